@@ -8,28 +8,171 @@ Features:
 - Record QC test results for batches
 - Manage Pilot Sites & Installations
 - Simple dashboard and JSON API endpoints for field reports
+- Dashboard counts kept in a summary table and served with ETag / 304 revalidation
+- LRU cache of rendered recipe, panel and site pages, invalidated by per-model version counters (stats in /metrics)
+- Keyset-paginated list pages and JSON listings (/api/recipes, /api/batches, /api/qc, /api/sites)
+- Full-text typeahead search over recipes, panel types, batches and sites (/api/search, SQLite FTS5); forms load choices lazily
+- Recall tracing from a QC test, batch or recipe to every affected installation and site (/api/trace/..., CSV)
+- Day / week / month rollups of QC strength and production per recipe and panel type (/api/trends, `flask rollups backfill`)
+- QC analytics per batch and recipe vs target strength (/api/analytics/batches, /api/analytics/recipes)
+- Nearby / bounding-box pilot site search backed by an R*Tree (/api/sites/nearby, /api/sites/bbox)
+- Bulk NDJSON / JSON-array upload of QC results (/api/report_qc/bulk)
+- Streaming CSV / Parquet exports of QC tests, batches and installations (/export/qc.csv, `flask export`)
+- Panel inventory ledger per batch and site (/api/inventory/..., `flask inventory rebuild|verify`)
+- Prometheus metrics at /metrics; opt-in slow-request sampling profiler (/debug/slow_requests)
+- gzip / brotli compression of API responses and request bodies; MessagePack via Accept / Content-Type: application/msgpack
+- Offline sync for the field app: catalog deltas by change version (/api/sync?since=) and idempotent uploads (/api/sync/upload)
+- INGEST_MODE=queue: report APIs answer 202 and a worker pool inserts from a durable queue (/api/reports/<id>, `flask ingest`)
+- PANELS_STORAGE_MODE=concurrent: SQLite WAL, busy timeout and group commit for bursts of field reports
+- PANELS_PARTITION_DIR: per-district SQLite databases chosen per request (X-District / ?district=); the dashboard
+  and /api/trends read all of them in parallel, exports one after another; analytics, inventory and /api/sync
+  need a district (`flask partitions create|list|sync-catalog`)
 
 To run:
 1. python3 -m venv venv
 2. source venv/bin/activate    (or venv\Scripts\activate on Windows)
-3. pip install flask sqlalchemy flask_sqlalchemy
+3. pip install flask sqlalchemy flask_sqlalchemy   (optional: numpy for /api/analytics, pyarrow for Parquet export,
+   brotli and msgpack for the compact API wire formats)
 4. python BambooPlasticPanelManager.py
 5. Open http://127.0.0.1:5000
 
+Benchmarks live in benchmarks/: run_suite.py times every route on synthetic data (seed_data.py)
+and checks for regressions against stored baselines; bench_*.py cover individual features.
+
 This is a prototype: replace with production-level auth, validation, and hosting for real deployment.
 """
 
-from flask import Flask, render_template_string, request, redirect, url_for, jsonify, flash
+from flask import Flask, Request, render_template, request, redirect, url_for, jsonify, flash, abort, g, has_app_context, has_request_context, session, stream_with_context
+from flask.cli import AppGroup
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from jinja2 import DictLoader
+from sqlalchemy import bindparam, create_engine, event, inspect as sa_inspect, select, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, StatementError
+from sqlalchemy.orm import Session, joinedload, object_session
+from sqlalchemy.pool import QueuePool
+from werkzeug.exceptions import BadRequest, HTTPException, RequestEntityTooLarge
+from werkzeug.wsgi import LimitedStream
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import base64
+import binascii
+import click
+import contextlib
+import csv
+import functools
+import heapq
+import importlib.util
+import io
+import json
+import math
 import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # only the /api/analytics endpoints need it
+    np = None
+try:
+    import brotli
+except ImportError:  # Accept-Encoding: br falls back to gzip
+    brotli = None
+try:
+    import msgpack
+except ImportError:  # API bodies stay JSON-only
+    msgpack = None
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///panels.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('PANELS_DATABASE_URI', 'sqlite:///panels.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['QC_BULK_CHUNK_SIZE'] = int(os.environ.get('QC_BULK_CHUNK_SIZE', 500))  # rows per executemany
+app.config['PAGE_SIZE'] = 50       # default rows per list page / API page
+app.config['PAGE_SIZE_MAX'] = 500
+app.config['EXPORT_CHUNK_ROWS'] = 5000  # rows fetched per cursor round trip / Parquet row group
+# Count SQL statements per request into X-SQL-Queries / X-SQL-Time-ms headers (always on in debug mode)
+app.config['SQL_QUERY_STATS'] = os.environ.get('SQL_QUERY_STATS', '') == '1'
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Keep the N slowest requests with sampled stacks at /debug/slow_requests (0 = profiler off)
+app.config['PROFILE_SLOW_REQUESTS'] = int(os.environ.get('PROFILE_SLOW_REQUESTS', 0))
+app.config['PROFILE_SAMPLE_INTERVAL_MS'] = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+app.config['PROFILE_STACK_DEPTH'] = 12
+# Seconds a worker trusts its cached dashboard version before re-reading it (other workers may have written)
+app.config['DASHBOARD_SUMMARY_TTL'] = float(os.environ.get('DASHBOARD_SUMMARY_TTL', 2.0))
+# 'default' keeps SQLite's stock journal; 'concurrent' is for multi-worker servers taking bursts of field
+# reports: WAL journal, busy timeout, a sized connection pool and group commit for /api/report_qc + /api/field_report
+app.config['PANELS_STORAGE_MODE'] = os.environ.get('PANELS_STORAGE_MODE', 'default')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['GROUP_COMMIT_MAX_BATCH'] = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 200))
+app.config['GROUP_COMMIT_MAX_WAIT_MS'] = float(os.environ.get('GROUP_COMMIT_MAX_WAIT_MS', 5))
+if app.config['PANELS_STORAGE_MODE'] == 'concurrent':
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'poolclass': QueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 8)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 16)),
+        'pool_timeout': 30,
+        'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0, 'check_same_thread': False},
+    }
+# Report ingestion for /api/report_qc + /api/field_report: 'sync' inserts inside the request,
+# 'queue' stores the payload, answers 202 with a report id and lets background workers insert in batches
+app.config['INGEST_MODE'] = os.environ.get('INGEST_MODE', 'sync')
+app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', 2))
+app.config['INGEST_BATCH_SIZE'] = int(os.environ.get('INGEST_BATCH_SIZE', 200))
+app.config['INGEST_MAX_ATTEMPTS'] = int(os.environ.get('INGEST_MAX_ATTEMPTS', 5))
+app.config['INGEST_POLL_INTERVAL'] = float(os.environ.get('INGEST_POLL_INTERVAL', 1.0))  # seconds between idle polls
+app.config['INGEST_CLAIM_TIMEOUT'] = 300  # seconds before a report stuck in 'processing' is claimed again
+# /api/ and /export/ responses are gzip/brotli-compressed when the client accepts it and the body is
+# at least COMPRESS_MIN_BYTES; compressed request bodies are inflated up to MAX_DECOMPRESSED_BYTES
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+app.config['COMPRESS_LEVEL'] = 6            # gzip
+app.config['COMPRESS_BROTLI_QUALITY'] = 5   # brotli; 5 compresses better than gzip -6 at similar CPU
+app.config['MAX_DECOMPRESSED_BYTES'] = 64 * 1024 * 1024
+# Rendered list/detail pages kept per worker (0 disables); RESPONSE_CACHE_SHARED_PATH adds a SQLite
+# file shared by the workers on one host
+app.config['RESPONSE_CACHE_ENTRIES'] = int(os.environ.get('RESPONSE_CACHE_ENTRIES', 256))
+app.config['RESPONSE_CACHE_SHARED_PATH'] = os.environ.get('RESPONSE_CACHE_SHARED_PATH', '')
+app.config['RESPONSE_CACHE_SHARED_ENTRIES'] = int(os.environ.get('RESPONSE_CACHE_SHARED_ENTRIES', 5000))
+# Load the QC analytics cache in the background when a worker starts instead of in the first analytics request
+app.config['ANALYTICS_WARM_ON_START'] = os.environ.get('ANALYTICS_WARM_ON_START', '1') == '1'
+app.config['ANALYTICS_CHUNK_ROWS'] = int(os.environ.get('ANALYTICS_CHUNK_ROWS', 65536))  # QC rows per stored column chunk
+app.config['SEARCH_PRELOAD'] = 20  # newest rows offered by a form's typeahead before anything is typed
+# Partitioned storage: a district given its own database in PARTITION_DIR (`flask partitions create`) keeps its
+# sites, batches, QC tests and installations there, so its writes never lock another district's file. Requests
+# pick a district with an X-District header or ?district=; anything else stays in SQLALCHEMY_DATABASE_URI.
+app.config['PARTITION_DIR'] = os.environ.get('PANELS_PARTITION_DIR', '')
+app.config['PARTITION_WORKERS'] = int(os.environ.get('PARTITION_WORKERS', 8))  # threads for cross-district reads
+app.config['CATALOG_RETRY_SECONDS'] = 5.0  # a district the catalog could not be copied to is retried this often
 app.secret_key = 'dev-secret'
 
-db = SQLAlchemy(app)
+def current_partition():
+    """District whose database this app context uses; None for the main database."""
+    return g.get('partition') if has_app_context() else None
+
+class PartitionedSQLAlchemy(SQLAlchemy):
+    """db.session, db.engine and db.create_all() use the current district's database (see PartitionRouter)."""
+
+    @property
+    def engines(self):
+        key = current_partition()
+        if key is None:
+            return super().engines
+        return {None: partitions.engine(key)}
+
+    @property
+    def main_engine(self):
+        return super().engines[None]
+
+db = PartitionedSQLAlchemy(app)
 
 # -----------------
 # Models
@@ -42,6 +185,9 @@ class Recipe(db.Model):
     additives = db.Column(db.String(250))
     notes = db.Column(db.String(500))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    row_version = db.Column(db.Integer, index=True)  # change version for /api/sync
+
+    __table_args__ = (db.Index('ix_recipe_created_at_id', 'created_at', 'id'),)
 
 class PanelType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -51,6 +197,7 @@ class PanelType(db.Model):
     thickness_m = db.Column(db.Float, default=0.12)
     target_strength_mpa = db.Column(db.Float, default=20.0)
     notes = db.Column(db.String(250))
+    row_version = db.Column(db.Integer, index=True)
 
 class Batch(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -59,19 +206,27 @@ class Batch(db.Model):
     quantity = db.Column(db.Integer, default=0)
     produced_on = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(50), default='produced')
+    row_version = db.Column(db.Integer, index=True)
+
+    __table_args__ = (db.Index('ix_batch_produced_on_id', 'produced_on', 'id'),
+                      db.Index('ix_batch_recipe_id', 'recipe_id', 'id'))
 
     recipe = db.relationship('Recipe')
     panel_type = db.relationship('PanelType')
 
 class QCTest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'))
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), index=True)
     compressive_mpa = db.Column(db.Float)
     flexural_mpa = db.Column(db.Float)
     water_absorption_percent = db.Column(db.Float)
     abrasion_loss_percent = db.Column(db.Float)
     tested_on = db.Column(db.DateTime, default=datetime.utcnow)
     notes = db.Column(db.String(500))
+    idempotency_key = db.Column(db.String(64))  # client-generated, so a retried upload is stored once
+
+    __table_args__ = (db.Index('ix_qc_test_tested_on_id', 'tested_on', 'id'),
+                      db.Index('ux_qc_test_idempotency_key', 'idempotency_key', unique=True))
 
     batch = db.relationship('Batch')
 
@@ -84,24 +239,1218 @@ class PilotSite(db.Model):
     longitude = db.Column(db.Float)
     slope_deg = db.Column(db.Float)
     notes = db.Column(db.String(500))
+    row_version = db.Column(db.Integer, index=True)
+
+    __table_args__ = (db.Index('ix_pilot_site_lat_lon', 'latitude', 'longitude'),)
 
 class Installation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    site_id = db.Column(db.Integer, db.ForeignKey('pilot_site.id'))
-    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'))
+    site_id = db.Column(db.Integer, db.ForeignKey('pilot_site.id'), index=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), index=True)
     panels_installed = db.Column(db.Integer, default=0)
     installed_on = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(50), default='installed')
+    idempotency_key = db.Column(db.String(64))
+
+    __table_args__ = (db.Index('ux_installation_idempotency_key', 'idempotency_key', unique=True),)
 
     site = db.relationship('PilotSite')
     batch = db.relationship('Batch')
 
+class SummaryCounter(db.Model):
+    """Running row counts for the dashboard, one row per table plus a 'version' row.
+    Maintained in the same transaction as the inserts (see the dashboard summary section)."""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BatchStock(db.Model):
+    """Inventory ledger: panels produced and installed per batch (in the yard = produced - installed)."""
+    batch_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    produced = db.Column(db.Integer, nullable=False, default=0)
+    installed = db.Column(db.Integer, nullable=False, default=0)
+
+class SiteStock(db.Model):
+    """Inventory ledger: panels laid per pilot site."""
+    site_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    installed = db.Column(db.Integer, nullable=False, default=0)
+    installations = db.Column(db.Integer, nullable=False, default=0)
+
+class QCRollup(db.Model):
+    """QC result sums per period and recipe / panel type (0 = unknown), for trend charts without scanning qc_test.
+    Means and standard deviations are derived from the counts, sums and sums of squares."""
+    grain = db.Column(db.String(5), primary_key=True)    # day / week / month
+    period_start = db.Column(db.Date, primary_key=True)  # weeks start on Monday
+    recipe_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    panel_type_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    tests = db.Column(db.Integer, nullable=False, default=0)
+    comp_n = db.Column(db.Integer, nullable=False, default=0)
+    comp_sum = db.Column(db.Float, nullable=False, default=0.0)
+    comp_sumsq = db.Column(db.Float, nullable=False, default=0.0)
+    flex_n = db.Column(db.Integer, nullable=False, default=0)
+    flex_sum = db.Column(db.Float, nullable=False, default=0.0)
+    flex_sumsq = db.Column(db.Float, nullable=False, default=0.0)
+
+class ProductionRollup(db.Model):
+    """Batches and panels produced per period and recipe / panel type."""
+    grain = db.Column(db.String(5), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    recipe_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    panel_type_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    batches = db.Column(db.Integer, nullable=False, default=0)
+    panels = db.Column(db.Integer, nullable=False, default=0)
+
+class QCColumnChunk(db.Model):
+    """qc_test rows after_id < id <= upto_id packed as float64 columns, so a cold analytics load reads a few
+    blobs instead of every row. Chunks form a contiguous prefix of qc_test; changing an old row drops them."""
+    id = db.Column(db.Integer, primary_key=True)
+    after_id = db.Column(db.Integer, nullable=False, unique=True)
+    upto_id = db.Column(db.Integer, nullable=False)
+    rows = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+class BatchSiteTrace(db.Model):
+    """Traceability index: panels each site received from each batch, with the batch's recipe and panel type
+    copied in, so recall queries by batch or recipe never scan installation."""
+    batch_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    site_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    recipe_id = db.Column(db.Integer)
+    panel_type_id = db.Column(db.Integer)
+    panels = db.Column(db.Integer, nullable=False, default=0)
+    installations = db.Column(db.Integer, nullable=False, default=0)
+    first_installed_on = db.Column(db.DateTime)
+    last_installed_on = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_batch_site_trace_recipe_site', 'recipe_id', 'site_id'),)
+
+class ModelVersion(db.Model):
+    """Change counter per table, bumped by every ORM write to it; keys the response cache."""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False)
+
+class SyncVersion(db.Model):
+    """Single-row change counter; every catalog write takes the next value as its row_version."""
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class IngestReport(db.Model):
+    """Durable queue of accepted report payloads (INGEST_MODE=queue), drained by the ingest workers."""
+    __tablename__ = 'ingest_queue'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'qc' or 'field'
+    payload = db.Column(db.Text, nullable=False)     # request JSON as received
+    state = db.Column(db.String(20), nullable=False, default='queued')  # queued / processing / done / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    result_id = db.Column(db.Integer)                # QCTest / Installation id once done
+    error = db.Column(db.String(500))
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_ingest_queue_state_next', 'state', 'next_attempt_at'),)
+
 # -----------------
 # Initialize DB
 # -----------------
+def _ensure_columns():
+    """Add columns that older databases lack; create_all() never alters existing tables. New columns are nullable."""
+    inspector = sa_inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.exec_driver_sql('ALTER TABLE %s ADD COLUMN %s %s' % (
+                        table.name, column.name, column.type.compile(db.engine.dialect)))
+
 @app.before_first_request
 def create_tables():
     db.create_all()
+    _ensure_columns()
+    # create_all() skips tables that already exist, so indexes added to older databases are created here
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    init_summary()
+    init_site_spatial_index()
+    init_search_index()
+    init_inventory()
+    init_sync_versions()
+    init_model_versions()
+    init_rollups()
+    init_trace()
+
+_background_jobs = []
+_background_started = False
+_background_lock = threading.Lock()
+
+def background_job(fn):
+    """Register fn to start this process's background threads; run once, just before the first request."""
+    _background_jobs.append(fn)
+    return fn
+
+@app.before_request
+def _start_background_jobs():
+    # started lazily rather than at import, so a server that forks its workers starts threads in each worker
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+        for fn in _background_jobs:
+            fn()
+
+# -----------------
+# Per-request SQL accounting (debug aid; lets tests pin the number of queries a page issues)
+# -----------------
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_timer_start(conn, cursor, statement, parameters, context, executemany):
+    # kept on the statement's execution context, so a statement that raises leaves nothing behind
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_timer_stop(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if app.config['METRICS_ENABLED']:
+        db_statement_latency.observe(elapsed)
+    if has_request_context() and 'sql_stats' in g:
+        g.sql_stats['count'] += 1
+        g.sql_stats['seconds'] += elapsed
+
+@app.before_request
+def _start_sql_stats():
+    if app.debug or app.config['SQL_QUERY_STATS'] or app.config['METRICS_ENABLED']:
+        g.sql_stats = {'count': 0, 'seconds': 0.0}
+
+@app.after_request
+def _report_sql_stats(response):
+    stats = g.get('sql_stats')
+    if stats is not None and (app.debug or app.config['SQL_QUERY_STATS']):
+        response.headers['X-SQL-Queries'] = str(stats['count'])
+        response.headers['X-SQL-Time-ms'] = '%.2f' % (stats['seconds'] * 1000)
+    return response
+
+# -----------------
+# Metrics: Prometheus text exposition at /metrics (per worker process)
+# -----------------
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Metric:
+    """Counter, gauge or histogram with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, kind, name, help, labels=(), buckets=None):
+        self.kind, self.name, self.help, self.labels, self.buckets = kind, name, help, labels, buckets
+        self.lock = threading.Lock()
+        self.values = {}
+        metrics_registry.append(self)
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1      # count (+Inf bucket)
+            counts[-1] += value  # sum
+
+    def _labels(self, label_values, extra=None):
+        pairs = list(zip(self.labels, label_values)) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+        with self.lock:
+            items = sorted(self.values.items(), key=lambda kv: [str(v) for v in kv[0]])
+        for label_values, value in items:
+            if self.kind != 'histogram':
+                lines.append('%s%s %s' % (self.name, self._labels(label_values), repr(float(value))))
+                continue
+            for bound, count in zip(self.buckets, value):
+                lines.append('%s_bucket%s %d' % (self.name, self._labels(label_values, ('le', repr(float(bound)))), count))
+            lines.append('%s_bucket%s %d' % (self.name, self._labels(label_values, ('le', '+Inf')), value[-2]))
+            lines.append('%s_sum%s %s' % (self.name, self._labels(label_values), repr(value[-1])))
+            lines.append('%s_count%s %d' % (self.name, self._labels(label_values), value[-2]))
+        return lines
+
+metrics_registry = []
+http_requests = Metric('counter', 'panels_http_requests_total', 'HTTP requests by endpoint, method and status.',
+                       ('endpoint', 'method', 'status'))
+http_latency = Metric('histogram', 'panels_http_request_duration_seconds', 'Time to produce the response.',
+                      ('endpoint', 'method'), LATENCY_BUCKETS)
+http_in_flight = Metric('gauge', 'panels_http_requests_in_flight', 'Requests currently being handled.')
+http_response_size = Metric('histogram', 'panels_http_response_size_bytes', 'Response body size (non-streamed responses).',
+                            ('endpoint',), SIZE_BUCKETS)
+db_statements = Metric('counter', 'panels_db_statements_total', 'SQL statements executed, by endpoint.', ('endpoint',))
+db_statements_per_request = Metric('histogram', 'panels_db_statements_per_request', 'SQL statements per request.',
+                                   ('endpoint',), COUNT_BUCKETS)
+db_statement_latency = Metric('histogram', 'panels_db_statement_duration_seconds', 'SQL statement execution time.',
+                              (), LATENCY_BUCKETS)
+db_commit_latency = Metric('histogram', 'panels_db_commit_duration_seconds', 'Session commit time (flush + COMMIT).',
+                           (), LATENCY_BUCKETS)
+
+@event.listens_for(Session, 'before_commit')
+def _commit_timer_start(db_session):
+    db_session.info['commit_start'] = time.perf_counter()
+
+@event.listens_for(Session, 'after_commit')
+def _commit_timer_stop(db_session):
+    start = db_session.info.pop('commit_start', None)
+    if start is not None:
+        db_commit_latency.observe(time.perf_counter() - start)
+
+@app.before_request
+def _start_request_metrics():
+    if app.config['METRICS_ENABLED']:
+        g.request_start = time.perf_counter()
+        http_in_flight.inc(1)
+        if app.config['PROFILE_SLOW_REQUESTS']:
+            request_profiler.start_request()
+
+@app.after_request
+def _record_response_metrics(response):
+    if 'request_start' in g and not response.is_streamed:
+        http_response_size.observe(response.calculate_content_length() or 0, request.endpoint or 'unknown')
+    return response
+
+@app.teardown_request
+def _finish_request_metrics(exc):
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or 'unknown'
+    http_in_flight.inc(-1)
+    http_latency.observe(elapsed, endpoint, request.method)
+    status = 500 if exc is not None else g.pop('response_status', 0)
+    http_requests.inc(1, endpoint, request.method, str(status))
+    stats = g.get('sql_stats')
+    if stats is not None:
+        db_statements.inc(stats['count'], endpoint)
+        db_statements_per_request.observe(stats['count'], endpoint)
+    if app.config['PROFILE_SLOW_REQUESTS']:
+        request_profiler.finish_request(elapsed, '%s %s' % (request.method, request.full_path.rstrip('?')))
+
+@app.after_request
+def _remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.route('/metrics')
+def metrics():
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# -----------------
+# Opt-in sampling profiler: keeps the slowest PROFILE_SLOW_REQUESTS requests with their hottest stacks
+# -----------------
+class RequestProfiler:
+    """Samples the stacks of in-flight request threads every PROFILE_SAMPLE_INTERVAL_MS.
+
+    Each request records how often every distinct stack was seen. When the request
+    ends, it is kept if it is among the N slowest so far, where N is
+    PROFILE_SLOW_REQUESTS. The report is served at /debug/slow_requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {}   # thread id -> {stack: samples}
+        self.slowest = []  # min-heap of (seconds, seq, report)
+        self.seq = 0
+        self.thread = None
+
+    def start_request(self):
+        with self.lock:
+            self.active[threading.get_ident()] = {}
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._sample_forever, name='request-profiler', daemon=True)
+                self.thread.start()
+
+    def finish_request(self, seconds, label):
+        with self.lock:
+            stacks = self.active.pop(threading.get_ident(), {})
+            top = sorted(stacks.items(), key=lambda kv: -kv[1])[:5]
+            report = {'request': label, 'seconds': round(seconds, 4), 'samples': sum(stacks.values()),
+                      'stacks': [{'samples': n, 'stack': list(stack)} for stack, n in top]}
+            self.seq += 1
+            heapq.heappush(self.slowest, (seconds, self.seq, report))
+            while len(self.slowest) > app.config['PROFILE_SLOW_REQUESTS']:
+                heapq.heappop(self.slowest)
+
+    def report(self):
+        with self.lock:
+            return [r for _, _, r in sorted(self.slowest, reverse=True)]
+
+    def _sample_forever(self):
+        while True:
+            time.sleep(app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000.0)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, stacks in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    stack = tuple('%s:%d %s' % (f.filename, f.lineno, f.name)
+                                  for f in traceback.extract_stack(frame)[-app.config['PROFILE_STACK_DEPTH']:])
+                    stacks[stack] = stacks.get(stack, 0) + 1
+
+request_profiler = RequestProfiler()
+
+@app.route('/debug/slow_requests')
+def debug_slow_requests():
+    if not app.config['PROFILE_SLOW_REQUESTS']:
+        abort(404)
+    return jsonify({'status':'ok','items':request_profiler.report()})
+
+# -----------------
+# Wire formats for the field/mobile API: compression and MessagePack
+# -----------------
+COMPRESS_PATH_PREFIXES = ('/api/', '/export/')
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/msgpack', 'application/x-ndjson')
+
+def _compressor(encoding):
+    """(compress(bytes) -> bytes, finish() -> bytes) for a response Content-Encoding."""
+    if encoding == 'br':
+        c = brotli.Compressor(quality=app.config['COMPRESS_BROTLI_QUALITY'])
+        return c.process, c.finish
+    c = zlib.compressobj(app.config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)  # wbits 31: gzip container
+    return c.compress, c.flush
+
+def _compress_chunks(chunks, encoding):
+    compress, finish = _compressor(encoding)
+    for chunk in chunks:
+        out = compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if out:
+            yield out
+    yield finish()
+
+@app.after_request
+def _compress_response(response):
+    """Compress /api/ and /export/ bodies for clients that send Accept-Encoding: br or gzip.
+    Bodies under COMPRESS_MIN_BYTES are sent as-is; streamed bodies are compressed chunk by chunk."""
+    if not request.path.startswith(COMPRESS_PATH_PREFIXES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or 'Content-Encoding' in response.headers or response.status_code in (204, 304)
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+        return response
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+    if not encoding:
+        return response
+    if response.is_streamed:
+        response.response = _compress_chunks(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_BYTES']:
+            return response
+        compress, finish = _compressor(encoding)
+        response.set_data(compress(data) + finish())
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)  # same entity, different bytes
+    return response
+
+class _DecompressingReader(io.RawIOBase):
+    """File-like view of a gzip/brotli request body that inflates as it is read, up to MAX_DECOMPRESSED_BYTES."""
+
+    def __init__(self, raw, encoding, limit):
+        self.raw, self.encoding, self.limit = raw, encoding, limit
+        self.decompressor = brotli.Decompressor() if encoding == 'br' else zlib.decompressobj(47)  # 47: gzip or zlib
+        self.pending, self.total, self.eof = b'', 0, False
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        chunk = self.raw.read(16384)
+        try:
+            if not chunk:
+                self.eof = True
+                if self.encoding == 'br':
+                    if not self.decompressor.is_finished():
+                        raise ValueError('truncated brotli stream')
+                    return b''
+                return self.decompressor.flush()
+            return self.decompressor.process(chunk) if self.encoding == 'br' else self.decompressor.decompress(chunk)
+        except Exception as e:
+            raise BadRequest('could not decode %s request body: %s' % (self.encoding, e))
+
+    def readinto(self, buffer):
+        while not self.pending and not self.eof:
+            self.pending = self._fill()
+            self.total += len(self.pending)
+            if self.total > self.limit:
+                raise RequestEntityTooLarge()
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+class DecompressRequestMiddleware:
+    """WSGI middleware that decodes Content-Encoding: gzip / br request bodies before Flask sees them.
+    The body is inflated while the view reads it, so streamed uploads (/api/report_qc/bulk) stay streamed."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding in ('', 'identity'):
+            return self.wsgi_app(environ, start_response)
+        if encoding not in ('gzip', 'br') or (encoding == 'br' and brotli is None):
+            response = app.response_class('unsupported Content-Encoding: %s\n' % encoding, 415, mimetype='text/plain')
+            return response(environ, start_response)
+        raw = environ['wsgi.input']
+        if environ.get('CONTENT_LENGTH'):
+            raw = LimitedStream(raw, int(environ['CONTENT_LENGTH']))
+        environ['wsgi.input'] = io.BufferedReader(_DecompressingReader(raw, encoding, app.config['MAX_DECOMPRESSED_BYTES']))
+        environ['wsgi.input_terminated'] = True  # decoded length is unknown: read to EOF
+        environ.pop('CONTENT_LENGTH', None)
+        environ.pop('HTTP_CONTENT_ENCODING')
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = DecompressRequestMiddleware(app.wsgi_app)
+
+def _wants_msgpack():
+    accept = request.accept_mimetypes
+    return msgpack is not None and accept['application/msgpack'] > accept['application/json']
+
+class ApiJSONProvider(DefaultJSONProvider):
+    """jsonify() that answers Accept: application/msgpack with a MessagePack body of the same data."""
+
+    def response(self, *args, **kwargs):
+        if not has_request_context() or not _wants_msgpack():
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(msgpack.packb(obj, default=self.default), mimetype='application/msgpack')
+
+class ApiRequest(Request):
+    """Request whose get_json() / .json also accept Content-Type: application/msgpack bodies."""
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if self.mimetype != 'application/msgpack' or msgpack is None:
+            return super().get_json(force=force, silent=silent, cache=cache)
+        try:
+            return msgpack.unpackb(self.get_data(cache=cache), raw=False)
+        except Exception:
+            if silent:
+                return None
+            raise BadRequest('invalid MessagePack body')
+
+app.json = ApiJSONProvider(app)
+app.request_class = ApiRequest
+
+# -----------------
+# Storage mode: SQLite pragmas and group commit for report APIs
+# -----------------
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_conn, connection_record):
+    if not isinstance(dbapi_conn, sqlite3.Connection) or app.config['PANELS_STORAGE_MODE'] != 'concurrent':
+        return
+    cursor = dbapi_conn.cursor()
+    # WAL lets readers run alongside the single writer; NORMAL only fsyncs at checkpoints in WAL mode
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=%s' % app.config['SQLITE_SYNCHRONOUS'])
+    cursor.execute('PRAGMA busy_timeout=%d' % app.config['SQLITE_BUSY_TIMEOUT_MS'])
+    cursor.close()
+
+class GroupCommitWriter:
+    """Background thread that inserts rows submitted by concurrent requests in shared transactions.
+
+    Each request calls submit(Model, values) and waits on the returned future. The
+    thread takes whatever has queued up, up to GROUP_COMMIT_MAX_BATCH rows or
+    GROUP_COMMIT_MAX_WAIT_MS after the first one. It adds them all through the ORM,
+    so the usual flush hooks still run, and commits once: one fsync and one
+    lock acquisition for the whole group. If the group fails, its rows are
+    retried one by one so a bad row only fails its own request.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, model, values):
+        future = Future()
+        self.queue.put((current_partition(), model, values, future))
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self.thread.start()
+        return future
+
+    def _take_group(self):
+        group = [self.queue.get()]
+        deadline = time.monotonic() + app.config['GROUP_COMMIT_MAX_WAIT_MS'] / 1000.0
+        while len(group) < app.config['GROUP_COMMIT_MAX_BATCH']:
+            remaining = deadline - time.monotonic()
+            try:
+                group.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    def _run(self):
+        while True:
+            by_partition = {}
+            for key, model, values, future in self._take_group():
+                by_partition.setdefault(key, []).append((model, values, future))
+            for key, group in by_partition.items():
+                self._commit_group(key, group)
+
+    def _commit_group(self, key, group):
+        with partition_context(key):
+            try:
+                objs = [model(**values) for model, values, _ in group]
+                db.session.add_all(objs)
+                db.session.commit()
+                for obj, (_, _, future) in zip(objs, group):
+                    future.set_result(obj.id)
+            except Exception:
+                db.session.rollback()
+                for model, values, future in group:
+                    self._insert_one(model, values, future)
+
+    @staticmethod
+    def _insert_one(model, values, future):
+        try:
+            obj = model(**values)
+            db.session.add(obj)
+            db.session.commit()
+            future.set_result(obj.id)
+        except Exception as e:
+            db.session.rollback()
+            future.set_exception(e)
+
+group_writer = GroupCommitWriter()
+
+def insert_report(model, values):
+    """Insert one row for a report API and return its id.
+    In 'concurrent' storage mode the row goes through the group-commit writer."""
+    if app.config['PANELS_STORAGE_MODE'] == 'concurrent':
+        return group_writer.submit(model, values).result(timeout=app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0 + 30)
+    obj = model(**values)
+    db.session.add(obj)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return obj.id
+
+def _ids_by_key(model, keys):
+    """{idempotency_key: id} for the keys that already have a row."""
+    keys = [k for k in keys if k]
+    if not keys:
+        return {}
+    return dict(db.session.query(model.idempotency_key, model.id).filter(model.idempotency_key.in_(keys)))
+
+def insert_report_once(model, values):
+    """insert_report() that returns (id, duplicate): a row whose idempotency_key is already
+    stored is not inserted again, and the original row's id is returned instead."""
+    key = values.get('idempotency_key')
+    existing = _ids_by_key(model, [key]).get(key)
+    if existing is not None:
+        return existing, True
+    try:
+        return insert_report(model, values), False
+    except IntegrityError:
+        # lost the race with a concurrent retry of the same report
+        existing = _ids_by_key(model, [key]).get(key)
+        if existing is None:
+            raise
+        return existing, True
+
+def insert_reports_once(model, rows):
+    """Insert many keyed rows in one transaction; returns [(id, duplicate)] in order."""
+    existing = _ids_by_key(model, [r.get('idempotency_key') for r in rows])
+    new = {}
+    for values in rows:
+        key = values.get('idempotency_key')
+        if key not in existing and key not in new:
+            new[key] = model(**values)
+    if new:
+        db.session.add_all(new.values())
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return [insert_report_once(model, values) for values in rows]
+    out, seen = [], set()
+    for values in rows:
+        key = values.get('idempotency_key')
+        if key in existing or key in seen:
+            out.append((existing.get(key) or new[key].id, True))
+        else:
+            seen.add(key)
+            out.append((new[key].id, False))
+    return out
+
+# -----------------
+# Report ingestion queue (INGEST_MODE=queue)
+# -----------------
+def _qc_report_values(data, received_at):
+    return dict(batch_id=data.get('batch_id'), compressive_mpa=data.get('compressive_mpa'),
+                flexural_mpa=data.get('flexural_mpa'), water_absorption_percent=data.get('water_absorption_percent'),
+                abrasion_loss_percent=data.get('abrasion_loss_percent'), notes=data.get('notes',''), tested_on=received_at,
+                idempotency_key=data.get('idempotency_key'))
+
+def _field_report_values(data, received_at):
+    return dict(site_id=data.get('site_id'), batch_id=data.get('batch_id'), panels_installed=data.get('installed_panels',0),
+                installed_on=received_at, status='reported', idempotency_key=data.get('idempotency_key'))
+
+def _report_number(data, name, python_type, required=False):
+    """data[name] as `python_type` (numeric strings accepted), None if absent; ValueError otherwise."""
+    value = data.get(name)
+    if value is None or value == '':
+        if required:
+            raise ValueError('%s required' % name)
+        return None
+    if isinstance(value, bool):
+        raise ValueError('%s must be a number' % name)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('%s must be a number' % name)
+    if python_type is int:
+        if number != int(number):
+            raise ValueError('%s must be an integer' % name)
+        return int(number)
+    return number
+
+def _validate_qc_report(data):
+    data = dict(data, batch_id=_report_number(data, 'batch_id', int, required=True))
+    for name in ('compressive_mpa', 'flexural_mpa', 'water_absorption_percent', 'abrasion_loss_percent'):
+        data[name] = _report_number(data, name, float)
+    if data.get('notes') is not None and not isinstance(data['notes'], str):
+        raise ValueError('notes must be a string')
+    return data
+
+def _validate_field_report(data):
+    data = dict(data, site_id=_report_number(data, 'site_id', int, required=True),
+                batch_id=_report_number(data, 'batch_id', int, required=True))
+    # the ledger and the over-draw check do arithmetic on it, so "5" is taken as 5 here
+    data['installed_panels'] = _report_number(data, 'installed_panels', int) or 0
+    return data
+
+def validate_report(kind, data):
+    """Report JSON with its fields checked and converted to the column types; raises ValueError.
+    Done before a report is stored or queued, so a bad payload is refused with 400 instead of retried."""
+    if not isinstance(data, dict):
+        raise ValueError('report must be a JSON object')
+    return REPORT_VALIDATORS[kind](data)
+
+REPORT_VALIDATORS = {'qc': _validate_qc_report, 'field': _validate_field_report}
+
+# kind -> (model, function building its column values from the request JSON)
+REPORT_KINDS = {'qc': (QCTest, _qc_report_values), 'field': (Installation, _field_report_values)}
+
+ingest_reports = Metric('counter', 'panels_ingest_reports_total', 'Queued reports handled by the ingest workers, by outcome.',
+                        ('kind', 'outcome'))
+
+def enqueue_report(kind, data):
+    """Store a report payload durably and return its report id; the ingest workers insert it later."""
+    report_id = insert_report(IngestReport, dict(kind=kind, payload=json.dumps(data)))
+    ingest_workers.start()
+    return report_id
+
+def _claim_reports(limit):
+    """Mark up to `limit` due reports as ours with a single UPDATE, so concurrent workers never share one."""
+    token = os.urandom(8).hex()
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=app.config['INGEST_CLAIM_TIMEOUT'])
+    due = select(IngestReport.id).where(
+        ((IngestReport.state == 'queued') & (IngestReport.next_attempt_at <= now)) |
+        ((IngestReport.state == 'processing') & (IngestReport.claimed_at < stale))
+    ).order_by(IngestReport.id).limit(limit)
+    IngestReport.query.filter(IngestReport.id.in_(due.scalar_subquery())).update(
+        {'state': 'processing', 'claimed_by': token, 'claimed_at': now}, synchronize_session=False)
+    db.session.commit()
+    return IngestReport.query.filter_by(claimed_by=token, state='processing').order_by(IngestReport.id).all()
+
+def _apply_reports(reports):
+    """Insert the rows for `reports` and mark them done in one transaction."""
+    parsed = []
+    for report in reports:
+        model, values = REPORT_KINDS[report.kind]
+        parsed.append((model, values(json.loads(report.payload), report.received_at)))
+    stored = {model: _ids_by_key(model, [row['idempotency_key'] for m, row in parsed if m is model])
+              for model, _ in REPORT_KINDS.values()}
+    # each report's row: a new object, or the id already stored under its idempotency key
+    targets, new = [], {}
+    for model, row in parsed:
+        key = row['idempotency_key']
+        if key in stored[model]:
+            targets.append(stored[model][key])
+        elif key and (model, key) in new:
+            targets.append(new[(model, key)])
+        else:
+            obj = model(**row)
+            db.session.add(obj)
+            targets.append(obj)
+            if key:
+                new[(model, key)] = obj
+    db.session.flush()
+    now = datetime.utcnow()
+    for report, target in zip(reports, targets):
+        report.result_id = target if isinstance(target, int) else target.id
+        report.state, report.processed_at, report.error = 'done', now, None
+        report.attempts += 1
+    db.session.commit()
+    if app.config['METRICS_ENABLED']:
+        for report in reports:
+            ingest_reports.inc(1, report.kind, 'done')
+
+def _is_permanent(error):
+    """True for errors a retry cannot fix (the payload does not fit the tables), as opposed to a locked database."""
+    if isinstance(error, OperationalError):
+        return False
+    return isinstance(error, (ValueError, TypeError, KeyError, StatementError))
+
+def _reschedule(report, error):
+    """Record a failed attempt: retry later with exponential backoff, or give up after INGEST_MAX_ATTEMPTS
+    (at once for a payload that can never be inserted)."""
+    report.attempts += 1
+    report.error = str(error)[:500]
+    if report.attempts >= app.config['INGEST_MAX_ATTEMPTS'] or _is_permanent(error):
+        report.state, report.processed_at = 'failed', datetime.utcnow()
+    else:
+        report.state = 'queued'
+        report.next_attempt_at = datetime.utcnow() + timedelta(seconds=2 ** report.attempts)
+    db.session.commit()
+    if app.config['METRICS_ENABLED']:
+        ingest_reports.inc(1, report.kind, 'failed' if report.state == 'failed' else 'retry')
+
+def drain_once(limit=None):
+    """Claim and apply one batch of due reports; returns how many were claimed."""
+    reports = _claim_reports(limit or app.config['INGEST_BATCH_SIZE'])
+    if not reports:
+        return 0
+    try:
+        _apply_reports(reports)
+    except Exception:
+        db.session.rollback()
+        # find the bad report(s) so the rest of the batch still goes in
+        for report in reports:
+            try:
+                _apply_reports([report])
+            except Exception as e:
+                db.session.rollback()
+                _reschedule(report, e)
+    return len(reports)
+
+class IngestWorkerPool:
+    """INGEST_WORKERS threads that move queued reports into QCTest / Installation.
+
+    Each worker claims a batch of due reports, inserts them through the ORM (so the
+    summary and inventory hooks run) and marks them done in the same transaction, so
+    a report is applied exactly once. Reports left 'processing' by a process that died
+    are claimed again after INGEST_CLAIM_TIMEOUT.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        with self.lock:
+            self.threads = [t for t in self.threads if t.is_alive()]
+            while len(self.threads) < app.config['INGEST_WORKERS']:
+                thread = threading.Thread(target=self._run, name='ingest-worker', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            claimed = 0
+            try:
+                for key in [None] + partitions.keys():
+                    with partition_context(key):
+                        claimed += drain_once()
+            except Exception:
+                app.logger.exception('ingest worker error')
+                claimed = 0
+            if not claimed:
+                # idle: poll rather than wake per report, so a burst is applied in a few large batches
+                time.sleep(app.config['INGEST_POLL_INTERVAL'])
+
+ingest_workers = IngestWorkerPool()
+
+@background_job
+def start_ingest_workers():
+    # picks up reports queued before a restart
+    if app.config['INGEST_MODE'] == 'queue':
+        ingest_workers.start()
+
+def _accepted(report_id, **extra):
+    # the report is queued in the district's database, so its status URL has to route back there
+    district = {'district': current_partition()} if current_partition() else {}
+    return jsonify(dict({'status':'accepted','report_id':report_id,
+                         'status_url':url_for('api_report_status', id=report_id, **district)}, **extra)), 202
+
+@app.route('/api/reports/<int:id>')
+def api_report_status(id):
+    """Processing state of a queued report: queued, processing, done (with result_id) or failed (with error)."""
+    report = db.session.get(IngestReport, id) or abort(404)
+    data = {k: v for k, v in model_to_dict(report).items() if k not in ('payload', 'claimed_by')}
+    return jsonify(dict(data, status='ok'))
+
+ingest_cli = AppGroup('ingest', help='Inspect and drain the report ingestion queue.')
+
+@ingest_cli.command('drain')
+def ingest_drain_command():
+    """Apply every due report in this process, then exit."""
+    create_tables()
+    total = 0
+    while True:
+        claimed = drain_once()
+        if not claimed:
+            break
+        total += claimed
+    click.echo('%d reports processed' % total)
+
+@ingest_cli.command('retry-failed')
+def ingest_retry_command():
+    """Queue reports that ran out of attempts again."""
+    create_tables()
+    count = IngestReport.query.filter_by(state='failed').update(
+        {'state': 'queued', 'attempts': 0, 'next_attempt_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    click.echo('%d reports queued again' % count)
+
+@ingest_cli.command('status')
+def ingest_status_command():
+    """Number of reports in each state."""
+    create_tables()
+    for state, count in db.session.query(IngestReport.state, db.func.count()).group_by(IngestReport.state).order_by(IngestReport.state):
+        click.echo('%-10s %d' % (state, count))
+
+app.cli.add_command(ingest_cli)
+
+# -----------------
+# Partitioned storage: one SQLite database per district (PARTITION_DIR)
+# -----------------
+# Recipes and panel types are edited in the main database and copied into every district database
+CATALOG_MODELS = [Recipe, PanelType]
+CENTRAL_ENDPOINTS = {'new_recipe', 'new_panel'}
+
+def partition_key(district):
+    """File name for a district's database: 'West Singhbhum' -> 'west_singhbhum'."""
+    return re.sub(r'[^a-z0-9]+', '_', (district or '').strip().lower()).strip('_')
+
+@contextlib.contextmanager
+def partition_context(key):
+    """App context whose db.session and db.engine use district `key`'s database (None: the main one)."""
+    with app.app_context():
+        g.partition = key
+        yield
+
+class PartitionRouter:
+    """Engines for the district databases in PARTITION_DIR, and a thread pool for reads that span them.
+
+    A district database holds the full schema, so every model, flush hook and route works
+    unchanged inside it; db.engines hands the session the engine of the request's district.
+    A database is opened on first use: missing tables are created and the catalog is copied
+    from the main database.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.engines = {}
+        self.opening = {}
+        self.executor = None
+
+    def path(self, key):
+        return os.path.join(os.path.abspath(app.config['PARTITION_DIR']), key + '.db')
+
+    def keys(self):
+        """Districts that have a database file, including ones created by other processes."""
+        directory = app.config['PARTITION_DIR']
+        if not directory or not os.path.isdir(directory):
+            return []
+        return sorted(name[:-3] for name in os.listdir(directory) if name.endswith('.db'))
+
+    def exists(self, key):
+        return key in self.engines or os.path.exists(self.path(key))
+
+    def spans(self):
+        """True when partitioning is on and no district was chosen (a district without its own
+        database binds the context to the main database)."""
+        return bool(app.config['PARTITION_DIR']) and current_partition() is None and not g.get('district')
+
+    def engine(self, key):
+        engine = self.engines.get(key)
+        if engine is not None:
+            return engine
+        with self.lock:
+            if key in self.engines:
+                return self.engines[key]
+            if key in self.opening:  # create_tables() below, routed back here by db.engines
+                return self.opening[key]
+            os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+            engine = create_engine('sqlite:///' + self.path(key), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+            self.opening[key] = engine
+            try:
+                with partition_context(key):
+                    create_tables()
+                sync_catalog([key])
+            finally:
+                del self.opening[key]
+            self.engines[key] = engine
+            return engine
+
+    def fan_out(self, fn, keys=None):
+        """Call fn() in the main database and every district database in parallel; results in key order."""
+        keys = [None] + self.keys() if keys is None else keys
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(app.config['PARTITION_WORKERS'], thread_name_prefix='partition')
+        futures = [self.executor.submit(self._call_in, key, fn) for key in keys]
+        return [f.result() for f in futures]
+
+    @staticmethod
+    def _call_in(key, fn):
+        with partition_context(key):
+            return fn()
+
+partitions = PartitionRouter()
+
+@app.before_request
+def _route_partition():
+    """Bind the request to a district database: the X-District header, ?district= (remembered when picked
+    on the dashboard) or the session; a new site goes to its own district. Districts without a
+    database, and the catalog forms, use the main database."""
+    if not app.config['PARTITION_DIR'] or request.endpoint in CENTRAL_ENDPOINTS:
+        return
+    district = request.headers.get('X-District', request.args.get('district'))
+    if request.endpoint == 'dashboard' and 'district' in request.args:
+        session['district'] = request.args['district']
+    if district is None:
+        district = session.get('district')
+    if request.endpoint == 'new_site' and request.method == 'POST':
+        district = request.form.get('district')
+    key = partition_key(district)
+    if key and partitions.exists(key):
+        db.session.remove()  # a session opened before routing (create_tables) is bound to the main database
+        g.partition = key
+    elif key:
+        g.district = key
+
+def single_database(view):
+    """For views whose ids and versions only mean something within one database: when no district
+    was chosen, answer 400 rather than silently reading the main database alone."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if partitions.spans():
+            return jsonify({'status':'error','message':'choose a district with the X-District header or ?district=; '
+                            'this endpoint reads one database'}), 400
+        return view(*args, **kwargs)
+    return wrapper
+
+def _same_row(have, row):
+    return have is not None and all(have[c] == v for c, v in row.items() if c != 'row_version')
+
+def sync_catalog(keys=None, ids=None):
+    """Copy recipes and panel types from the main database into district databases, keeping their ids.
+    `ids` ({table name: ids}) limits the copy to those rows; by default the whole catalog is compared.
+    Changed rows get the district's next sync version, and its page cache and dashboard counts are updated."""
+    def rows_of(table):
+        return select(table) if ids is None else select(table).where(table.c.id.in_(ids[table.name]))
+    tables = [m.__table__ for m in CATALOG_MODELS if ids is None or ids.get(m.__table__.name)]
+    with db.main_engine.connect() as conn:
+        catalog = [(table, conn.execute(rows_of(table)).mappings().all()) for table in tables]
+    versions, counters = ModelVersion.__table__, SummaryCounter.__table__
+    for key in partitions.keys() if keys is None else keys:
+        with partitions.engine(key).begin() as conn:
+            for table, rows in catalog:
+                have = {r['id']: r for r in conn.execute(rows_of(table)).mappings()}
+                stale = [dict(r) for r in rows if not _same_row(have.get(r['id']), r)]
+                if not stale:
+                    continue
+                version = _next_sync_version(conn)
+                stmt = sqlite_insert(table)
+                stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={
+                    c.name: stmt.excluded[c.name] for c in table.columns if c.name != 'id'})
+                conn.execute(stmt, [dict(r, row_version=version) for r in stale])
+                stmt = sqlite_insert(versions).values(name=table.name, value=_initial_model_version())
+                conn.execute(stmt.on_conflict_do_update(index_elements=['name'], set_={'value': versions.c.value + 1}))
+                now = datetime.utcnow()
+                conn.execute(counters.update().where(counters.c.name == table.name).values(
+                    value=select(db.func.count()).select_from(table).scalar_subquery(), updated_at=now))
+                conn.execute(counters.update().where(counters.c.name == 'version').values(
+                    value=counters.c.value + 1, updated_at=now))
+
+class CatalogPusher:
+    """Background thread that copies committed recipe and panel type changes into the district databases.
+
+    A commit in the main database queues the ids it changed; the thread merges whatever has
+    queued up and copies just those rows with sync_catalog(). A district it cannot write
+    (locked, or its file unreadable) keeps its pending ids and is retried every
+    CATALOG_RETRY_SECONDS, so the write that changed the catalog never waits on a district.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pending = {}  # district key -> {table name: ids}
+
+    def submit(self, changed):
+        self.queue.put(changed)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='catalog-push', daemon=True)
+                self.thread.start()
+
+    def _take_changes(self):
+        """Everything queued, waiting for the first change (only until the next retry if districts are pending)."""
+        try:
+            changes = [self.queue.get(timeout=app.config['CATALOG_RETRY_SECONDS'] if self.pending else None)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                changes.append(self.queue.get_nowait())
+            except queue.Empty:
+                return changes
+
+    def _run(self):
+        while True:
+            changes = self._take_changes()
+            with app.app_context():
+                for key in partitions.keys() if changes else ():
+                    pending = self.pending.setdefault(key, {})
+                    for changed in changes:
+                        for table, ids in changed.items():
+                            pending.setdefault(table, set()).update(ids)
+                for key, ids in list(self.pending.items()):
+                    try:
+                        sync_catalog([key], ids)
+                        del self.pending[key]
+                    except Exception:
+                        app.logger.warning('copying the catalog to district %s failed; will retry', key, exc_info=True)
+            for _ in changes:
+                self.queue.task_done()
+
+catalog_pusher = CatalogPusher()
+
+@event.listens_for(Session, 'after_flush')
+def _note_catalog_changes(db_session, flush_context):
+    if not app.config['PARTITION_DIR'] or current_partition() is not None:
+        return
+    for obj in list(db_session.new) + list(db_session.dirty):
+        if isinstance(obj, tuple(CATALOG_MODELS)):
+            db_session.info.setdefault('catalog_changed', {}).setdefault(obj.__table__.name, set()).add(obj.id)
+
+@event.listens_for(Session, 'after_commit')
+def _push_catalog(db_session):
+    changed = db_session.info.pop('catalog_changed', None)
+    if changed:
+        catalog_pusher.submit(changed)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_catalog_flag(db_session):
+    db_session.info.pop('catalog_changed', None)
+
+partitions_cli = AppGroup('partitions', help='Manage the per-district databases in PANELS_PARTITION_DIR.')
+
+@partitions_cli.command('create')
+@click.argument('district')
+def partitions_create_command(district):
+    """Give DISTRICT its own database; its new sites, batches, QC tests and installations are stored there."""
+    if not app.config['PARTITION_DIR']:
+        raise click.UsageError('set PANELS_PARTITION_DIR first')
+    key = partition_key(district)
+    if not key:
+        raise click.BadParameter('needs at least one letter or digit', param_hint='DISTRICT')
+    create_tables()
+    partitions.engine(key)
+    click.echo('%s: %s' % (key, partitions.path(key)))
+    left = PilotSite.query.filter(db.func.lower(db.func.trim(PilotSite.district)) == district.strip().lower()).count()
+    if left:
+        click.echo('%d existing sites in %s stay in the main database' % (left, district))
+
+@partitions_cli.command('list')
+def partitions_list_command():
+    """Row counts of the main database and each district database, read in parallel."""
+    create_tables()
+    keys = [None] + partitions.keys()
+    counts = partitions.fan_out(lambda: {c.name: c.value for c in SummaryCounter.query}, keys)
+    click.echo('%-24s %10s %10s %12s' % ('database', 'sites', 'batches', 'qc tests'))
+    for key, c in zip(keys, counts):
+        click.echo('%-24s %10d %10d %12d' % (key or '(main)', c.get('pilot_site', 0), c.get('batch', 0), c.get('qc_test', 0)))
+
+@partitions_cli.command('sync-catalog')
+def partitions_sync_catalog_command():
+    """Copy recipes and panel types to every district database (normally done on each catalog change)."""
+    create_tables()
+    sync_catalog()
+    click.echo('catalog copied to %d district databases' % len(partitions.keys()))
+
+app.cli.add_command(partitions_cli)
+
+# -----------------
+# Keyset pagination helpers
+# -----------------
+def _encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError('cursor does not match this listing')
+        return [datetime.fromisoformat(v) if c.type.python_type is datetime else c.type.python_type(v)
+                for c, v in zip(columns, values)]
+    except (ValueError, TypeError, binascii.Error):
+        abort(400, 'invalid cursor')
+
+def keyset_page(query, columns):
+    """Return (items, next_cursor) for one page of `query`, newest first.
+    `columns` is the sort key; its last column must be unique (the primary key) so the
+    ?cursor= position is exact. Each page is an index range scan, so latency does not
+    grow with the table the way OFFSET or .all() does. Page size comes from ?limit=.
+    """
+    limit = min(max(request.args.get('limit', app.config['PAGE_SIZE'], type=int), 1), app.config['PAGE_SIZE_MAX'])
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.filter(tuple_(*columns) < tuple_(*_decode_cursor(cursor, columns)))
+    items = query.order_by(*[c.desc() for c in columns]).limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = _encode_cursor([getattr(items[-1], c.key) for c in columns])
+    return items, next_cursor
+
+def model_to_dict(obj):
+    """Plain column values of a model row, JSON-ready (datetimes as ISO strings)."""
+    data = {}
+    for c in obj.__table__.columns:
+        value = getattr(obj, c.key)
+        data[c.key] = value.isoformat() if isinstance(value, datetime) else value
+    return data
 
 # -----------------
 # Templates (simple single-file templates for prototype)
@@ -142,18 +1491,241 @@ base_html = '''
 </html>
 '''
 
+# Pages are named templates that extend base.html, registered next to their views below.
+# Jinja compiles each one once and serves it from its template cache afterwards.
+templates = {'base.html': base_html}
+templates['_pager.html'] = '''
+    {% if request.args.get('cursor') %}<a class="btn btn-sm btn-outline-secondary" href="{{ url_for(request.endpoint, limit=request.args.get('limit')) }}">Newest</a>{% endif %}
+    {% if next_cursor %}<a class="btn btn-sm btn-outline-secondary" href="{{ url_for(request.endpoint, cursor=next_cursor, limit=request.args.get('limit')) }}">Older</a>{% endif %}
+'''
+app.jinja_loader = DictLoader(templates)
+
+# -----------------
+# Dashboard summary (counts kept up to date on insert; dashboard served with an ETag)
+# -----------------
+SUMMARY_MODELS = [Recipe, PanelType, Batch, QCTest, PilotSite]
+_summary_tables = {m.__table__.name for m in SUMMARY_MODELS}
+_dashboard_cache = {}  # database (partition key) -> {'version', 'updated_at', 'checked'}
+
+def init_summary():
+    """Seed the counters from the tables the first time (databases created before the summary existed)."""
+    if SummaryCounter.query.count():
+        return
+    for m in SUMMARY_MODELS:
+        db.session.add(SummaryCounter(name=m.__table__.name, value=m.query.count()))
+    db.session.add(SummaryCounter(name='version', value=1))
+    db.session.commit()
+
+def bump_summary(db_session, deltas):
+    """Add {table_name: delta} to the counters and bump the version, inside the caller's transaction.
+    ORM inserts are counted automatically; Core bulk inserts must call this themselves."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    conn = db_session.connection()
+    table = SummaryCounter.__table__
+    now = datetime.utcnow()
+    for name, delta in deltas.items():
+        conn.execute(table.update().where(table.c.name == name).values(value=table.c.value + delta, updated_at=now))
+    conn.execute(table.update().where(table.c.name == 'version').values(value=table.c.value + 1, updated_at=now))
+    db_session.info['summary_dirty'] = True
+
+@event.listens_for(Session, 'after_flush')
+def _count_flushed_rows(db_session, flush_context):
+    deltas = {}
+    for obj in db_session.new:
+        name = obj.__table__.name
+        if name in _summary_tables:
+            deltas[name] = deltas.get(name, 0) + 1
+    for obj in db_session.deleted:
+        name = obj.__table__.name
+        if name in _summary_tables:
+            deltas[name] = deltas.get(name, 0) - 1
+    bump_summary(db_session, deltas)
+
+@event.listens_for(Session, 'after_commit')
+def _expire_dashboard_version(db_session):
+    if db_session.info.pop('summary_dirty', False):
+        _dashboard_cache.clear()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_summary_flag(db_session):
+    db_session.info.pop('summary_dirty', None)
+
+def dashboard_version():
+    """(version, updated_at) of the summary; re-read from the DB at most every DASHBOARD_SUMMARY_TTL seconds
+    unless this worker committed an insert in the meantime."""
+    cache = _dashboard_cache.setdefault(current_partition(), {'checked': 0.0})
+    if time.monotonic() - cache['checked'] > app.config['DASHBOARD_SUMMARY_TTL']:
+        row = db.session.get(SummaryCounter, 'version')
+        cache.update(version=row.value, updated_at=row.updated_at, checked=time.monotonic())
+    return cache['version'], cache['updated_at']
+
+# -----------------
+# Response cache for read-mostly pages, invalidated by per-model version counters
+# -----------------
+CACHED_MODELS = [Recipe, PanelType, PilotSite]
+
+def _mark_model_changed(mapper, connection, target):
+    db_session = object_session(target)
+    if db_session is not None:
+        db_session.info.setdefault('changed_tables', set()).add(mapper.local_table.name)
+
+for _model in CACHED_MODELS:
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _mark_model_changed)
+
+@event.listens_for(Session, 'after_flush')
+def _bump_model_versions(db_session, flush_context):
+    """One version bump per changed table per flush, in the writing transaction."""
+    changed = db_session.info.pop('changed_tables', None)
+    if not changed:
+        return
+    table = ModelVersion.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=['name'], set_={'value': table.c.value + 1})
+    db_session.connection().execute(stmt, [{'name': name, 'value': _initial_model_version()} for name in sorted(changed)])
+
+def _initial_model_version():
+    # start from the clock, so a recreated database never reuses versions still held by a shared cache
+    return int(time.time() * 1000)
+
+def init_model_versions():
+    existing = {name for (name,) in db.session.query(ModelVersion.name)}
+    for model in CACHED_MODELS:
+        if model.__table__.name not in existing:
+            db.session.add(ModelVersion(name=model.__table__.name, value=_initial_model_version()))
+    db.session.commit()
+
+response_cache_events = Metric('counter', 'panels_response_cache_events_total',
+                               'Response cache lookups and evictions by view and event (hit, shared_hit, miss, eviction).',
+                               ('view', 'event'))
+response_cache_entries = Metric('gauge', 'panels_response_cache_entries', 'Pages held in the in-process response cache.')
+
+class ResponseCache:
+    """Bounded in-process LRU of rendered pages, optionally backed by a SQLite file that the
+    workers on one host share (RESPONSE_CACHE_SHARED_PATH). Keys carry the versions of the
+    models a page shows, so a write makes the old entries unreachable instead of deleting them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.local = threading.local()
+
+    def get(self, key, view):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                self._count(view, 'hit')
+                return body
+        body = self._shared_get(key)
+        if body is not None:
+            self._put_local(key, body, view)
+            self._count(view, 'shared_hit')
+            return body
+        self._count(view, 'miss')
+        return None
+
+    def put(self, key, body, view):
+        self._put_local(key, body, view)
+        self._shared_put(key, body, view)
+
+    def _put_local(self, key, body, view):
+        with self.lock:
+            if key not in self.entries:
+                self._gauge(1)
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > app.config['RESPONSE_CACHE_ENTRIES']:
+                self.entries.popitem(last=False)
+                self._gauge(-1)
+                self._count(view, 'eviction')
+
+    def clear(self):
+        with self.lock:
+            self._gauge(-len(self.entries))
+            self.entries.clear()
+
+    def _shared(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(app.config['RESPONSE_CACHE_SHARED_PATH'], timeout=0.5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, body TEXT NOT NULL, stored REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_stored ON response_cache (stored)')
+            self.local.conn = conn
+        return conn
+
+    def _shared_get(self, key):
+        if not app.config['RESPONSE_CACHE_SHARED_PATH']:
+            return None
+        try:
+            row = self._shared().execute('SELECT body FROM response_cache WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            return None  # the shared cache is an optimisation; a busy or broken file is just a miss
+        return row[0] if row else None
+
+    def _shared_put(self, key, body, view):
+        if not app.config['RESPONSE_CACHE_SHARED_PATH']:
+            return
+        try:
+            conn = self._shared()
+            conn.execute('INSERT OR REPLACE INTO response_cache (key, body, stored) VALUES (?, ?, ?)', (key, body, time.time()))
+            # keep the newest RESPONSE_CACHE_SHARED_ENTRIES rows
+            evicted = conn.execute('DELETE FROM response_cache WHERE stored < (SELECT stored FROM response_cache '
+                                   'ORDER BY stored DESC LIMIT 1 OFFSET ?)',
+                                   (app.config['RESPONSE_CACHE_SHARED_ENTRIES'] - 1,)).rowcount
+        except sqlite3.Error:
+            return
+        if evicted > 0:
+            self._count(view, 'shared_eviction', evicted)
+
+    @staticmethod
+    def _count(view, name, amount=1):
+        if app.config['METRICS_ENABLED']:
+            response_cache_events.inc(amount, view, name)
+
+    @staticmethod
+    def _gauge(amount):
+        if app.config['METRICS_ENABLED']:
+            response_cache_entries.inc(amount)
+
+response_cache = ResponseCache()
+
+def cached_view(*models):
+    """Cache a GET view's rendered page, keyed by endpoint, path + query string and the
+    current versions of `models`. Pages are rendered normally while a flash message is pending."""
+    tables = sorted(m.__table__.name for m in models)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not app.config['RESPONSE_CACHE_ENTRIES'] or request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+            versions = dict(db.session.query(ModelVersion.name, ModelVersion.value).filter(ModelVersion.name.in_(tables)))
+            key = '%s %s %s %s' % (current_partition() or '', request.endpoint, request.full_path,
+                                   ','.join('%s=%s' % (t, versions.get(t)) for t in tables))
+            body = response_cache.get(key, request.endpoint)
+            if body is None:
+                body = view(*args, **kwargs)
+                if isinstance(body, str):
+                    response_cache.put(key, body, request.endpoint)
+            return body
+        return wrapper
+    return decorator
+
 # -----------------
 # Routes: Dashboard
 # -----------------
-@app.route('/')
-def dashboard():
-    total_recipes = Recipe.query.count()
-    total_panel_types = PanelType.query.count()
-    total_batches = Batch.query.count()
-    total_qc = QCTest.query.count()
-    sites = PilotSite.query.all()
-    return render_template_string(base_html + '''
+templates['dashboard.html'] = '''{% extends "base.html" %}
     {% block content %}
+    {% if districts %}
+    <p>District:
+      <a href="/?district="{% if not district %} class="fw-bold"{% endif %}>All</a>
+      {% for d in districts %} | <a href="/?district={{d}}"{% if d == district %} class="fw-bold"{% endif %}>{{d}}</a>{% endfor %}
+    </p>
+    {% endif %}
     <div class="row">
       <div class="col-md-3"><div class="card p-3">Recipes<br><h3>{{total_recipes}}</h3></div></div>
       <div class="col-md-3"><div class="card p-3">Panel Types<br><h3>{{total_panel_types}}</h3></div></div>
@@ -174,15 +1746,59 @@ def dashboard():
       {% endfor %}
     </div>
     {% endblock %}
-    ''', total_recipes=total_recipes, total_panel_types=total_panel_types, total_batches=total_batches, total_qc=total_qc, sites=sites)
+    '''
+
+def _dashboard_data():
+    counts = {c.name: c.value for c in SummaryCounter.query.filter(SummaryCounter.name.in_(_summary_tables))}
+    return counts, PilotSite.query.all()
+
+def dashboard_state():
+    """dashboard_version() of this request's database, or combined over every database when the dashboard
+    spans districts (each version only grows, so neither does their sum)."""
+    if not partitions.spans():
+        return dashboard_version()
+    states = partitions.fan_out(dashboard_version)
+    return sum(v for v, _ in states), max((u for _, u in states if u), default=None)
+
+@app.route('/')
+def dashboard():
+    version, updated_at = dashboard_state()
+    etag = 'dashboard-%d' % version
+    if app.config['PARTITION_DIR']:
+        etag += '-' + ('all' if partitions.spans() else current_partition() or 'main')
+    # A pending flash message must be rendered, so only unchanged, message-free pages are revalidated
+    conditional = not session.get('_flashes')
+    if request.if_none_match:
+        unchanged = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        unchanged = bool(since and updated_at and updated_at.replace(microsecond=0, tzinfo=timezone.utc) <= since)
+    if conditional and unchanged:
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    if partitions.spans():
+        # counts from every database in parallel; the catalog is copied into each, so take the main one's
+        parts = partitions.fan_out(_dashboard_data)
+        counts = {name: sum(c[name] for c, _ in parts) for name in _summary_tables}
+        counts.update((m.__table__.name, parts[0][0][m.__table__.name]) for m in CATALOG_MODELS)
+        sites = [s for _, part_sites in parts for s in part_sites]
+    else:
+        counts, sites = _dashboard_data()
+    response = app.make_response(render_template('dashboard.html',
+        total_recipes=counts['recipe'], total_panel_types=counts['panel_type'],
+        total_batches=counts['batch'], total_qc=counts['qc_test'], sites=sites,
+        districts=partitions.keys(), district=current_partition()))
+    if conditional:
+        response.set_etag(etag)
+        response.last_modified = updated_at
+        response.cache_control.no_cache = True
+    return response
 
 # -----------------
 # Recipes
 # -----------------
-@app.route('/recipes')
-def recipes():
-    items = Recipe.query.order_by(Recipe.created_at.desc()).all()
-    return render_template_string(base_html + '''
+templates['recipes.html'] = '''{% extends "base.html" %}
     {% block content %}
     <h3>Recipes <a class="btn btn-sm btn-success" href="/recipes/new">New</a></h3>
     <table class="table table-sm">
@@ -196,8 +1812,29 @@ def recipes():
       </tr>
       {% endfor %}
     </table>
+    {% include "_pager.html" %}
+    {% endblock %}
+    '''
+
+@app.route('/recipes')
+@cached_view(Recipe)
+def recipes():
+    items, next_cursor = keyset_page(Recipe.query, [Recipe.created_at, Recipe.id])
+    return render_template('recipes.html', items=items, next_cursor=next_cursor)
+
+templates['new_recipe.html'] = '''{% extends "base.html" %}
+    {% block content %}
+    <h3>New Recipe</h3>
+    <form method="post">
+      <div class="mb-3"><label>Name</label><input class="form-control" name="name" required></div>
+      <div class="mb-3"><label>Cement %</label><input class="form-control" name="cement" value="5"></div>
+      <div class="mb-3"><label>Plastic % (fine agg vol %)</label><input class="form-control" name="plastic" value="5"></div>
+      <div class="mb-3"><label>Additives</label><input class="form-control" name="additives"></div>
+      <div class="mb-3"><label>Notes</label><textarea class="form-control" name="notes"></textarea></div>
+      <button class="btn btn-primary">Save</button>
+    </form>
     {% endblock %}
-    ''', items=items)
+    '''
 
 @app.route('/recipes/new', methods=['GET','POST'])
 def new_recipe():
@@ -213,24 +1850,9 @@ def new_recipe():
         db.session.commit()
         flash('Recipe created')
         return redirect(url_for('recipes'))
-    return render_template_string(base_html + '''
-    {% block content %}
-    <h3>New Recipe</h3>
-    <form method="post">
-      <div class="mb-3"><label>Name</label><input class="form-control" name="name" required></div>
-      <div class="mb-3"><label>Cement %</label><input class="form-control" name="cement" value="5"></div>
-      <div class="mb-3"><label>Plastic % (fine agg vol %)</label><input class="form-control" name="plastic" value="5"></div>
-      <div class="mb-3"><label>Additives</label><input class="form-control" name="additives"></div>
-      <div class="mb-3"><label>Notes</label><textarea class="form-control" name="notes"></textarea></div>
-      <button class="btn btn-primary">Save</button>
-    </form>
-    {% endblock %}
-    ''')
-
-@app.route('/recipes/<int:id>')
-def view_recipe(id):
-    r = Recipe.query.get_or_404(id)
-    return render_template_string(base_html + '''
+    return render_template('new_recipe.html')
+
+templates['view_recipe.html'] = '''{% extends "base.html" %}
     {% block content %}
     <h3>Recipe: {{r.name}}</h3>
     <ul>
@@ -241,15 +1863,18 @@ def view_recipe(id):
     </ul>
     <a href="/recipes">Back</a>
     {% endblock %}
-    ''', r=r)
+    '''
+
+@app.route('/recipes/<int:id>')
+@cached_view(Recipe)
+def view_recipe(id):
+    r = Recipe.query.get_or_404(id)
+    return render_template('view_recipe.html', r=r)
 
 # -----------------
 # Panel Types
 # -----------------
-@app.route('/panels')
-def panels():
-    items = PanelType.query.all()
-    return render_template_string(base_html + '''
+templates['panels.html'] = '''{% extends "base.html" %}
     {% block content %}
     <h3>Panel Types <a class="btn btn-sm btn-success" href="/panels/new">New</a></h3>
     <table class="table table-sm"><tr><th>Name</th><th>Size (m)</th><th>Thickness</th><th>Target MPa</th></tr>
@@ -258,7 +1883,28 @@ def panels():
     {% endfor %}
     </table>
     {% endblock %}
-    ''', items=items)
+    '''
+
+@app.route('/panels')
+@cached_view(PanelType)
+def panels():
+    items = PanelType.query.all()
+    return render_template('panels.html', items=items)
+
+templates['new_panel.html'] = '''{% extends "base.html" %}
+    {% block content %}
+    <h3>New Panel Type</h3>
+    <form method="post">
+      <div class="mb-3"><label>Name</label><input class="form-control" name="name" required></div>
+      <div class="mb-3"><label>Length (m)</label><input class="form-control" name="length" value="1.0"></div>
+      <div class="mb-3"><label>Width (m)</label><input class="form-control" name="width" value="0.5"></div>
+      <div class="mb-3"><label>Thickness (m)</label><input class="form-control" name="thickness" value="0.12"></div>
+      <div class="mb-3"><label>Target Strength (MPa)</label><input class="form-control" name="target" value="20"></div>
+      <div class="mb-3"><label>Notes</label><textarea class="form-control" name="notes"></textarea></div>
+      <button class="btn btn-primary">Save</button>
+    </form>
+    {% endblock %}
+    '''
 
 @app.route('/panels/new', methods=['GET','POST'])
 def new_panel():
@@ -275,28 +1921,12 @@ def new_panel():
         db.session.commit()
         flash('Panel type created')
         return redirect(url_for('panels'))
-    return render_template_string(base_html + '''
-    {% block content %}
-    <h3>New Panel Type</h3>
-    <form method="post">
-      <div class="mb-3"><label>Name</label><input class="form-control" name="name" required></div>
-      <div class="mb-3"><label>Length (m)</label><input class="form-control" name="length" value="1.0"></div>
-      <div class="mb-3"><label>Width (m)</label><input class="form-control" name="width" value="0.5"></div>
-      <div class="mb-3"><label>Thickness (m)</label><input class="form-control" name="thickness" value="0.12"></div>
-      <div class="mb-3"><label>Target Strength (MPa)</label><input class="form-control" name="target" value="20"></div>
-      <div class="mb-3"><label>Notes</label><textarea class="form-control" name="notes"></textarea></div>
-      <button class="btn btn-primary">Save</button>
-    </form>
-    {% endblock %}
-    ''')
+    return render_template('new_panel.html')
 
 # -----------------
 # Batches
 # -----------------
-@app.route('/batches')
-def batches():
-    items = Batch.query.order_by(Batch.produced_on.desc()).all()
-    return render_template_string(base_html + '''
+templates['batches.html'] = '''{% extends "base.html" %}
     {% block content %}
     <h3>Batches <a class="btn btn-sm btn-success" href="/batches/new">New</a></h3>
     <table class="table table-sm"><tr><th>ID</th><th>Panel Type</th><th>Recipe</th><th>Qty</th><th>Produced On</th></tr>
@@ -304,13 +1934,33 @@ def batches():
       <tr><td>{{b.id}}</td><td>{{b.panel_type.name if b.panel_type else 'n/a'}}</td><td>{{b.recipe.name if b.recipe else 'n/a'}}</td><td>{{b.quantity}}</td><td>{{b.produced_on.strftime('%Y-%m-%d')}}</td></tr>
     {% endfor %}
     </table>
+    {% include "_pager.html" %}
     {% endblock %}
-    ''', items=items)
+    '''
+
+@app.route('/batches')
+def batches():
+    query = Batch.query.options(joinedload(Batch.panel_type), joinedload(Batch.recipe))
+    items, next_cursor = keyset_page(query, [Batch.produced_on, Batch.id])
+    return render_template('batches.html', items=items, next_cursor=next_cursor)
+
+templates['new_batch.html'] = '''{% extends "base.html" %}
+    {% from "_typeahead.html" import typeahead_field, typeahead_script %}
+    {% block content %}
+    <h3>New Batch</h3>
+    <form method="post">
+      {{ typeahead_field('recipe', 'recipe', 'Recipe', recipes) }}
+      {{ typeahead_field('panel', 'panel_type', 'Panel Type', panels) }}
+      <div class="mb-3"><label>Quantity</label><input class="form-control" name="quantity" value="100"></div>
+      <div class="mb-3"><label>Produced On</label><input class="form-control" name="produced_on" type="date"></div>
+      <button class="btn btn-primary">Save</button>
+    </form>
+    {{ typeahead_script() }}
+    {% endblock %}
+    '''
 
 @app.route('/batches/new', methods=['GET','POST'])
 def new_batch():
-    recipes = Recipe.query.all()
-    panels = PanelType.query.all()
     if request.method == 'POST':
         b = Batch(
             recipe_id=int(request.form.get('recipe')),
@@ -322,26 +1972,12 @@ def new_batch():
         db.session.commit()
         flash('Batch created')
         return redirect(url_for('batches'))
-    return render_template_string(base_html + '''
-    {% block content %}
-    <h3>New Batch</h3>
-    <form method="post">
-      <div class="mb-3"><label>Recipe</label><select class="form-control" name="recipe">{% for r in recipes %}<option value="{{r.id}}">{{r.name}}</option>{% endfor %}</select></div>
-      <div class="mb-3"><label>Panel Type</label><select class="form-control" name="panel">{% for p in panels %}<option value="{{p.id}}">{{p.name}}</option>{% endfor %}</select></div>
-      <div class="mb-3"><label>Quantity</label><input class="form-control" name="quantity" value="100"></div>
-      <div class="mb-3"><label>Produced On</label><input class="form-control" name="produced_on" type="date"></div>
-      <button class="btn btn-primary">Save</button>
-    </form>
-    {% endblock %}
-    ''', recipes=recipes, panels=panels)
+    return render_template('new_batch.html', recipes=search_options('recipe'), panels=search_options('panel_type'))
 
 # -----------------
 # QC Tests
 # -----------------
-@app.route('/qc')
-def qc():
-    items = QCTest.query.order_by(QCTest.tested_on.desc()).all()
-    return render_template_string(base_html + '''
+templates['qc.html'] = '''{% extends "base.html" %}
     {% block content %}
     <h3>QC Tests <a class="btn btn-sm btn-success" href="/qc/new">New</a></h3>
     <table class="table table-sm"><tr><th>ID</th><th>Batch</th><th>Comp (MPa)</th><th>Flex (MPa)</th><th>Tested</th></tr>
@@ -349,12 +1985,34 @@ def qc():
       <tr><td>{{q.id}}</td><td>{{q.batch.id if q.batch else 'n/a'}}</td><td>{{q.compressive_mpa}}</td><td>{{q.flexural_mpa}}</td><td>{{q.tested_on.strftime('%Y-%m-%d')}}</td></tr>
     {% endfor %}
     </table>
+    {% include "_pager.html" %}
+    {% endblock %}
+    '''
+
+@app.route('/qc')
+def qc():
+    items, next_cursor = keyset_page(QCTest.query.options(joinedload(QCTest.batch)), [QCTest.tested_on, QCTest.id])
+    return render_template('qc.html', items=items, next_cursor=next_cursor)
+
+templates['new_qc.html'] = '''{% extends "base.html" %}
+    {% from "_typeahead.html" import typeahead_field, typeahead_script %}
+    {% block content %}
+    <h3>New QC Test</h3>
+    <form method="post">
+      {{ typeahead_field('batch', 'batch', 'Batch', batches) }}
+      <div class="mb-3"><label>Compressive (MPa)</label><input class="form-control" name="comp"></div>
+      <div class="mb-3"><label>Flexural (MPa)</label><input class="form-control" name="flex"></div>
+      <div class="mb-3"><label>Water Absorption %</label><input class="form-control" name="water"></div>
+      <div class="mb-3"><label>Abrasion Loss %</label><input class="form-control" name="abr"></div>
+      <div class="mb-3"><label>Notes</label><textarea class="form-control" name="notes"></textarea></div>
+      <button class="btn btn-primary">Save</button>
+    </form>
+    {{ typeahead_script() }}
     {% endblock %}
-    ''', items=items)
+    '''
 
 @app.route('/qc/new', methods=['GET','POST'])
 def new_qc():
-    batches = Batch.query.all()
     if request.method == 'POST':
         q = QCTest(
             batch_id=int(request.form.get('batch')),
@@ -368,28 +2026,12 @@ def new_qc():
         db.session.commit()
         flash('QC Test recorded')
         return redirect(url_for('qc'))
-    return render_template_string(base_html + '''
-    {% block content %}
-    <h3>New QC Test</h3>
-    <form method="post">
-      <div class="mb-3"><label>Batch</label><select class="form-control" name="batch">{% for b in batches %}<option value="{{b.id}}">{{b.id}} - {{b.panel_type.name if b.panel_type else 'n/a'}}</option>{% endfor %}</select></div>
-      <div class="mb-3"><label>Compressive (MPa)</label><input class="form-control" name="comp"></div>
-      <div class="mb-3"><label>Flexural (MPa)</label><input class="form-control" name="flex"></div>
-      <div class="mb-3"><label>Water Absorption %</label><input class="form-control" name="water"></div>
-      <div class="mb-3"><label>Abrasion Loss %</label><input class="form-control" name="abr"></div>
-      <div class="mb-3"><label>Notes</label><textarea class="form-control" name="notes"></textarea></div>
-      <button class="btn btn-primary">Save</button>
-    </form>
-    {% endblock %}
-    ''', batches=batches)
+    return render_template('new_qc.html', batches=search_options('batch'))
 
 # -----------------
 # Pilot Sites & Installations
 # -----------------
-@app.route('/sites')
-def sites():
-    items = PilotSite.query.all()
-    return render_template_string(base_html + '''
+templates['sites.html'] = '''{% extends "base.html" %}
     {% block content %}
     <h3>Pilot Sites <a class="btn btn-sm btn-success" href="/sites/new">New</a></h3>
     <table class="table table-sm"><tr><th>Name</th><th>Village</th><th>District</th><th>Slope</th></tr>
@@ -397,8 +2039,31 @@ def sites():
       <tr><td>{{s.name}}</td><td>{{s.village}}</td><td>{{s.district}}</td><td>{{s.slope_deg}}</td></tr>
     {% endfor %}
     </table>
+    {% include "_pager.html" %}
+    {% endblock %}
+    '''
+
+@app.route('/sites')
+@cached_view(PilotSite)
+def sites():
+    items, next_cursor = keyset_page(PilotSite.query, [PilotSite.id])
+    return render_template('sites.html', items=items, next_cursor=next_cursor)
+
+templates['new_site.html'] = '''{% extends "base.html" %}
+    {% block content %}
+    <h3>New Pilot Site</h3>
+    <form method="post">
+      <div class="mb-3"><label>Name</label><input class="form-control" name="name" required></div>
+      <div class="mb-3"><label>Village</label><input class="form-control" name="village"></div>
+      <div class="mb-3"><label>District</label><input class="form-control" name="district"></div>
+      <div class="mb-3"><label>Latitude</label><input class="form-control" name="lat"></div>
+      <div class="mb-3"><label>Longitude</label><input class="form-control" name="lon"></div>
+      <div class="mb-3"><label>Slope (deg)</label><input class="form-control" name="slope" value="5"></div>
+      <div class="mb-3"><label>Notes</label><textarea class="form-control" name="notes"></textarea></div>
+      <button class="btn btn-primary">Save</button>
+    </form>
     {% endblock %}
-    ''', items=items)
+    '''
 
 @app.route('/sites/new', methods=['GET','POST'])
 def new_site():
@@ -415,30 +2080,30 @@ def new_site():
         db.session.add(s)
         db.session.commit()
         flash('Site added')
-        return redirect(url_for('sites'))
-    return render_template_string(base_html + '''
+        # the site went to its own district's database, which may not be the one this session browses
+        return redirect(url_for('sites', district=s.district if app.config['PARTITION_DIR'] and s.district else None))
+    return render_template('new_site.html')
+
+# -----------------
+# Installations
+# -----------------
+templates['new_install.html'] = '''{% extends "base.html" %}
+    {% from "_typeahead.html" import typeahead_field, typeahead_script %}
     {% block content %}
-    <h3>New Pilot Site</h3>
+    <h3>New Installation</h3>
     <form method="post">
-      <div class="mb-3"><label>Name</label><input class="form-control" name="name" required></div>
-      <div class="mb-3"><label>Village</label><input class="form-control" name="village"></div>
-      <div class="mb-3"><label>District</label><input class="form-control" name="district"></div>
-      <div class="mb-3"><label>Latitude</label><input class="form-control" name="lat"></div>
-      <div class="mb-3"><label>Longitude</label><input class="form-control" name="lon"></div>
-      <div class="mb-3"><label>Slope (deg)</label><input class="form-control" name="slope" value="5"></div>
-      <div class="mb-3"><label>Notes</label><textarea class="form-control" name="notes"></textarea></div>
+      {{ typeahead_field('site', 'site', 'Site', sites) }}
+      {{ typeahead_field('batch', 'batch', 'Batch', batches) }}
+      <div class="mb-3"><label>Panels Installed</label><input class="form-control" name="qty" value="100"></div>
+      <div class="mb-3"><label>Installed On</label><input class="form-control" name="installed_on" type="date"></div>
       <button class="btn btn-primary">Save</button>
     </form>
+    {{ typeahead_script() }}
     {% endblock %}
-    ''')
+    '''
 
-# -----------------
-# Installations
-# -----------------
 @app.route('/install/new', methods=['GET','POST'])
 def new_install():
-    sites = PilotSite.query.all()
-    batches = Batch.query.all()
     if request.method == 'POST':
         it = Installation(
             site_id=int(request.form.get('site')),
@@ -446,22 +2111,12 @@ def new_install():
             panels_installed=int(request.form.get('qty',0)),
             installed_on=datetime.strptime(request.form.get('installed_on'), '%Y-%m-%d') if request.form.get('installed_on') else datetime.utcnow()
         )
+        warning = overdraw_warning(it.batch_id, it.panels_installed)
         db.session.add(it)
         db.session.commit()
-        flash('Installation recorded')
+        flash('Installation recorded' + (' (warning: %s)' % warning if warning else ''))
         return redirect(url_for('dashboard'))
-    return render_template_string(base_html + '''
-    {% block content %}
-    <h3>New Installation</h3>
-    <form method="post">
-      <div class="mb-3"><label>Site</label><select class="form-control" name="site">{% for s in sites %}<option value="{{s.id}}">{{s.name}}</option>{% endfor %}</select></div>
-      <div class="mb-3"><label>Batch</label><select class="form-control" name="batch">{% for b in batches %}<option value="{{b.id}}">{{b.id}}</option>{% endfor %}</select></div>
-      <div class="mb-3"><label>Panels Installed</label><input class="form-control" name="qty" value="100"></div>
-      <div class="mb-3"><label>Installed On</label><input class="form-control" name="installed_on" type="date"></div>
-      <button class="btn btn-primary">Save</button>
-    </form>
-    {% endblock %}
-    ''', sites=sites, batches=batches)
+    return render_template('new_install.html', sites=search_options('site'), batches=search_options('batch'))
 
 # -----------------
 # Simple API endpoints for field/mobile
@@ -469,38 +2124,1549 @@ def new_install():
 @app.route('/api/report_qc', methods=['POST'])
 def api_report_qc():
     """Accepts JSON: {batch_id, compressive_mpa, flexural_mpa, water_absorption_percent, abrasion_loss_percent, notes}
-    Returns success JSON.
+    Returns success JSON, or 202 with a report_id to poll at /api/reports/<id> when INGEST_MODE=queue.
     """
-    data = request.json or {}
     try:
-        q = QCTest(
-            batch_id=data.get('batch_id'),
-            compressive_mpa=data.get('compressive_mpa'),
-            flexural_mpa=data.get('flexural_mpa'),
-            water_absorption_percent=data.get('water_absorption_percent'),
-            abrasion_loss_percent=data.get('abrasion_loss_percent'),
-            notes=data.get('notes','')
-        )
-        db.session.add(q)
-        db.session.commit()
-        return jsonify({'status':'ok','id':q.id})
+        data = _with_idempotency_key(validate_report('qc', request.json or {}))
+    except ValueError as e:
+        return jsonify({'status':'error','message':str(e)}), 400
+    existing = _ids_by_key(QCTest, [data['idempotency_key']]).get(data['idempotency_key'])
+    if existing is not None:
+        return jsonify({'status':'ok','id':existing,'duplicate':True})
+    if app.config['INGEST_MODE'] == 'queue':
+        return _accepted(enqueue_report('qc', data))
+    try:
+        qc_id, duplicate = insert_report_once(QCTest, _qc_report_values(data, datetime.utcnow()))
+        return jsonify(dict({'status':'ok','id':qc_id}, **({'duplicate': True} if duplicate else {})))
     except Exception as e:
         return jsonify({'status':'error','message':str(e)}), 400
 
+def _with_idempotency_key(data):
+    return dict(data, idempotency_key=request.headers.get('Idempotency-Key') or data.get('idempotency_key'))
+
 @app.route('/api/field_report', methods=['POST'])
 def api_field_report():
     """Field app can report installation status or issues.
     Example JSON: {site_id, batch_id, installed_panels, issue: 'crack'}
+    An Idempotency-Key header (or idempotency_key field) makes retries safe: a repeated
+    report returns the first installation_id with duplicate: true.
+    """
+    try:
+        data = _with_idempotency_key(validate_report('field', request.json or {}))
+    except ValueError as e:
+        return jsonify({'status':'error','message':str(e)}), 400
+    existing = _ids_by_key(Installation, [data['idempotency_key']]).get(data['idempotency_key'])
+    if existing is not None:
+        return jsonify({'status':'ok','installation_id':existing,'duplicate':True})
+    warning = overdraw_warning(data['batch_id'], data['installed_panels'])
+    if app.config['INGEST_MODE'] == 'queue':
+        return _accepted(enqueue_report('field', data), **({'warning': warning} if warning else {}))
+    installation_id, duplicate = insert_report_once(Installation, _field_report_values(data, datetime.utcnow()))
+    result = {'status':'ok','installation_id':installation_id}
+    if duplicate:
+        result['duplicate'] = True
+    elif warning:
+        result['warning'] = warning
+    return jsonify(result)
+
+# -----------------
+# Paginated JSON listings (?cursor=&limit=, same ordering as the HTML tables)
+# -----------------
+def _api_page(query, columns):
+    items, next_cursor = keyset_page(query, columns)
+    return jsonify({'items':[model_to_dict(i) for i in items],'next_cursor':next_cursor})
+
+@app.route('/api/recipes')
+def api_recipes():
+    return _api_page(Recipe.query, [Recipe.created_at, Recipe.id])
+
+@app.route('/api/batches')
+def api_batches():
+    return _api_page(Batch.query, [Batch.produced_on, Batch.id])
+
+@app.route('/api/qc')
+def api_qc():
+    return _api_page(QCTest.query, [QCTest.tested_on, QCTest.id])
+
+@app.route('/api/sites')
+def api_sites():
+    return _api_page(PilotSite.query, [PilotSite.id])
+
+# -----------------
+# Bulk QC ingestion (lab uploads at end of shift)
+# -----------------
+def _qc_row_from_json(data, now):
+    """Validate one bulk QC record against the QCTest columns.
+    Returns a dict with every insertable column set; raises ValueError on bad input.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('row must be a JSON object')
+    columns = {c.name: c for c in QCTest.__table__.columns if not c.primary_key}
+    unknown = sorted(set(data) - set(columns))
+    if unknown:
+        raise ValueError('unknown field(s): ' + ', '.join(unknown))
+    if data.get('batch_id') is None:
+        raise ValueError('batch_id required')
+    row = {}
+    for name, col in columns.items():
+        value = data.get(name)
+        if value is None:
+            row[name] = now if name == 'tested_on' else ('' if name == 'notes' else None)
+            continue
+        python_type = col.type.python_type
+        if python_type is datetime:
+            try:
+                value = datetime.fromisoformat(str(value))
+            except ValueError:
+                raise ValueError('%s must be an ISO date/time' % name)
+        elif python_type in (int, float):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError('%s must be a number' % name)
+            if python_type is int and value != int(value):
+                raise ValueError('%s must be an integer' % name)
+            value = python_type(value)
+        else:
+            value = str(value)
+            if col.type.length and len(value) > col.type.length:
+                raise ValueError('%s longer than %d characters' % (name, col.type.length))
+        row[name] = value
+    return row
+
+def _iter_bulk_records():
+    """Yield (row_number, record_or_error) pairs from the request body.
+    application/json bodies must be a JSON array; anything else is read as NDJSON, line by line.
+    """
+    if request.mimetype == 'application/json':
+        try:
+            records = json.loads(request.get_data() or b'[]')
+        except ValueError as e:
+            raise ValueError('invalid JSON body: %s' % e)
+        if not isinstance(records, list):
+            raise ValueError('JSON body must be an array of QC records')
+        for n, record in enumerate(records, 1):
+            yield n, record
+        return
+    n = 0
+    for line in request.stream:
+        line = line.strip()
+        if not line:
+            continue
+        n += 1
+        try:
+            yield n, json.loads(line)
+        except ValueError as e:
+            yield n, ValueError('invalid JSON: %s' % e)
+
+def _insert_qc_chunk(chunk, results):
+    """Insert one chunk of validated (row_number, row) pairs with a single executemany; returns the rows accepted.
+    Rows whose batch does not exist are rejected instead of inserted. A row whose idempotency_key is
+    already stored (or repeated earlier in the upload) is not inserted again; it is reported as
+    a duplicate with the id of the stored row.
+    """
+    batch_ids = {row['batch_id'] for _, row in chunk}
+    known = {bid for (bid,) in db.session.query(Batch.id).filter(Batch.id.in_(batch_ids))}
+    stored = _ids_by_key(QCTest, [row['idempotency_key'] for _, row in chunk])
+    rows, seen, repeats = [], set(), []
+    for n, row in chunk:
+        key = row['idempotency_key']
+        if row['batch_id'] not in known:
+            results.append({'row': n, 'status': 'error', 'message': 'unknown batch_id %s' % row['batch_id']})
+        elif key and (key in stored or key in seen):
+            repeats.append((n, key))
+        else:
+            if key:
+                seen.add(key)
+            rows.append(row)
+            results.append({'row': n, 'status': 'ok'})
+    if rows:
+        db.session.execute(QCTest.__table__.insert(), rows)
+        bump_summary(db.session, {'qc_test': len(rows)})
+        rollup_qc_rows(db.session.connection(), rows)
+    if repeats:
+        ids = dict(stored, **_ids_by_key(QCTest, [key for _, key in repeats if key not in stored]))
+        results.extend({'row': n, 'status': 'ok', 'id': ids[key], 'duplicate': True} for n, key in repeats)
+    return len(rows) + len(repeats)
+
+@app.route('/api/report_qc/bulk', methods=['POST'])
+def api_report_qc_bulk():
+    """Accepts NDJSON (one QC record per line) or a JSON array of the records /api/report_qc takes,
+    plus an optional ISO `tested_on` and `idempotency_key`. Valid rows are inserted in chunks of
+    QC_BULK_CHUNK_SIZE and committed in one transaction. Returns per-row accept/reject results;
+    rows whose idempotency_key is already stored are accepted as duplicates and not inserted again.
     """
-    data = request.json or {}
-    site_id = data.get('site_id')
-    batch_id = data.get('batch_id')
-    if not site_id or not batch_id:
-        return jsonify({'status':'error','message':'site_id and batch_id required'}), 400
-    it = Installation(site_id=site_id, batch_id=batch_id, panels_installed=data.get('installed_panels',0), installed_on=datetime.utcnow(), status='reported')
-    db.session.add(it)
+    chunk_size = max(1, request.args.get('chunk_size', app.config['QC_BULK_CHUNK_SIZE'], type=int))
+    now = datetime.utcnow()
+    results, chunk, accepted = [], [], 0
+    try:
+        for n, record in _iter_bulk_records():
+            try:
+                if isinstance(record, ValueError):
+                    raise record
+                chunk.append((n, _qc_row_from_json(record, now)))
+            except ValueError as e:
+                results.append({'row': n, 'status': 'error', 'message': str(e)})
+            if len(chunk) >= chunk_size:
+                accepted += _insert_qc_chunk(chunk, results)
+                chunk = []
+        if chunk:
+            accepted += _insert_qc_chunk(chunk, results)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'status':'error','message':str(e)}), 400
+    except HTTPException:
+        # undecodable or oversized compressed body
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'status':'error','message':str(e)}), 500
+    results.sort(key=lambda r: r['row'])
+    return jsonify({'status':'ok','accepted':accepted,'rejected':len(results) - accepted,'results':results})
+
+# -----------------
+# QC analytics (column-wise NumPy statistics per batch and per recipe)
+# -----------------
+QC_METRICS = ['compressive_mpa', 'flexural_mpa', 'water_absorption_percent', 'abrasion_loss_percent']
+_QC_COLUMNS = ['id', 'batch_id'] + QC_METRICS
+_QC_RECORD = np.dtype([(name, '<f8') for name in _QC_COLUMNS]) if np is not None else None
+
+def _fetch_qc_rows(after_id, upto_id):
+    """qc_test rows with after_id < id <= upto_id, by id, as a float64 record array (NULL -> NaN).
+    np.fromiter fills it straight from the raw DB-API cursor, so no list of rows is built on the way."""
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute('SELECT %s FROM qc_test WHERE id > ? AND id <= ? ORDER BY id' % ', '.join(_QC_COLUMNS),
+                   (after_id, upto_id))
+    return np.fromiter(cursor, dtype=_QC_RECORD)
+
+def _load_qc_rows(upto_id):
+    """(records, chunked_upto, chunked_rows) for every qc_test row with id <= upto_id. The QCColumnChunk
+    prefix is read from its blobs; only the rows after it (up to chunked_upto) are fetched one by one."""
+    parts, pos = [], 0
+    chunks = db.session.query(QCColumnChunk.after_id, QCColumnChunk.upto_id, QCColumnChunk.data) \
+        .filter(QCColumnChunk.upto_id <= upto_id).order_by(QCColumnChunk.after_id)
+    for after_id, chunk_upto, data in chunks:
+        if after_id != pos:
+            break
+        parts.append(np.frombuffer(data, dtype=_QC_RECORD))
+        pos = chunk_upto
+    chunked_rows = sum(len(p) for p in parts)
+    parts.append(_fetch_qc_rows(pos, upto_id))
+    return np.concatenate(parts), pos, chunked_rows
+
+@event.listens_for(Session, 'after_flush')
+def _drop_stale_qc_chunks(db_session, flush_context):
+    """Chunks assume qc_test rows are only appended: editing or deleting one drops the chunks from its id on."""
+    changed = [obj.id for obj in db_session.deleted if isinstance(obj, QCTest)] + \
+              [obj.id for obj in db_session.dirty if isinstance(obj, QCTest) and db_session.is_modified(obj)]
+    if changed:
+        db_session.connection().execute(QCColumnChunk.__table__.delete().where(QCColumnChunk.upto_id >= min(changed)))
+        _qc_analytics.pop(current_partition(), None)
+
+class _GroupIndex:
+    """Row positions grouped by key: an argsort of the rows present when built, plus a scan of the
+    rows appended since, which are sorted in once they pass a quarter of the total."""
+
+    def __init__(self, keys):
+        self.order = np.argsort(keys)
+        self.sorted = keys[self.order]
+
+    def rows(self, keys, values):
+        """Positions of the rows whose key is in `values`; `keys` is the key column including appended rows."""
+        if len(keys) - len(self.order) > len(self.order) // 4:
+            self.__init__(keys)
+        lo = np.searchsorted(self.sorted, values, 'left')
+        hi = np.searchsorted(self.sorted, values, 'right')
+        base = len(self.order)
+        tail = base + np.flatnonzero(np.isin(keys[base:], values))
+        return np.concatenate([self.order[a:b] for a, b in zip(lo, hi)] + [tail])
+
+def _group_stats(keys, values):
+    """Per-key n/mean/std/p05/p50/p95 of `values` (NaN ignored), computed without a Python loop.
+    Returns (unique_keys, {stat: array})."""
+    ok = ~(np.isnan(values) | np.isnan(keys))
+    if not ok.all():
+        keys, values = keys[ok], values[ok]
+    # one argsort on key + value scaled into [0, 0.5): each key's values end up contiguous and ascending
+    span = values.max() - values.min() if len(values) else 0.0
+    order = np.argsort(keys + (values - (values.min() if len(values) else 0.0)) / (2 * span if span else 1.0))
+    keys, values = keys[order], values[order]
+    if not len(keys):
+        return keys, {}
+    # keys are sorted, so each group starts where the key changes
+    start = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    uniq, count = keys[start], np.diff(np.append(start, len(keys)))
+    mean = np.add.reduceat(values, start) / count
+    sq = np.add.reduceat((values - np.repeat(mean, count)) ** 2, start)
+    std = np.where(count > 1, np.sqrt(sq / np.maximum(count - 1, 1)), np.nan)
+    stats = {'n': count, 'mean': mean, 'std': std}
+    for label, q in (('p05', 0.05), ('p50', 0.5), ('p95', 0.95)):
+        # linear interpolation between order statistics, same as np.percentile's default
+        pos = start + q * (count - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        stats[label] = values[lo] + (values[hi] - values[lo]) * (pos - lo)
+    return uniq, stats
+
+def _stats_by_key(cols, key):
+    """{key_value: {metric: {stat: value}}} for every QC metric."""
+    out = {}
+    for metric in QC_METRICS:
+        uniq, stats = _group_stats(cols[key], cols[metric])
+        if not len(uniq):
+            continue
+        names = list(stats)
+        columns = [stats['n'].tolist()]
+        for s in names[1:]:
+            # NaN (e.g. std of a single sample) becomes None so it serialises as null
+            column = np.round(stats[s], 3).tolist()
+            for i in np.flatnonzero(np.isnan(stats[s])).tolist():
+                column[i] = None
+            columns.append(column)
+        for k, values in zip(uniq.astype(np.int64).tolist(), zip(*columns)):
+            out.setdefault(k, {})[metric] = dict(zip(names, values))
+    return out
+
+class QCAnalytics:
+    """Cached per-batch and per-recipe QC statistics.
+
+    QC values are held in memory as NumPy columns with spare capacity, together
+    with the highest qc_test.id folded in so far. refresh() appends only rows
+    above that watermark and recomputes the batches that received them and those
+    batches' recipes, finding their rows through a _GroupIndex rather than a scan.
+    Other batches keep their cached results, and every worker picks up rows
+    written by the others. Loaded rows are stored back as QCColumnChunk blobs, so
+    the next cold load (a new worker, or a restart) skips fetching them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.watermark = 0
+        self.size = 0
+        self.columns = None  # name -> float64 array; rows [0, size) are filled
+        self.by_batch = self.by_recipe = None
+        self.chunked_upto = self.chunked_rows = 0
+        self.batch_meta = {}  # batch_id -> (recipe_id, panel_type_id, target_strength_mpa)
+        self.batches = {}
+        self.recipes = {}
+
+    def refresh(self, block=True):
+        """Fold in rows added since the last refresh. Returns False, having done nothing, when `block`
+        is false and another thread is already refreshing."""
+        if not self.lock.acquire(blocking=block):
+            return False
+        try:
+            max_id = db.session.query(db.func.max(QCTest.id)).scalar() or 0
+            if max_id == self.watermark:
+                return True
+            if max_id < self.watermark:  # the database was replaced; start over
+                self._reset()
+            if self.columns is None:
+                records, self.chunked_upto, self.chunked_rows = _load_qc_rows(max_id)
+                self._append(records)
+                cols = {name: self.column(name) for name in self.columns}
+                self.by_batch = _GroupIndex(cols['batch_id'])
+                self.by_recipe = _GroupIndex(cols['recipe_id'])
+                batches = self._compute_batches({}, cols)
+                recipes = self._compute_recipes({}, batches, cols)
+            else:
+                new = self._append(_fetch_qc_rows(self.watermark, max_id))
+                dirty_batches = np.unique(new['batch_id'][~np.isnan(new['batch_id'])])
+                dirty_recipes = np.unique(new['recipe_id'][~np.isnan(new['recipe_id'])])
+                batches = self._compute_batches(dict(self.batches), self._rows(self.by_batch, 'batch_id', dirty_batches))
+                recipes = self._compute_recipes(dict(self.recipes), batches,
+                                                self._rows(self.by_recipe, 'recipe_id', dirty_recipes))
+            # swapped in whole, so requests served while a refresh runs read a consistent snapshot
+            self.batches, self.recipes, self.watermark = batches, recipes, max_id
+            self._store_chunks()
+            return True
+        finally:
+            self.lock.release()
+
+    def column(self, name):
+        return self.columns[name][:self.size]
+
+    def _append(self, records):
+        """Append a record array (plus its derived recipe_id column); returns the new rows' columns."""
+        self._load_batch_meta(records['batch_id'])
+        new = {name: records[name] for name in _QC_COLUMNS}
+        new['recipe_id'] = self._recipe_ids(new['batch_id'])
+        end = self.size + len(records)
+        if self.columns is None or end > len(self.columns['id']):
+            grown = {name: np.empty(max(end + end // 4, 1024)) for name in new}
+            if self.columns is not None:
+                for name in grown:
+                    grown[name][:self.size] = self.column(name)
+            self.columns = grown
+        for name, values in new.items():
+            self.columns[name][self.size:end] = values
+        self.size = end
+        return new
+
+    def _rows(self, index, key, values):
+        rows = index.rows(self.column(key), values)
+        return {name: self.columns[name][rows] for name in self.columns}
+
+    def _store_chunks(self):
+        """Write full chunks of rows not yet stored as QCColumnChunk; another worker may have beaten us to it."""
+        size = app.config['ANALYTICS_CHUNK_ROWS']
+        chunks = []
+        while self.size - self.chunked_rows >= size:
+            start, end = self.chunked_rows, self.chunked_rows + size
+            records = np.empty(size, dtype=_QC_RECORD)
+            for name in _QC_COLUMNS:
+                records[name] = self.columns[name][start:end]
+            upto_id = int(records['id'][-1])
+            chunks.append({'after_id': self.chunked_upto, 'upto_id': upto_id, 'rows': size, 'data': records.tobytes()})
+            self.chunked_upto, self.chunked_rows = upto_id, end
+        if not chunks:
+            return
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(QCColumnChunk.__table__.insert(), chunks)
+        except (IntegrityError, OperationalError) as e:
+            app.logger.info('QC column chunks not stored: %s', e)
+
+    def _load_batch_meta(self, batch_ids):
+        missing = {int(b) for b in np.unique(batch_ids[~np.isnan(batch_ids)])} - set(self.batch_meta)
+        if not missing:
+            return
+        query = db.session.query(Batch.id, Batch.recipe_id, Batch.panel_type_id, PanelType.target_strength_mpa) \
+            .outerjoin(PanelType, PanelType.id == Batch.panel_type_id)
+        if len(missing) <= 500:
+            query = query.filter(Batch.id.in_(missing))
+        for batch_id, recipe_id, panel_type_id, target in query:
+            self.batch_meta[batch_id] = (recipe_id, panel_type_id, target)
+
+    def _recipe_ids(self, batch_ids):
+        """Vectorised batch_id -> recipe_id lookup (NaN for unknown batches or batches without a recipe)."""
+        if not self.batch_meta:
+            return np.full(len(batch_ids), np.nan)
+        # batch ids are dense integers, so a table indexed by id beats a sorted search
+        lookup = np.full(max(self.batch_meta) + 2, np.nan)
+        for b, (recipe_id, _, _) in self.batch_meta.items():
+            if recipe_id is not None:
+                lookup[b] = recipe_id
+        idx = np.nan_to_num(batch_ids, nan=-1).astype(np.int64)
+        idx[(idx < 0) | (idx >= len(lookup))] = len(lookup) - 1  # unknown -> the trailing NaN slot
+        return lookup[idx]
+
+    def _compute_batches(self, batches, cols):
+        for b, metrics in _stats_by_key(cols, 'batch_id').items():
+            recipe_id, panel_type_id, target = self.batch_meta.get(b, (None, None, None))
+            characteristic = metrics.get('compressive_mpa', {}).get('p05')
+            batches[b] = {
+                'batch_id': b,
+                'recipe_id': recipe_id,
+                'panel_type_id': panel_type_id,
+                'target_strength_mpa': target,
+                'characteristic_compressive_mpa': characteristic,
+                'meets_target': None if characteristic is None or target is None else characteristic >= target,
+                'metrics': metrics,
+            }
+        return batches
+
+    def _compute_recipes(self, recipes, batches, cols):
+        for r, metrics in _stats_by_key(cols, 'recipe_id').items():
+            recipes[r] = {
+                'recipe_id': r,
+                'characteristic_compressive_mpa': metrics.get('compressive_mpa', {}).get('p05'),
+                'characteristic_flexural_mpa': metrics.get('flexural_mpa', {}).get('p05'),
+                'metrics': metrics,
+            }
+        tested, below = {}, {}
+        for b in batches.values():
+            tested[b['recipe_id']] = tested.get(b['recipe_id'], 0) + 1
+            below[b['recipe_id']] = below.get(b['recipe_id'], 0) + (b['meets_target'] is False)
+        for r, recipe in recipes.items():
+            recipes[r] = dict(recipe, batches_tested=tested.get(r, 0), batches_below_target=below.get(r, 0))
+        return recipes
+
+_qc_analytics = {}  # database (partition key) -> QCAnalytics; ids and watermarks are per database
+
+def qc_analytics():
+    """The analytics cache of the database this request is routed to."""
+    return _qc_analytics.setdefault(current_partition(), QCAnalytics())
+
+@background_job
+def warm_qc_analytics():
+    """Load the analytics cache on a background thread, so the first analytics request after a worker
+    starts does not pay for the cold load. Only the main database's cache is warmed; each district's
+    loads on its first analytics request."""
+    if np is None or not app.config['ANALYTICS_WARM_ON_START']:
+        return
+
+    def warm():
+        try:
+            with app.app_context():
+                qc_analytics().refresh()
+        except Exception:
+            app.logger.exception('QC analytics warm-up failed')
+    threading.Thread(target=warm, name='qc-analytics-warm', daemon=True).start()
+
+def _refreshed_analytics():
+    """(analytics, None) with this database's cache brought up to date, or (None, error response).
+    A request never waits on another thread's refresh: it is served the results as they stand,
+    or a 503 with Retry-After while the first load (e.g. the start-up warm-up) is still running."""
+    if np is None:
+        return None, (jsonify({'status':'error','message':'numpy is required for analytics (pip install numpy)'}), 503)
+    analytics = qc_analytics()
+    if not analytics.refresh(block=False) and analytics.columns is None:
+        return None, (jsonify({'status':'error','message':'QC analytics are loading, retry shortly'}), 503,
+                      {'Retry-After': '1'})
+    return analytics, None
+
+def _analytics_response(analytics, items):
+    return jsonify({'status':'ok','qc_watermark':analytics.watermark,'items':items})
+
+@app.route('/api/analytics/batches')
+@single_database
+def api_analytics_batches():
+    """Per-batch QC statistics vs PanelType.target_strength_mpa.
+    Optional filters: ?batch_id=, ?recipe_id=, ?below_target=1
+    """
+    analytics, error = _refreshed_analytics()
+    if error:
+        return error
+    items = sorted(analytics.batches.values(), key=lambda b: b['batch_id'])
+    if request.args.get('batch_id', type=int) is not None:
+        items = [b for b in items if b['batch_id'] == request.args.get('batch_id', type=int)]
+    if request.args.get('recipe_id', type=int) is not None:
+        items = [b for b in items if b['recipe_id'] == request.args.get('recipe_id', type=int)]
+    if request.args.get('below_target') == '1':
+        items = [b for b in items if b['meets_target'] is False]
+    return _analytics_response(analytics, items)
+
+@app.route('/api/analytics/recipes')
+@single_database
+def api_analytics_recipes():
+    """Per-recipe QC statistics across all of the recipe's batches."""
+    analytics, error = _refreshed_analytics()
+    if error:
+        return error
+    return _analytics_response(analytics, sorted(analytics.recipes.values(), key=lambda r: r['recipe_id']))
+
+# -----------------
+# Spatial index for pilot sites (SQLite R*Tree kept in sync by triggers)
+# -----------------
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = 111.195
+_spatial = {'rtree': False}
+
+_RTREE_DDL = [
+    'CREATE VIRTUAL TABLE IF NOT EXISTS pilot_site_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)',
+    '''CREATE TRIGGER IF NOT EXISTS pilot_site_rtree_ai AFTER INSERT ON pilot_site
+       WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL BEGIN
+         INSERT INTO pilot_site_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS pilot_site_rtree_au AFTER UPDATE OF latitude, longitude ON pilot_site BEGIN
+         DELETE FROM pilot_site_rtree WHERE id = OLD.id;
+         INSERT INTO pilot_site_rtree SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+           WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS pilot_site_rtree_ad AFTER DELETE ON pilot_site BEGIN
+         DELETE FROM pilot_site_rtree WHERE id = OLD.id;
+       END''',
+    # index sites that existed before the R*Tree did
+    '''INSERT INTO pilot_site_rtree
+       SELECT id, latitude, latitude, longitude, longitude FROM pilot_site
+       WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND id NOT IN (SELECT id FROM pilot_site_rtree)''',
+]
+
+def init_site_spatial_index():
+    """Create the R*Tree and its triggers. Without R*Tree support (or on another database) queries
+    fall back to a range scan on ix_pilot_site_lat_lon."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    try:
+        with db.engine.begin() as conn:
+            for ddl in _RTREE_DDL:
+                conn.exec_driver_sql(ddl)
+        _spatial['rtree'] = True
+    except Exception as e:
+        app.logger.warning('R*Tree unavailable, nearby-site queries will use a range scan: %s', e)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+SITE_BBOX_PROBE_FACTOR = 50  # sites_in_bbox(limit=n) first checks the lowest n * 50 ids
+# CROSS JOIN keeps SQLite from driving the join off ix_pilot_site_lat_lon, which only narrows latitude.
+# The R*Tree stores 32-bit floats rounded outwards, so the exact columns are re-checked.
+_SITES_IN_BOX_SQL = (
+    'SELECT pilot_site.* FROM pilot_site_rtree CROSS JOIN pilot_site ON pilot_site.id = pilot_site_rtree.id '
+    'WHERE pilot_site_rtree.max_lat >= :min_lat AND pilot_site_rtree.min_lat <= :max_lat '
+    'AND pilot_site_rtree.max_lon >= :min_lon AND pilot_site_rtree.min_lon <= :max_lon '
+    'AND pilot_site.latitude BETWEEN :min_lat AND :max_lat AND pilot_site.longitude BETWEEN :min_lon AND :max_lon '
+    'ORDER BY pilot_site.id')
+
+def sites_in_bbox(min_lat, min_lon, max_lat, max_lon, limit=None):
+    """PilotSite rows whose coordinates fall inside the box, by id; the limit is applied in SQL."""
+    query = PilotSite.query.filter(PilotSite.latitude.between(min_lat, max_lat),
+                                   PilotSite.longitude.between(min_lon, max_lon))
+    if limit:
+        # A box covering most sites fills the page from the first rows by id, which is far cheaper than
+        # walking (and sorting) every R*Tree entry in it. Any lower id is among those rows, so the page is exact.
+        head = select(PilotSite.id).order_by(PilotSite.id).offset(limit * SITE_BBOX_PROBE_FACTOR - 1).limit(1)
+        sites = query.filter(PilotSite.id <= head.scalar_subquery()).order_by(PilotSite.id).limit(limit).all()
+        if len(sites) == limit:
+            return sites
+    if _spatial['rtree']:
+        params = {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon}
+        if limit:
+            return PilotSite.query.from_statement(text(_SITES_IN_BOX_SQL + ' LIMIT :limit')).params(params, limit=limit).all()
+        return PilotSite.query.from_statement(text(_SITES_IN_BOX_SQL)).params(params).all()
+    return (query.order_by(PilotSite.id).limit(limit) if limit else query).all()
+
+def sites_near(lat, lon, radius_km):
+    """[(distance_km, PilotSite)] within radius_km of (lat, lon), nearest first."""
+    dlat = radius_km / KM_PER_DEG_LAT
+    dlon = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+    found = []
+    for s in sites_in_bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon):
+        d = haversine_km(lat, lon, s.latitude, s.longitude)
+        if d <= radius_km:
+            found.append((d, s))
+    found.sort(key=lambda pair: (pair[0], pair[1].id))
+    return found
+
+def _site_summary(s, distance_km=None):
+    data = {'id': s.id, 'name': s.name, 'village': s.village, 'district': s.district,
+            'latitude': s.latitude, 'longitude': s.longitude}
+    if distance_km is not None:
+        data['distance_km'] = round(distance_km, 3)
+    return data
+
+def _float_args(*names):
+    try:
+        return [float(request.args[n]) for n in names]
+    except (KeyError, ValueError):
+        abort(400, '%s are required numbers' % ', '.join(names))
+
+@app.route('/api/sites/nearby')
+def api_sites_nearby():
+    """Sites within ?radius_km= (default 5) of ?lat=&lon=, nearest first, with distance_km.
+    ?installations=1 adds each site's installations; ?limit= caps the number of sites.
+    """
+    lat, lon = _float_args('lat', 'lon')
+    radius_km = request.args.get('radius_km', 5.0, type=float)
+    limit = min(max(request.args.get('limit', app.config['PAGE_SIZE'], type=int), 1), app.config['PAGE_SIZE_MAX'])
+    found = sites_near(lat, lon, radius_km)[:limit]
+    items = [_site_summary(s, d) for d, s in found]
+    if request.args.get('installations') == '1' and items:
+        by_site = {}
+        for it in Installation.query.filter(Installation.site_id.in_([i['id'] for i in items])).order_by(Installation.id):
+            by_site.setdefault(it.site_id, []).append(model_to_dict(it))
+        for item in items:
+            item['installations'] = by_site.get(item['id'], [])
+    return jsonify({'status':'ok','radius_km':radius_km,'items':items})
+
+@app.route('/api/sites/bbox')
+def api_sites_bbox():
+    """Sites inside ?min_lat=&min_lon=&max_lat=&max_lon= (at most ?limit=)."""
+    min_lat, min_lon, max_lat, max_lon = _float_args('min_lat', 'min_lon', 'max_lat', 'max_lon')
+    limit = min(max(request.args.get('limit', app.config['PAGE_SIZE_MAX'], type=int), 1), app.config['PAGE_SIZE_MAX'])
+    items = [_site_summary(s) for s in sites_in_bbox(min_lat, min_lon, max_lat, max_lon, limit)]
+    return jsonify({'status':'ok','items':items})
+
+# -----------------
+# Streaming exports (CSV / Parquet) for consultants: /export/<dataset>.<fmt> and `flask export`
+# -----------------
+def _installed_in_district(batch_id_col, district):
+    site = PilotSite.__table__
+    inst = Installation.__table__
+    return select(inst.c.id).join(site, site.c.id == inst.c.site_id) \
+        .where(inst.c.batch_id == batch_id_col, site.c.district == district).exists()
+
+def _export_query(dataset, date_from=None, date_to=None, district=None):
+    """SELECT for one export dataset with the date range and district filters pushed into SQL.
+    date_to is inclusive (whole day)."""
+    qc_t, batch_t, recipe_t = QCTest.__table__, Batch.__table__, Recipe.__table__
+    panel_t, site_t, inst_t = PanelType.__table__, PilotSite.__table__, Installation.__table__
+    if dataset == 'qc':
+        stmt, date_col = select(*qc_t.c), qc_t.c.tested_on
+        if district:
+            stmt = stmt.where(_installed_in_district(qc_t.c.batch_id, district))
+    elif dataset == 'batches':
+        stmt = select(*batch_t.c,
+                      recipe_t.c.name.label('recipe_name'), recipe_t.c.cement_percent, recipe_t.c.plastic_percent,
+                      panel_t.c.name.label('panel_type_name'), panel_t.c.target_strength_mpa) \
+            .select_from(batch_t.outerjoin(recipe_t, recipe_t.c.id == batch_t.c.recipe_id)
+                                .outerjoin(panel_t, panel_t.c.id == batch_t.c.panel_type_id))
+        date_col = batch_t.c.produced_on
+        if district:
+            stmt = stmt.where(_installed_in_district(batch_t.c.id, district))
+    elif dataset == 'installations':
+        stmt = select(*inst_t.c,
+                      site_t.c.name.label('site_name'), site_t.c.village, site_t.c.district,
+                      site_t.c.latitude, site_t.c.longitude) \
+            .select_from(inst_t.outerjoin(site_t, site_t.c.id == inst_t.c.site_id))
+        date_col = inst_t.c.installed_on
+        if district:
+            stmt = stmt.where(site_t.c.district == district)
+    else:
+        raise ValueError('unknown dataset %r (choose from %s)' % (dataset, ', '.join(EXPORT_DATASETS)))
+    if date_from:
+        stmt = stmt.where(date_col >= date_from)
+    if date_to:
+        stmt = stmt.where(date_col < date_to + timedelta(days=1))
+    stmt = stmt.order_by(date_col, stmt.selected_columns.id)
+    if partitions.spans():
+        # every database is exported in turn; ids repeat across them, so each row says where it came from
+        stmt = stmt.add_columns(bindparam('database', type_=db.String).label('database'))
+    return stmt
+
+EXPORT_DATASETS = ('qc', 'batches', 'installations')
+
+def _export_partitions(stmt):
+    """Yield lists of rows using a streaming cursor, app.config['EXPORT_CHUNK_ROWS'] at a time.
+    With no district chosen, the main database and then each district's are read."""
+    if partitions.spans():
+        sources = [(db.main_engine, {'database': 'main'})] + \
+                  [(partitions.engine(key), {'database': key}) for key in partitions.keys()]
+    else:
+        sources = [(db.engine, {})]
+    for engine, params in sources:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=app.config['EXPORT_CHUNK_ROWS']) \
+                .execute(stmt, params)
+            for rows in result.partitions():
+                yield rows
+
+def export_csv(stmt):
+    """Yield CSV text chunks (header first), one per partition of rows."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([c.name for c in stmt.selected_columns])
+    for rows in _export_partitions(stmt):
+        writer.writerows(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever pyarrow wrote since the last drain()."""
+    closed = False
+
+    def __init__(self):
+        self.parts, self.pos = [], 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+def export_parquet(stmt):
+    """Yield Parquet bytes: one row group per partition of rows, then the footer."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrow_types = {int: pa.int64(), float: pa.float64(), datetime: pa.timestamp('us'), str: pa.string()}
+    schema = pa.schema([(c.name, arrow_types.get(c.type.python_type, pa.string())) for c in stmt.selected_columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for rows in _export_partitions(stmt):
+        columns = list(zip(*rows))
+        writer.write_table(pa.table([pa.array(col, type=f.type) for col, f in zip(columns, schema)], schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+EXPORT_FORMATS = {'csv': (export_csv, 'text/csv'), 'parquet': (export_parquet, 'application/vnd.apache.parquet')}
+
+def _parse_day(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        raise ValueError('%s must be YYYY-MM-DD' % name)
+
+@app.route('/export/<dataset>.<fmt>')
+def export_dataset(dataset, fmt):
+    """Stream a dataset as CSV or Parquet. Filters: ?from=YYYY-MM-DD&to=YYYY-MM-DD&district="""
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'status':'error','message':'format must be csv or parquet'}), 400
+    try:
+        stmt = _export_query(dataset, _parse_day(request.args.get('from'), 'from'),
+                             _parse_day(request.args.get('to'), 'to'), request.args.get('district'))
+    except ValueError as e:
+        return jsonify({'status':'error','message':str(e)}), 400
+    writer, mimetype = EXPORT_FORMATS[fmt]
+    if fmt == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        return jsonify({'status':'error','message':'pyarrow is required for Parquet export (pip install pyarrow)'}), 503
+    response = app.response_class(stream_with_context(writer(stmt)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (dataset, fmt)
+    return response
+
+@app.cli.command('export')
+@click.argument('dataset', type=click.Choice(EXPORT_DATASETS))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv')
+@click.option('--output', '-o', default='-', help='File to write (default: stdout).')
+@click.option('--from', 'date_from', help='First day, YYYY-MM-DD.')
+@click.option('--to', 'date_to', help='Last day, YYYY-MM-DD.')
+@click.option('--district')
+def export_command(dataset, fmt, output, date_from, date_to, district):
+    """Export qc, batches or installations as CSV or Parquet."""
+    try:
+        stmt = _export_query(dataset, _parse_day(date_from, '--from'), _parse_day(date_to, '--to'), district)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    stream = click.open_file(output, 'w' if fmt == 'csv' else 'wb')
+    with stream:
+        for chunk in EXPORT_FORMATS[fmt][0](stmt):
+            stream.write(chunk)
+
+# -----------------
+# Search: SQLite FTS5 index over recipes, panel types, batches and sites, kept in sync by triggers
+# -----------------
+_search = {'fts': False}
+
+# kind -> (table, rowid code, label, detail shown under the label, extra searchable text, columns whose update reindexes)
+# Expressions use {t} for the row (NEW in triggers, the table itself in the backfill). rowid = id * 4 + code.
+SEARCH_SOURCES = {
+    'recipe': ('recipe', 0, "{t}.name", "COALESCE({t}.additives, '')", "COALESCE({t}.notes, '')",
+               'name, additives, notes'),
+    'panel_type': ('panel_type', 1, "{t}.name", "''", "COALESCE({t}.notes, '')", 'name, notes'),
+    'batch': ('batch', 2, "'Batch ' || {t}.id",
+              "COALESCE((SELECT name FROM recipe WHERE id = {t}.recipe_id), '') || ' / ' || "
+              "COALESCE((SELECT name FROM panel_type WHERE id = {t}.panel_type_id), '')",
+              "COALESCE({t}.status, '')", 'recipe_id, panel_type_id, status'),
+    'site': ('pilot_site', 3, "{t}.name", "COALESCE({t}.village, '') || ', ' || COALESCE({t}.district, '')",
+             "COALESCE({t}.notes, '')", 'name, village, district, notes'),
+}
+
+def _search_ddl():
+    ddl = ["CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+           "kind UNINDEXED, ref UNINDEXED, label, detail, body, tokenize='unicode61', prefix='2 3')"]
+    for kind, (table, code, label, detail, body, columns) in SEARCH_SOURCES.items():
+        values = "%s.id * 4 + %d, '%s', %s.id, %s, %s, %s" % (
+            '{t}', code, kind, '{t}', label, detail, body)
+        new_values = values.format(t='NEW')
+        ddl += [
+            'CREATE TRIGGER IF NOT EXISTS search_%s_ai AFTER INSERT ON %s BEGIN '
+            'INSERT INTO search_fts (rowid, kind, ref, label, detail, body) VALUES (%s); END' % (kind, table, new_values),
+            'CREATE TRIGGER IF NOT EXISTS search_%s_au AFTER UPDATE OF %s ON %s BEGIN '
+            'DELETE FROM search_fts WHERE rowid = OLD.id * 4 + %d; '
+            'INSERT INTO search_fts (rowid, kind, ref, label, detail, body) VALUES (%s); END'
+            % (kind, columns, table, code, new_values),
+            'CREATE TRIGGER IF NOT EXISTS search_%s_ad AFTER DELETE ON %s BEGIN '
+            'DELETE FROM search_fts WHERE rowid = OLD.id * 4 + %d; END' % (kind, table, code),
+            # index rows that existed before the search index did
+            'INSERT INTO search_fts (rowid, kind, ref, label, detail, body) SELECT %s FROM %s '
+            'WHERE %s.id * 4 + %d NOT IN (SELECT rowid FROM search_fts)' % (values.format(t=table), table, table, code),
+        ]
+    return ddl
+
+def init_search_index():
+    """Create the FTS5 index and its triggers. Without FTS5 (or on another database) /api/search falls back to LIKE."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    try:
+        with db.engine.begin() as conn:
+            for ddl in _search_ddl():
+                conn.exec_driver_sql(ddl)
+        _search['fts'] = True
+    except Exception as e:
+        app.logger.warning('FTS5 unavailable, search will use LIKE scans: %s', e)
+
+def _search_label(kind, obj):
+    """(label, detail) for a row, matching what the FTS triggers store."""
+    if kind == 'batch':
+        return 'Batch %d' % obj.id, '%s / %s' % (obj.recipe.name if obj.recipe else '', obj.panel_type.name if obj.panel_type else '')
+    if kind == 'site':
+        return obj.name, '%s, %s' % (obj.village or '', obj.district or '')
+    return obj.name, (obj.additives or '') if kind == 'recipe' else ''
+
+_SEARCH_MODELS = {'recipe': Recipe, 'panel_type': PanelType, 'batch': Batch, 'site': PilotSite}
+
+def _kind_query(kind):
+    model = _SEARCH_MODELS[kind]
+    if kind == 'batch':
+        return model.query.options(joinedload(Batch.recipe), joinedload(Batch.panel_type))
+    return model.query
+
+def _like_search(terms, kinds, limit):
+    """Fallback: every term must appear (LIKE, case-insensitive for ASCII) in one of the row's text columns."""
+    items = []
+    for kind in kinds:
+        model = _SEARCH_MODELS[kind]
+        query = _kind_query(kind)
+        for term in terms:
+            pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            if kind == 'batch':
+                columns = [db.literal('Batch ').concat(db.cast(Batch.id, db.String)), Batch.status]
+            else:
+                columns = [getattr(model, c) for c in ('name', 'village', 'district', 'additives', 'notes') if hasattr(model, c)]
+            query = query.filter(db.or_(*[c.like(pattern, escape='\\') for c in columns]))
+        for obj in query.order_by(model.id.desc()).limit(limit - len(items)):
+            label, detail = _search_label(kind, obj)
+            items.append({'kind': kind, 'id': obj.id, 'label': label, 'detail': detail})
+        if len(items) >= limit:
+            break
+    return items
+
+def search(q, kinds, limit):
+    """Ranked matches for a typeahead query: every word of `q` as a prefix, label matches weighted 10x."""
+    terms = re.findall(r'\w+', q.lower())[:8]
+    if not terms:
+        return []
+    if not _search['fts']:
+        return _like_search(terms, kinds, limit)
+    match = ' '.join('"%s"*' % t for t in terms)
+    sql = ('SELECT kind, ref, label, detail FROM search_fts WHERE search_fts MATCH :match AND kind IN (%s) '
+           'ORDER BY bm25(search_fts, 0.0, 0.0, 10.0, 1.0, 1.0) LIMIT :limit') % ', '.join(
+               ':k%d' % i for i in range(len(kinds)))
+    params = dict({'match': match, 'limit': limit}, **{'k%d' % i: k for i, k in enumerate(kinds)})
+    return [{'kind': kind, 'id': ref, 'label': label, 'detail': detail}
+            for kind, ref, label, detail in db.session.execute(text(sql), params)]
+
+def search_options(kind, n=None):
+    """(id, text) for the newest rows of a kind: the choices a typeahead shows before anything is typed."""
+    rows = _kind_query(kind).order_by(_SEARCH_MODELS[kind].id.desc()).limit(n or app.config['SEARCH_PRELOAD']).all()
+    options = []
+    for obj in rows:
+        label, detail = _search_label(kind, obj)
+        options.append((obj.id, '%s (%s)' % (label, detail) if detail.strip(' /,') else label))
+    return options
+
+@app.route('/api/search')
+def api_search():
+    """Typeahead search. ?q= words matched as prefixes; ?kind=recipe,panel_type,batch,site (default all); ?limit= (max 50)."""
+    kinds = [k for k in request.args.get('kind', ','.join(SEARCH_SOURCES)).split(',') if k]
+    if not kinds or any(k not in SEARCH_SOURCES for k in kinds):
+        return jsonify({'status':'error','message':'kind must be one or more of %s' % ', '.join(SEARCH_SOURCES)}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    result = {'status':'ok','items':search(request.args.get('q', ''), kinds, limit)}
+    if partitions.spans():
+        # forms used without a district write to the main database, so their typeahead searches it; say so
+        result['database'] = 'main'
+    return jsonify(result)
+
+# Form field that offers the newest rows and fetches matches from /api/search while the user types
+templates['_typeahead.html'] = '''{% macro typeahead_field(name, kind, label, options) %}
+    <div class="mb-3"><label>{{label}}</label>
+      <input class="form-control" name="{{name}}" list="{{name}}-options" data-search-kind="{{kind}}" autocomplete="off"
+             pattern="[0-9]+" title="Type to search, then pick an entry" placeholder="Type to search" required>
+      <datalist id="{{name}}-options">{% for value, text in options %}<option value="{{value}}" label="{{text}}">{{text}}</option>{% endfor %}</datalist>
+    </div>
+    {% endmacro %}
+    {% macro typeahead_script() %}
+    <script>
+    document.querySelectorAll('input[data-search-kind]').forEach(function (input) {
+      var list = document.getElementById(input.getAttribute('list')), timer = null;
+      input.addEventListener('input', function () {
+        clearTimeout(timer);
+        if (!input.value || !isNaN(input.value)) { return; }  // empty, or an id picked from the list
+        timer = setTimeout(function () {
+          fetch('/api/search?limit=15&kind=' + input.dataset.searchKind + '&q=' + encodeURIComponent(input.value))
+            .then(function (resp) { return resp.json(); })
+            .then(function (data) {
+              list.innerHTML = '';
+              data.items.forEach(function (item) {
+                var option = document.createElement('option');
+                option.value = item.id;
+                option.label = option.textContent = item.label + (item.detail ? ' (' + item.detail + ')' : '');
+                list.appendChild(option);
+              });
+            });
+        }, 200);
+      });
+    });
+    </script>
+    {% endmacro %}
+    '''
+
+# -----------------
+# Panel inventory ledger (running stock per batch and per site)
+# -----------------
+def _stock_upsert(model, key, deltas):
+    """INSERT ... ON CONFLICT DO UPDATE adding `deltas` ({key_value: {column: delta}}) to the ledger rows."""
+    table = model.__table__
+    rows = [dict({key: k}, **d) for k, d in deltas.items()]
+    if not rows:
+        return []
+    columns = [c for c in rows[0] if c != key]
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=[key],
+                                      set_={c: table.c[c] + stmt.excluded[c] for c in columns})
+    return [(stmt, rows)]
+
+@event.listens_for(Session, 'after_flush')
+def _post_inventory_movements(db_session, flush_context):
+    """Apply inserted/deleted batches and installations to the ledger inside the same transaction.
+    (Edits to quantity/panels_installed of existing rows are not tracked; `flask inventory rebuild` fixes drift.)"""
+    batches, sites = {}, {}
+    for objs, sign in ((db_session.new, 1), (db_session.deleted, -1)):
+        for obj in objs:
+            if isinstance(obj, Batch) and obj.id is not None:
+                row = batches.setdefault(obj.id, {'produced': 0, 'installed': 0})
+                row['produced'] += sign * (obj.quantity or 0)
+            elif isinstance(obj, Installation):
+                panels = sign * (obj.panels_installed or 0)
+                if obj.batch_id is not None:
+                    row = batches.setdefault(obj.batch_id, {'produced': 0, 'installed': 0})
+                    row['installed'] += panels
+                if obj.site_id is not None:
+                    row = sites.setdefault(obj.site_id, {'installed': 0, 'installations': 0})
+                    row['installed'] += panels
+                    row['installations'] += sign
+    if not batches and not sites:
+        return
+    conn = db_session.connection()
+    for stmt, rows in _stock_upsert(BatchStock, 'batch_id', batches) + _stock_upsert(SiteStock, 'site_id', sites):
+        conn.execute(stmt, rows)
+
+_EXPECTED_BATCH_STOCK = '''
+    SELECT id, SUM(produced), SUM(installed) FROM (
+        SELECT id, COALESCE(quantity, 0) AS produced, 0 AS installed FROM batch
+        UNION ALL
+        SELECT batch_id, 0, COALESCE(panels_installed, 0) FROM installation WHERE batch_id IS NOT NULL
+    ) GROUP BY id
+'''
+_EXPECTED_SITE_STOCK = '''
+    SELECT site_id, SUM(COALESCE(panels_installed, 0)), COUNT(*) FROM installation
+    WHERE site_id IS NOT NULL GROUP BY site_id
+'''
+
+def rebuild_inventory():
+    """Recompute the ledger from batch and installation rows in one transaction."""
+    conn = db.session.connection()
+    conn.execute(BatchStock.__table__.delete())
+    conn.execute(SiteStock.__table__.delete())
+    conn.exec_driver_sql('INSERT INTO batch_stock (batch_id, produced, installed) ' + _EXPECTED_BATCH_STOCK)
+    conn.exec_driver_sql('INSERT INTO site_stock (site_id, installed, installations) ' + _EXPECTED_SITE_STOCK)
+    db.session.commit()
+
+def verify_inventory():
+    """List of human-readable differences between the ledger and a fresh recomputation."""
+    conn = db.session.connection()
+    problems = []
+    for label, expected_sql, table, cols in (
+            ('batch', _EXPECTED_BATCH_STOCK, BatchStock.__table__, ('produced', 'installed')),
+            ('site', _EXPECTED_SITE_STOCK, SiteStock.__table__, ('installed', 'installations'))):
+        expected = {row[0]: tuple(row[1:]) for row in conn.exec_driver_sql(expected_sql)}
+        actual = {row[0]: tuple(row[1:]) for row in conn.execute(select(list(table.c)[0], *[table.c[c] for c in cols]))}
+        for key in sorted(set(expected) | set(actual)):
+            want = expected.get(key, (0,) * len(cols))
+            have = actual.get(key, (0,) * len(cols))
+            if want != have:
+                problems.append('%s %s: ledger %s, recomputed %s' % (label, key, dict(zip(cols, have)), dict(zip(cols, want))))
+    return problems
+
+def init_inventory():
+    """Build the ledger once for databases that predate it."""
+    if not BatchStock.query.first() and (Batch.query.first() or Installation.query.first()):
+        rebuild_inventory()
+
+def _batch_stock_dict(stock, batch_id):
+    produced, installed = (stock.produced, stock.installed) if stock else (0, 0)
+    return {'batch_id': batch_id, 'produced': produced, 'installed': installed, 'in_yard': produced - installed}
+
+def overdraw_warning(batch_id, panels):
+    """Warning text if installing `panels` from the batch would exceed what is left in the yard, else None."""
+    stock = db.session.get(BatchStock, batch_id)
+    in_yard = stock.produced - stock.installed if stock else 0
+    if panels and panels > in_yard:
+        return 'installing %d panels over-draws batch %s (%d left in the yard)' % (panels, batch_id, in_yard)
+    return None
+
+@app.route('/api/inventory/batches/<int:id>')
+@single_database
+def api_inventory_batch(id):
+    """Panels produced, installed and still in the yard for one batch."""
+    return jsonify(dict(_batch_stock_dict(db.session.get(BatchStock, id), id), status='ok'))
+
+@app.route('/api/inventory/sites/<int:id>')
+@single_database
+def api_inventory_site(id):
+    """Panels installed at one site, and the number of installations."""
+    stock = db.session.get(SiteStock, id)
+    return jsonify({'status':'ok','site_id':id,'installed':stock.installed if stock else 0,
+                    'installations':stock.installations if stock else 0})
+
+@app.route('/api/inventory/batches')
+@single_database
+def api_inventory_batches():
+    """Ledger rows for all batches, keyset-paginated by batch id (?cursor=&limit=)."""
+    items, next_cursor = keyset_page(BatchStock.query, [BatchStock.batch_id])
+    return jsonify({'items':[_batch_stock_dict(s, s.batch_id) for s in items],'next_cursor':next_cursor})
+
+inventory_cli = AppGroup('inventory', help='Maintain the panel inventory ledger.')
+
+@inventory_cli.command('rebuild')
+def inventory_rebuild_command():
+    """Recompute every ledger row from batches and installations."""
+    create_tables()
+    rebuild_inventory()
+    click.echo('inventory ledger rebuilt')
+
+@inventory_cli.command('verify')
+def inventory_verify_command():
+    """Compare the ledger with a recomputation; exits 1 on any difference."""
+    create_tables()
+    problems = verify_inventory()
+    for p in problems:
+        click.echo(p)
+    if problems:
+        raise SystemExit(1)
+    click.echo('inventory ledger OK')
+
+app.cli.add_command(inventory_cli)
+
+# -----------------
+# Offline sync for the field app: change versions and idempotent uploads
+# -----------------
+SYNC_MODELS = [Recipe, PanelType, Batch, PilotSite]
+
+def _next_sync_version(conn, n=1):
+    """Reserve `n` change versions and return the highest; the reserved range is (result - n, result]."""
+    table = SyncVersion.__table__
+    stmt = sqlite_insert(table).values(id=1, value=n)
+    stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={'value': table.c.value + n}).returning(table.c.value)
+    return conn.execute(stmt).scalar()
+
+@event.listens_for(Session, 'before_flush')
+def _stamp_row_versions(db_session, flush_context, instances):
+    """Give every new or modified catalog row the next change version, inside the writing transaction.
+    SQLite runs one writer at a time, so versions become visible in increasing order."""
+    changed = [obj for obj in db_session.new if isinstance(obj, tuple(SYNC_MODELS))]
+    changed += [obj for obj in db_session.dirty if isinstance(obj, tuple(SYNC_MODELS)) and db_session.is_modified(obj)]
+    if not changed:
+        return
+    version = _next_sync_version(db_session.connection())
+    for obj in changed:
+        obj.row_version = version
+
+def init_sync_versions():
+    """Version rows that have none (older databases, Core bulk inserts), one distinct version per row."""
+    conn = db.session.connection()
+    for model in SYNC_MODELS:
+        table = model.__table__
+        pending, max_id = conn.execute(select(db.func.count(), db.func.max(table.c.id))
+                                       .where(table.c.row_version.is_(None))).one()
+        if not pending:
+            continue
+        base = _next_sync_version(conn, max_id) - max_id
+        conn.execute(table.update().where(table.c.row_version.is_(None)).values(row_version=base + table.c.id))
+    db.session.commit()
+
+def sync_changes(since, limit):
+    """Catalog rows changed after version `since`, at most about `limit` per table.
+    Returns (changes by table name, version reached, whether more changes remain)."""
+    current = db.session.get(SyncVersion, 1)
+    current = current.value if current else 0
+    upto = current
+    for model in SYNC_MODELS:
+        # version of the limit-th change in this table; stop the page there so no table is cut mid-version
+        nth = db.session.query(model.row_version).filter(model.row_version > since) \
+            .order_by(model.row_version).offset(limit - 1).limit(1).scalar()
+        if nth is not None:
+            upto = min(upto, nth)
+    changes = {}
+    for model in SYNC_MODELS:
+        rows = model.query.filter(model.row_version > since, model.row_version <= upto) \
+            .order_by(model.row_version, model.id).all()
+        changes[model.__table__.name] = [model_to_dict(r) for r in rows]
+    return changes, upto, upto < current
+
+@app.route('/api/sync')
+@single_database
+def api_sync():
+    """Catalog changes for the field app since ?since=<version> (0 for a full download).
+    Store the returned version and ask again with it; repeat while more is true."""
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', app.config['PAGE_SIZE_MAX'], type=int), 1), app.config['PAGE_SIZE_MAX'])
+    changes, version, more = sync_changes(since, limit)
+    return jsonify({'status':'ok','since':since,'version':version,'more':more,'changes':changes})
+
+# upload list name -> report kind (see REPORT_KINDS)
+SYNC_UPLOADS = {'installations': 'field', 'qc_tests': 'qc'}
+
+@app.route('/api/sync/upload', methods=['POST'])
+def api_sync_upload():
+    """Reports recorded offline, each with a client-generated idempotency_key:
+    {installations: [{idempotency_key, site_id, batch_id, installed_panels}], qc_tests: [{idempotency_key, batch_id, ...}]}
+    Re-sending an item returns the row created the first time (duplicate: true) instead of inserting it again.
+    Items are validated like single reports; if any is invalid nothing is stored and the 400 lists each error.
+    """
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'status':'error','message':'body must be a JSON object'}), 400
+    items = {name: data.get(name) or [] for name in SYNC_UPLOADS}
+    for name, batch in items.items():
+        if not isinstance(batch, list):
+            return jsonify({'status':'error','message':'%s must be a list' % name}), 400
+    if any(not isinstance(i, dict) or not i.get('idempotency_key') for batch in items.values() for i in batch):
+        return jsonify({'status':'error','message':'every item needs an idempotency_key'}), 400
+    errors = []
+    for name, kind in SYNC_UPLOADS.items():
+        for index, item in enumerate(items[name]):
+            try:
+                items[name][index] = validate_report(kind, item)
+            except ValueError as e:
+                errors.append({'list':name,'index':index,'idempotency_key':item['idempotency_key'],'message':str(e)})
+    if errors:
+        return jsonify({'status':'error','message':'%d invalid item(s)' % len(errors),'errors':errors}), 400
+    result = {'status':'ok'}
+    received_at = datetime.utcnow()
+    for name, kind in SYNC_UPLOADS.items():
+        model, values = REPORT_KINDS[kind]
+        rows = insert_reports_once(model, [values(i, received_at) for i in items[name]])
+        result[name] = [{'idempotency_key':i['idempotency_key'],'id':row_id,'duplicate':duplicate}
+                        for i, (row_id, duplicate) in zip(items[name], rows)]
+    return jsonify(result)
+
+# -----------------
+# Time-series rollups of QC strength and production (day / week / month)
+# -----------------
+ROLLUP_GRAINS = ('day', 'week', 'month')
+# SQLite expressions bucketing a timestamp column into the same period starts as _period_starts()
+_GRAIN_SQL = {'day': "date(%s)", 'week': "date(%s, 'weekday 0', '-6 days')", 'month': "date(%s, 'start of month')"}
+_QC_ROLLUP_SUMS = ('tests', 'comp_n', 'comp_sum', 'comp_sumsq', 'flex_n', 'flex_sum', 'flex_sumsq')
+_PRODUCTION_ROLLUP_SUMS = ('batches', 'panels')
+
+def _period_starts(moment):
+    """{grain: first day of the period containing `moment`}; weeks start on Monday."""
+    day = moment.date()
+    return {'day': day, 'week': day - timedelta(days=day.weekday()), 'month': day.replace(day=1)}
+
+def _add_rollup(deltas, moment, recipe_id, panel_type_id, values):
+    for grain, start in _period_starts(moment).items():
+        row = deltas.setdefault((grain, start, recipe_id or 0, panel_type_id or 0), dict.fromkeys(values, 0))
+        for name, value in values.items():
+            row[name] += value
+
+def _upsert_rollups(conn, model, deltas):
+    """Add `deltas` ({(grain, period_start, recipe_id, panel_type_id): {column: delta}}) to the rollup rows."""
+    if not deltas:
+        return
+    table = model.__table__
+    keys = ('grain', 'period_start', 'recipe_id', 'panel_type_id')
+    rows = [dict(zip(keys, key), **values) for key, values in deltas.items()]
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=list(keys),
+                                      set_={c: table.c[c] + stmt.excluded[c] for c in rows[0] if c not in keys})
+    conn.execute(stmt, rows)
+
+def _qc_rollup_values(compressive, flexural, sign=1):
+    comp, flex = compressive is not None, flexural is not None
+    return {'tests': sign, 'comp_n': sign * comp, 'comp_sum': sign * (compressive or 0.0),
+            'comp_sumsq': sign * (compressive or 0.0) ** 2, 'flex_n': sign * flex,
+            'flex_sum': sign * (flexural or 0.0), 'flex_sumsq': sign * (flexural or 0.0) ** 2}
+
+def rollup_qc_rows(conn, rows, sign=1):
+    """Add QC results (dicts with batch_id, tested_on, compressive_mpa, flexural_mpa) to the QC rollups.
+    Called from the flush hook and explicitly by Core inserts such as the bulk upload."""
+    rows = [r for r in rows if r.get('tested_on') is not None]
+    batch_ids = {r['batch_id'] for r in rows if r.get('batch_id') is not None}
+    dims = {}
+    if batch_ids:
+        dims = {bid: (recipe_id, panel_type_id) for bid, recipe_id, panel_type_id in conn.execute(
+            select(Batch.id, Batch.recipe_id, Batch.panel_type_id).where(Batch.id.in_(batch_ids)))}
+    deltas = {}
+    for r in rows:
+        recipe_id, panel_type_id = dims.get(r.get('batch_id'), (0, 0))
+        _add_rollup(deltas, r['tested_on'], recipe_id, panel_type_id,
+                    _qc_rollup_values(r.get('compressive_mpa'), r.get('flexural_mpa'), sign))
+    _upsert_rollups(conn, QCRollup, deltas)
+
+@event.listens_for(Session, 'after_flush')
+def _update_rollups(db_session, flush_context):
+    """Fold inserted/deleted QC results and batches into the rollups, inside the writing transaction."""
+    qc_rows, production = [], {}
+    for objs, sign in ((db_session.new, 1), (db_session.deleted, -1)):
+        for obj in objs:
+            if isinstance(obj, QCTest):
+                qc_rows.append((sign, {'batch_id': obj.batch_id, 'tested_on': obj.tested_on,
+                                       'compressive_mpa': obj.compressive_mpa, 'flexural_mpa': obj.flexural_mpa}))
+            elif isinstance(obj, Batch) and obj.produced_on is not None:
+                _add_rollup(production, obj.produced_on, obj.recipe_id, obj.panel_type_id,
+                            {'batches': sign, 'panels': sign * (obj.quantity or 0)})
+    if not qc_rows and not production:
+        return
+    conn = db_session.connection()
+    for sign in (1, -1):
+        rows = [r for s, r in qc_rows if s == sign]
+        if rows:
+            rollup_qc_rows(conn, rows, sign)
+    _upsert_rollups(conn, ProductionRollup, production)
+
+def rebuild_rollups():
+    """Recompute every rollup row from qc_test and batch in one transaction."""
+    conn = db.session.connection()
+    conn.execute(QCRollup.__table__.delete())
+    conn.execute(ProductionRollup.__table__.delete())
+    for grain in ROLLUP_GRAINS:
+        conn.exec_driver_sql('''
+            INSERT INTO qc_rollup (grain, period_start, recipe_id, panel_type_id, %s)
+            SELECT ?, %s AS period, COALESCE(b.recipe_id, 0) AS r, COALESCE(b.panel_type_id, 0) AS p, COUNT(*),
+                   COUNT(q.compressive_mpa), TOTAL(q.compressive_mpa), TOTAL(q.compressive_mpa * q.compressive_mpa),
+                   COUNT(q.flexural_mpa), TOTAL(q.flexural_mpa), TOTAL(q.flexural_mpa * q.flexural_mpa)
+            FROM qc_test q LEFT JOIN batch b ON b.id = q.batch_id
+            WHERE q.tested_on IS NOT NULL
+            GROUP BY period, r, p''' % (', '.join(_QC_ROLLUP_SUMS), _GRAIN_SQL[grain] % 'q.tested_on'), (grain,))
+        conn.exec_driver_sql('''
+            INSERT INTO production_rollup (grain, period_start, recipe_id, panel_type_id, batches, panels)
+            SELECT ?, %s AS period, COALESCE(recipe_id, 0) AS r, COALESCE(panel_type_id, 0) AS p,
+                   COUNT(*), COALESCE(SUM(quantity), 0)
+            FROM batch WHERE produced_on IS NOT NULL
+            GROUP BY period, r, p''' % (_GRAIN_SQL[grain] % 'produced_on'), (grain,))
     db.session.commit()
-    return jsonify({'status':'ok','installation_id':it.id})
+
+def init_rollups():
+    """Build the rollups once for databases that predate them."""
+    if not ProductionRollup.query.first() and Batch.query.first():
+        rebuild_rollups()
+
+def _std(n, total, sumsq):
+    if n < 2:
+        return None
+    return math.sqrt(max(sumsq - total * total / n, 0.0) / (n - 1))
+
+# ?by= -> rollup dimension columns kept in the output (the others are summed over)
+TREND_GROUPS = {'recipe': ('recipe_id',), 'panel_type': ('panel_type_id',),
+                'recipe_panel_type': ('recipe_id', 'panel_type_id'), 'all': ()}
+
+def _trend_rows(model, sums, grain, by, start, end, recipe_id, panel_type_id):
+    table = model.__table__
+    dims = [table.c[d] for d in TREND_GROUPS[by]]
+    query = select(table.c.period_start, *dims, *[db.func.sum(table.c[s]).label(s) for s in sums]) \
+        .where(table.c.grain == grain)
+    if start:
+        query = query.where(table.c.period_start >= start)
+    if end:
+        query = query.where(table.c.period_start <= end)
+    if recipe_id is not None:
+        query = query.where(table.c.recipe_id == recipe_id)
+    if panel_type_id is not None:
+        query = query.where(table.c.panel_type_id == panel_type_id)
+    query = query.group_by(table.c.period_start, *dims).order_by(table.c.period_start, *dims)
+    return db.session.execute(query).mappings().all()
+
+def _trend_totals(model, sums, *filters):
+    """_trend_rows(), summed over every database when the request spans districts (the rollups hold sums,
+    so merging them is exact)."""
+    if not partitions.spans():
+        return _trend_rows(model, sums, *filters)
+    merged = {}
+    for rows in partitions.fan_out(lambda: [dict(r) for r in _trend_rows(model, sums, *filters)]):
+        for row in rows:
+            key = tuple(v for k, v in row.items() if k not in sums)
+            if key in merged:
+                for s in sums:
+                    merged[key][s] = (merged[key][s] or 0) + (row[s] or 0)
+            else:
+                merged[key] = row
+    return [merged[k] for k in sorted(merged, key=lambda k: tuple((v is None, v) for v in k))]
+
+@app.route('/api/trends')
+def api_trends():
+    """QC strength and production volume per period from the rollup tables.
+    ?grain=day|week|month (default week), ?by=recipe|panel_type|recipe_panel_type|all (default recipe),
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD on the period start, optional ?recipe_id= and ?panel_type_id= filters.
+    Only rollup rows are read, so cost depends on the range asked for, not on the number of QC tests.
+    """
+    grain = request.args.get('grain', 'week')
+    by = request.args.get('by', 'recipe')
+    if grain not in ROLLUP_GRAINS or by not in TREND_GROUPS:
+        return jsonify({'status':'error','message':'grain must be day, week or month; by must be one of %s'
+                        % ', '.join(sorted(TREND_GROUPS))}), 400
+    try:
+        start = _parse_day(request.args.get('from'), 'from')
+        end = _parse_day(request.args.get('to'), 'to')
+    except ValueError as e:
+        return jsonify({'status':'error','message':str(e)}), 400
+    filters = (grain, by, start and start.date(), end and end.date(),
+               request.args.get('recipe_id', type=int), request.args.get('panel_type_id', type=int))
+    qc = []
+    for row in _trend_totals(QCRollup, _QC_ROLLUP_SUMS, *filters):
+        item = {'period': row['period_start'].isoformat(), 'tests': row['tests']}
+        item.update((d, row[d]) for d in TREND_GROUPS[by])
+        for metric, prefix in (('compressive', 'comp'), ('flexural', 'flex')):
+            n = row[prefix + '_n']
+            item[metric + '_mean'] = row[prefix + '_sum'] / n if n else None
+            item[metric + '_std'] = _std(n, row[prefix + '_sum'], row[prefix + '_sumsq'])
+        qc.append(item)
+    production = []
+    for row in _trend_totals(ProductionRollup, _PRODUCTION_ROLLUP_SUMS, *filters):
+        item = {'period': row['period_start'].isoformat(), 'batches': row['batches'], 'panels': row['panels']}
+        item.update((d, row[d]) for d in TREND_GROUPS[by])
+        production.append(item)
+    return jsonify({'status':'ok','grain':grain,'by':by,'qc':qc,'production':production})
+
+rollups_cli = AppGroup('rollups', help='Maintain the QC and production trend rollups.')
+
+@rollups_cli.command('backfill')
+def rollups_backfill_command():
+    """Recompute all rollups from the full QC and batch history."""
+    create_tables()
+    started = time.perf_counter()
+    rebuild_rollups()
+    click.echo('rollups rebuilt in %.1fs' % (time.perf_counter() - started))
+
+app.cli.add_command(rollups_cli)
+
+# -----------------
+# Traceability: QC test -> batch -> recipe / panel type -> installations -> pilot sites
+# -----------------
+@event.listens_for(Session, 'after_flush')
+def _update_trace(db_session, flush_context):
+    """Fold inserted/deleted installations into batch_site_trace, inside the writing transaction.
+    (A deleted installation does not narrow first/last_installed_on; `flask trace rebuild` does.)"""
+    moves = [(obj, sign) for objs, sign in ((db_session.new, 1), (db_session.deleted, -1)) for obj in objs
+             if isinstance(obj, Installation) and obj.batch_id is not None and obj.site_id is not None]
+    if not moves:
+        return
+    conn = db_session.connection()
+    dims = {bid: (recipe_id, panel_type_id) for bid, recipe_id, panel_type_id in conn.execute(
+        select(Batch.id, Batch.recipe_id, Batch.panel_type_id).where(Batch.id.in_({o.batch_id for o, _ in moves})))}
+    rows = {}
+    for obj, sign in moves:
+        recipe_id, panel_type_id = dims.get(obj.batch_id, (None, None))
+        row = rows.setdefault((obj.batch_id, obj.site_id), {
+            'batch_id': obj.batch_id, 'site_id': obj.site_id, 'recipe_id': recipe_id, 'panel_type_id': panel_type_id,
+            'panels': 0, 'installations': 0, 'first_installed_on': obj.installed_on, 'last_installed_on': obj.installed_on})
+        row['panels'] += sign * (obj.panels_installed or 0)
+        row['installations'] += sign
+        if obj.installed_on is not None and sign > 0:
+            row['first_installed_on'] = min(filter(None, (row['first_installed_on'], obj.installed_on)))
+            row['last_installed_on'] = max(filter(None, (row['last_installed_on'], obj.installed_on)))
+    table = BatchSiteTrace.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=['batch_id', 'site_id'], set_={
+        'panels': table.c.panels + stmt.excluded.panels,
+        'installations': table.c.installations + stmt.excluded.installations,
+        'first_installed_on': db.func.coalesce(db.func.min(table.c.first_installed_on, stmt.excluded.first_installed_on),
+                                               table.c.first_installed_on, stmt.excluded.first_installed_on),
+        'last_installed_on': db.func.coalesce(db.func.max(table.c.last_installed_on, stmt.excluded.last_installed_on),
+                                              table.c.last_installed_on, stmt.excluded.last_installed_on)})
+    conn.execute(stmt, list(rows.values()))
+
+def rebuild_trace():
+    """Recompute batch_site_trace from installation and batch in one transaction."""
+    conn = db.session.connection()
+    conn.execute(BatchSiteTrace.__table__.delete())
+    conn.exec_driver_sql('''
+        INSERT INTO batch_site_trace (batch_id, site_id, recipe_id, panel_type_id, panels, installations,
+                                      first_installed_on, last_installed_on)
+        SELECT i.batch_id, i.site_id, b.recipe_id, b.panel_type_id, COALESCE(SUM(i.panels_installed), 0), COUNT(*),
+               MIN(i.installed_on), MAX(i.installed_on)
+        FROM installation i LEFT JOIN batch b ON b.id = i.batch_id
+        WHERE i.batch_id IS NOT NULL AND i.site_id IS NOT NULL
+        GROUP BY i.batch_id, i.site_id''')
+    db.session.commit()
+
+def init_trace():
+    """Build the trace index once for databases that predate it."""
+    if not BatchSiteTrace.query.first() and Installation.query.first():
+        rebuild_trace()
+
+def _trace_select(condition, order_by):
+    """Trace rows joined to their pilot site: one row per (batch, site), as written to recall CSVs."""
+    t, s = BatchSiteTrace.__table__, PilotSite.__table__
+    return select(t.c.recipe_id, t.c.batch_id, t.c.panel_type_id, t.c.site_id, s.c.name.label('site_name'),
+                  s.c.village, s.c.district, s.c.latitude, s.c.longitude, t.c.panels, t.c.installations,
+                  t.c.first_installed_on, t.c.last_installed_on) \
+        .select_from(t.outerjoin(s, s.c.id == t.c.site_id)).where(condition).order_by(*order_by)
+
+def _row_dict(row):
+    return {k: v.isoformat() if isinstance(v, datetime) else v for k, v in row._mapping.items()}
+
+def _recall_csv(stmt, name):
+    response = app.response_class(stream_with_context(export_csv(stmt)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.csv' % name
+    return response
+
+def _batch_trace(batch):
+    """JSON body for one batch: its recipe and panel type, the sites and installations that got its
+    panels, and the other batches made with the same recipe."""
+    t = BatchSiteTrace.__table__
+    sites = db.session.execute(_trace_select(t.c.batch_id == batch.id, [t.c.site_id])).all()
+    installations = Installation.query.filter_by(batch_id=batch.id).order_by(Installation.id).all()
+    related = [bid for (bid,) in db.session.query(Batch.id).filter(Batch.recipe_id == batch.recipe_id, Batch.id != batch.id)
+               .order_by(Batch.id)] if batch.recipe_id is not None else []
+    return {'batch': model_to_dict(batch),
+            'recipe': model_to_dict(batch.recipe) if batch.recipe else None,
+            'panel_type': model_to_dict(batch.panel_type) if batch.panel_type else None,
+            'sites': [_row_dict(r) for r in sites],
+            'installations': [model_to_dict(i) for i in installations],
+            'related_batch_ids': related}
+
+@app.route('/api/trace/batch/<int:id>')
+def api_trace_batch(id):
+    """Every site and installation that received panels from a batch, plus its recipe's other batches.
+    ?format=csv gives the (batch, site) rows for a recall notice."""
+    batch = db.session.get(Batch, id) or abort(404)
+    if request.args.get('format') == 'csv':
+        t = BatchSiteTrace.__table__
+        return _recall_csv(_trace_select(t.c.batch_id == id, [t.c.site_id]), 'recall-batch-%d' % id)
+    return jsonify(dict(_batch_trace(batch), status='ok'))
+
+@app.route('/api/trace/qc/<int:id>')
+def api_trace_qc(id):
+    """Trace a QC result to its batch (as /api/trace/batch), with whether it fell below the panel type's target."""
+    qc = db.session.get(QCTest, id) or abort(404)
+    batch = db.session.get(Batch, qc.batch_id) if qc.batch_id is not None else None
+    if batch is None:
+        return jsonify({'status':'error','message':'QC test %d has no batch to trace' % id}), 404
+    if request.args.get('format') == 'csv':
+        t = BatchSiteTrace.__table__
+        return _recall_csv(_trace_select(t.c.batch_id == batch.id, [t.c.site_id]), 'recall-qc-%d' % id)
+    target = batch.panel_type.target_strength_mpa if batch.panel_type else None
+    qc_data = dict(model_to_dict(qc), target_strength_mpa=target,
+                   below_target=None if target is None or qc.compressive_mpa is None else qc.compressive_mpa < target)
+    return jsonify(dict(_batch_trace(batch), qc=qc_data, status='ok'))
+
+@app.route('/api/trace/recipe/<int:id>')
+def api_trace_recipe(id):
+    """Every site that received panels made with a recipe, with panel and batch counts per site.
+    Sites are paged by site id (?cursor=&limit=); ?format=csv streams every (batch, site) row."""
+    recipe = db.session.get(Recipe, id) or abort(404)
+    t = BatchSiteTrace.__table__
+    if request.args.get('format') == 'csv':
+        return _recall_csv(_trace_select(t.c.recipe_id == id, [t.c.site_id, t.c.batch_id]), 'recall-recipe-%d' % id)
+    limit = min(max(request.args.get('limit', app.config['PAGE_SIZE'], type=int), 1), app.config['PAGE_SIZE_MAX'])
+    s = PilotSite.__table__
+    query = select(t.c.site_id, s.c.name.label('site_name'), s.c.village, s.c.district, s.c.latitude, s.c.longitude,
+                   db.func.sum(t.c.panels).label('panels'), db.func.sum(t.c.installations).label('installations'),
+                   db.func.count().label('batches'), db.func.min(t.c.first_installed_on).label('first_installed_on'),
+                   db.func.max(t.c.last_installed_on).label('last_installed_on')) \
+        .select_from(t.outerjoin(s, s.c.id == t.c.site_id)).where(t.c.recipe_id == id)
+    if request.args.get('cursor'):
+        query = query.where(t.c.site_id > _decode_cursor(request.args['cursor'], [t.c.site_id])[0])
+    rows = db.session.execute(query.group_by(t.c.site_id).order_by(t.c.site_id).limit(limit + 1)).all()
+    next_cursor = _encode_cursor([rows[limit - 1].site_id]) if len(rows) > limit else None
+    batches = [bid for (bid,) in db.session.query(Batch.id).filter(Batch.recipe_id == id).order_by(Batch.id)]
+    return jsonify({'status':'ok','recipe':model_to_dict(recipe),'batch_ids':batches,
+                    'sites':[_row_dict(r) for r in rows[:limit]],'next_cursor':next_cursor})
+
+trace_cli = AppGroup('trace', help='Maintain the QC -> batch -> installation -> site trace index.')
+
+@trace_cli.command('rebuild')
+def trace_rebuild_command():
+    """Recompute the trace index from installations and batches."""
+    create_tables()
+    rebuild_trace()
+    click.echo('trace index rebuilt')
+
+app.cli.add_command(trace_cli)
 
 # -----------------
 # Run
@@ -0,0 +1,69 @@
+"""Time the QC analytics cache: first load (which stores the column chunks), cold load from
+the stored chunks (a new worker), unchanged refresh and incremental refresh.
+
+    python benchmarks/bench_analytics.py --qc-rows 1000000 --batches 20000
+"""
+import argparse
+
+import numpy as np
+
+from common import Timer, load_app
+
+
+def seed(module, n_rows, n_batches, n_recipes):
+    rnd = np.random.default_rng(7)
+    with module.app.app_context():
+        conn = module.db.session.connection()
+        conn.execute(module.Recipe.__table__.insert(), [{'name': 'R%d' % i} for i in range(n_recipes)])
+        conn.execute(module.PanelType.__table__.insert(), [{'name': 'P', 'target_strength_mpa': 20.0}])
+        conn.execute(module.Batch.__table__.insert(), [
+            {'recipe_id': int(i % n_recipes) + 1, 'panel_type_id': 1, 'quantity': 100} for i in range(n_batches)])
+        batch_ids = rnd.integers(1, n_batches + 1, n_rows)
+        comp = rnd.normal(25, 4, n_rows)
+        flex = rnd.normal(4, 0.6, n_rows)
+        for lo in range(0, n_rows, 100000):
+            conn.execute(module.QCTest.__table__.insert(), [
+                {'batch_id': int(b), 'compressive_mpa': float(c), 'flexural_mpa': float(f),
+                 'water_absorption_percent': 5.0, 'abrasion_loss_percent': 1.2}
+                for b, c, f in zip(batch_ids[lo:lo + 100000], comp[lo:lo + 100000], flex[lo:lo + 100000])])
+        module.db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--qc-rows', type=int, default=200000)
+    parser.add_argument('--batches', type=int, default=5000)
+    parser.add_argument('--recipes', type=int, default=20)
+    args = parser.parse_args()
+
+    module = load_app()
+    seed(module, args.qc_rows, args.batches, args.recipes)
+    with module.app.app_context():
+        with Timer() as first:
+            module.qc_analytics().refresh()
+        module._qc_analytics.clear()
+        analytics = module.qc_analytics()
+        with Timer() as cold:
+            analytics.refresh()
+        with Timer() as unchanged:
+            analytics.refresh()
+        module.db.session.add(module.QCTest(batch_id=1, compressive_mpa=30.0, flexural_mpa=4.0))
+        module.db.session.commit()
+        with Timer() as incremental:
+            analytics.refresh()
+
+        # spot-check the vectorised percentiles against numpy on one batch
+        comp = np.array([v for (v,) in module.db.session.query(module.QCTest.compressive_mpa).filter_by(batch_id=1)])
+        expected = round(float(np.percentile(comp, 5)), 3)
+        got = analytics.batches[1]['characteristic_compressive_mpa']
+        assert abs(expected - got) < 1e-3, (expected, got)
+
+    print('qc rows: %d, batches: %d, recipes: %d' % (args.qc_rows, args.batches, args.recipes))
+    print('first load:           %8.1f ms' % (first.elapsed * 1000))
+    print('cold load (chunks):   %8.1f ms' % (cold.elapsed * 1000))
+    print('unchanged refresh:    %8.1f ms' % (unchanged.elapsed * 1000))
+    print('one new QC row:       %8.1f ms' % (incremental.elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
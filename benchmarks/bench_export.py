@@ -0,0 +1,43 @@
+"""Check that streaming exports run in constant memory: peak Python allocation while
+exporting the QC table should not grow with the number of rows.
+
+    python benchmarks/bench_export.py --sizes 10000 100000 1000000
+"""
+import argparse
+import tracemalloc
+
+from common import Timer, load_app, seed_minimal
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--formats', nargs='+', default=['csv', 'parquet'])
+    args = parser.parse_args()
+
+    module = load_app()
+    batch_id = seed_minimal(module)
+    client = module.app.test_client()
+    have = 0
+    print('%-10s %-8s %12s %14s %12s' % ('rows', 'format', 'seconds', 'bytes out', 'peak MiB'))
+    for size in sorted(args.sizes):
+        with module.app.app_context():
+            for lo in range(have, size, 50000):
+                module.db.session.execute(module.QCTest.__table__.insert(), [
+                    {'batch_id': batch_id, 'compressive_mpa': 25.0, 'flexural_mpa': 4.0,
+                     'water_absorption_percent': 5.0, 'abrasion_loss_percent': 1.0, 'notes': 'bench'}
+                    for _ in range(lo, min(lo + 50000, size))])
+            module.db.session.commit()
+        have = size
+        for fmt in args.formats:
+            tracemalloc.start()
+            with Timer() as t:
+                resp = client.get('/export/qc.%s' % fmt, buffered=False)
+                total = sum(len(chunk) for chunk in resp.response)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('%-10d %-8s %12.2f %14d %12.1f' % (size, fmt, t.elapsed, total, peak / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Show that keyset-paginated list pages stay flat as the tables grow.
+
+For each size the script tops up the batch and QC tables, then times the first
+page and a page reached through a deep cursor on /batches, /qc and their JSON APIs.
+
+    python benchmarks/bench_pagination.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import random
+import statistics
+from datetime import datetime, timedelta
+
+from common import Timer, load_app, seed_minimal
+
+ROUTES = ['/batches', '/qc', '/api/batches', '/api/qc']
+
+
+def top_up(module, batch_id, have, want):
+    """Insert rows have..want into batch and qc_test with executemany."""
+    rnd = random.Random(have)
+    start = datetime(2020, 1, 1)
+    with module.app.app_context():
+        conn = module.db.session.connection()
+        for lo in range(have, want, 50000):
+            hi = min(lo + 50000, want)
+            conn.execute(module.Batch.__table__.insert(), [
+                {'recipe_id': 1, 'panel_type_id': 1, 'quantity': 100, 'status': 'produced',
+                 'produced_on': start + timedelta(minutes=i)} for i in range(lo, hi)])
+            conn.execute(module.QCTest.__table__.insert(), [
+                {'batch_id': batch_id, 'compressive_mpa': rnd.gauss(25, 3), 'flexural_mpa': rnd.gauss(4, 0.5),
+                 'water_absorption_percent': 5.0, 'abrasion_loss_percent': 1.0, 'notes': '',
+                 'tested_on': start + timedelta(minutes=i)} for i in range(lo, hi)])
+        module.db.session.commit()
+
+
+def time_route(client, url, repeat):
+    samples = []
+    for _ in range(repeat):
+        with Timer() as t:
+            resp = client.get(url)
+        assert resp.status_code == 200, (url, resp.status_code)
+        samples.append(t.elapsed * 1000)
+    return statistics.median(samples)
+
+
+def deep_cursor(client, route, pages):
+    """Follow next_cursor through the JSON twin of `route`; HTML pages accept the same cursor."""
+    url = route if route.startswith('/api') else '/api' + route
+    cursor = None
+    for _ in range(pages):
+        cursor = client.get(url + ('?cursor=' + cursor if cursor else '')).get_json()['next_cursor']
+        if not cursor:
+            break
+    return cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    module = load_app()
+    batch_id = seed_minimal(module)
+    client = module.app.test_client()
+    have = 0
+    print('%-10s %-14s %12s %12s' % ('rows', 'route', 'first (ms)', 'deep (ms)'))
+    for size in sorted(args.sizes):
+        top_up(module, batch_id, have, size)
+        have = size
+        for route in ROUTES:
+            cursor = deep_cursor(client, route, 10)
+            first = time_route(client, route, args.repeat)
+            deep = time_route(client, route + '?cursor=' + cursor, args.repeat) if cursor else float('nan')
+            print('%-10d %-14s %12.2f %12.2f' % (size, route, first, deep))
+
+
+if __name__ == '__main__':
+    main()
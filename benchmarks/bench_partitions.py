@@ -0,0 +1,108 @@
+"""One shared database vs a database per district (PANELS_PARTITION_DIR).
+
+Writer threads post bulk QC uploads (100 rows each), one per district, while the main
+thread times the dashboard of a district nobody is writing to. The same run is repeated
+with partitioning switched off, so every district shares the main database, and on, so
+each district writes its own file. Finally the all-districts dashboard, which reads every
+database, and /api/trends are timed with one fan-out thread and with one thread per database.
+
+    python benchmarks/bench_partitions.py --scale 10k --districts 4 --seconds 5
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from common import Timer, load_app
+from seed_data import DISTRICTS, parse_scale, seed
+
+BULK = '\n'.join(json.dumps({'batch_id': 1 + i % 10, 'compressive_mpa': 24.0, 'flexural_mpa': 4.1,
+                             'water_absorption_percent': 5.0, 'abrasion_loss_percent': 1.0}) for i in range(100))
+# Reads that span districts: each database is queried on the fan-out pool and the results merged
+ALL_DISTRICTS = ['/', '/api/trends?grain=month&by=recipe']
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100)
+    return statistics.median(samples), cuts[94]
+
+
+def contended(module, districts, seconds):
+    """(QC rows written per second, reader p50 ms, reader p95 ms) with writers on districts[1:]."""
+    stop = threading.Event()
+    lock = threading.Lock()
+    written = [0]
+
+    def writer(district):
+        client = module.app.test_client()
+        while not stop.is_set():
+            resp = client.post('/api/report_qc/bulk', data=BULK, content_type='application/x-ndjson',
+                               headers={'X-District': district})
+            assert resp.status_code == 200, resp.get_data()
+            with lock:
+                written[0] += 100
+
+    threads = [threading.Thread(target=writer, args=(d,)) for d in districts[1:]]
+    client = module.app.test_client()
+    samples = []
+    with Timer() as total:
+        for t in threads:
+            t.start()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            with Timer() as t:
+                assert client.get('/', headers={'X-District': districts[0]}).status_code == 200
+            samples.append(t.elapsed * 1000)
+        stop.set()
+        for t in threads:
+            t.join()
+    return (written[0] / total.elapsed,) + percentiles(samples)
+
+
+def latency_ms(module, url, n):
+    client = module.app.test_client()
+    samples = []
+    for _ in range(n):
+        with Timer() as t:
+            assert client.get(url).status_code == 200
+        samples.append(t.elapsed * 1000)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='10k', help='rows per district: 10k, 100k, 1m or a row count')
+    parser.add_argument('--districts', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per all-districts read')
+    args = parser.parse_args()
+
+    directory = os.path.join(tempfile.mkdtemp(prefix='panels-partitions-'), 'districts')
+    module = load_app(PANELS_PARTITION_DIR=directory, PANELS_STORAGE_MODE='concurrent')
+    n = parse_scale(args.scale)
+    districts = DISTRICTS[:args.districts]
+    seed(module, n)
+    for district in districts:
+        seed(module, n, partition=module.partition_key(district))
+
+    print('%d districts, %d QC rows each, %d writer threads' % (len(districts), n, len(districts) - 1))
+    print('%-24s %14s %16s %16s' % ('storage', 'rows/s written', 'reader p50 ms', 'reader p95 ms'))
+    for label, partition_dir in (('one database', ''), ('database per district', directory)):
+        module.app.config['PARTITION_DIR'] = partition_dir
+        rate, p50, p95 = contended(module, districts, args.seconds)
+        print('%-24s %14.0f %16.2f %16.2f' % (label, rate, p50, p95))
+
+    print('\nall-districts reads, idle, %d databases' % (len(districts) + 1))
+    for url in ALL_DISTRICTS:
+        for label, workers in (('one database at a time', 1), ('in parallel', len(districts) + 1)):
+            module.app.config['PARTITION_WORKERS'] = workers
+            module.partitions.executor = None  # the pool is sized on first use
+            p50, p95 = latency_ms(module, url, args.requests)
+            print('%-44s %-24s p50 %8.2f ms  p95 %8.2f ms' % (url, label, p50, p95))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Compare QC ingestion throughput: one POST per row vs. the bulk NDJSON endpoint.
+
+    python benchmarks/bench_qc_ingest.py --rows 5000 --chunk-size 500
+"""
+import argparse
+import json
+import random
+
+from common import Timer, load_app, seed_minimal
+
+
+def make_rows(batch_id, n):
+    rnd = random.Random(42)
+    return [{
+        'batch_id': batch_id,
+        'compressive_mpa': round(rnd.gauss(25, 3), 2),
+        'flexural_mpa': round(rnd.gauss(4, 0.5), 2),
+        'water_absorption_percent': round(rnd.uniform(2, 8), 2),
+        'abrasion_loss_percent': round(rnd.uniform(0.5, 3), 2),
+        'notes': 'bench',
+    } for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    module = load_app()
+    batch_id = seed_minimal(module)
+    rows = make_rows(batch_id, args.rows)
+    client = module.app.test_client()
+
+    with Timer() as per_row:
+        for row in rows:
+            assert client.post('/api/report_qc', json=row).status_code == 200
+    body = '\n'.join(json.dumps(r) for r in rows)
+    with Timer() as bulk:
+        resp = client.post('/api/report_qc/bulk?chunk_size=%d' % args.chunk_size,
+                           data=body, content_type='application/x-ndjson')
+    assert resp.status_code == 200 and resp.get_json()['accepted'] == args.rows, resp.get_data()
+
+    print('rows: %d, chunk size: %d' % (args.rows, args.chunk_size))
+    print('per-row endpoint: %8.0f rows/s (%.2fs)' % (args.rows / per_row.elapsed, per_row.elapsed))
+    print('bulk endpoint:    %8.0f rows/s (%.2fs)' % (args.rows / bulk.elapsed, bulk.elapsed))
+    print('speedup:          %8.1fx' % (per_row.elapsed / bulk.elapsed))
+
+
+if __name__ == '__main__':
+    main()
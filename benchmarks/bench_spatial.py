@@ -0,0 +1,55 @@
+"""Nearby-site query latency with many pilot sites.
+
+    python benchmarks/bench_spatial.py --sites 100000 --queries 500
+"""
+import argparse
+import random
+import statistics
+
+from common import Timer, load_app
+
+# rough bounding box of the pilot districts (lat, lon)
+LAT_RANGE = (20.0, 27.0)
+LON_RANGE = (80.0, 88.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sites', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--radius-km', type=float, default=5.0)
+    args = parser.parse_args()
+
+    module = load_app()
+    rnd = random.Random(3)
+    with module.app.app_context():
+        module.db.session.execute(module.PilotSite.__table__.insert(), [
+            {'name': 'Site %d' % i, 'village': 'V%d' % i, 'district': 'D%d' % (i % 40),
+             'latitude': rnd.uniform(*LAT_RANGE), 'longitude': rnd.uniform(*LON_RANGE)}
+            for i in range(args.sites)])
+        module.db.session.commit()
+        print('R*Tree in use: %s' % module._spatial['rtree'])
+
+        samples, hits = [], 0
+        for _ in range(args.queries):
+            lat, lon = rnd.uniform(*LAT_RANGE), rnd.uniform(*LON_RANGE)
+            with Timer() as t:
+                hits += len(module.sites_near(lat, lon, args.radius_km))
+            samples.append(t.elapsed * 1000)
+
+    client = module.app.test_client()
+    http = []
+    for _ in range(args.queries):
+        url = '/api/sites/nearby?lat=%f&lon=%f&radius_km=%f' % (rnd.uniform(*LAT_RANGE), rnd.uniform(*LON_RANGE), args.radius_km)
+        with Timer() as t:
+            assert client.get(url).status_code == 200
+        http.append(t.elapsed * 1000)
+
+    q = statistics.quantiles
+    print('sites: %d, radius: %.1f km, avg hits/query: %.1f' % (args.sites, args.radius_km, hits / args.queries))
+    print('sites_near():      p50 %.2f ms  p99 %.2f ms' % (statistics.median(samples), q(samples, n=100)[98]))
+    print('/api/sites/nearby: p50 %.2f ms  p99 %.2f ms' % (statistics.median(http), q(http, n=100)[98]))
+
+
+if __name__ == '__main__':
+    main()
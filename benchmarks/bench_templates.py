@@ -0,0 +1,55 @@
+"""Requests/sec on /, /batches and /qc with Jinja's compiled-template cache on and off.
+
+"Off" recompiles every template on every render (jinja_env.cache = None). That
+is roughly what the old render_template_string(base_html + ...) views did, so
+the two columns show the CPU saved by compiling once.
+
+    python benchmarks/bench_templates.py --requests 500
+"""
+import argparse
+
+from common import Timer, load_app, seed_minimal
+
+ROUTES = ['/', '/batches', '/qc']
+
+
+def seed(module, batch_id, n):
+    with module.app.app_context():
+        for i in range(n):
+            module.db.session.add(module.Batch(recipe_id=1, panel_type_id=1, quantity=100))
+            module.db.session.add(module.QCTest(batch_id=batch_id, compressive_mpa=25.0, flexural_mpa=4.0))
+            module.db.session.add(module.PilotSite(name='Site %d' % i, village='V', district='D'))
+        module.db.session.commit()
+
+
+def rps(client, url, n):
+    client.get(url)  # warm up
+    with Timer() as t:
+        for _ in range(n):
+            assert client.get(url).status_code == 200
+    return n / t.elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--rows', type=int, default=50, help='rows per table shown on the pages')
+    args = parser.parse_args()
+
+    module = load_app()
+    seed(module, seed_minimal(module), args.rows)
+    client = module.app.test_client()
+    env = module.app.jinja_env
+    cache = env.cache
+
+    print('%-10s %16s %16s %8s' % ('route', 'no cache (rps)', 'cached (rps)', 'gain'))
+    for route in ROUTES:
+        env.cache = None
+        cold = rps(client, route, args.requests)
+        env.cache = cache
+        warm = rps(client, route, args.requests)
+        print('%-10s %16.0f %16.0f %7.1fx' % (route, cold, warm, warm / cold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Compare /api/trends (rollup rows) with the same monthly aggregate computed from raw qc_test,
+and time the full rollup backfill.
+
+    python benchmarks/bench_trends.py --scale 1m
+"""
+import argparse
+import statistics
+
+from common import Timer, load_app
+from seed_data import parse_scale, seed
+
+RAW_MONTHLY = '''
+    SELECT date(q.tested_on, 'start of month') AS period, b.recipe_id, COUNT(*), AVG(q.compressive_mpa), AVG(q.flexural_mpa)
+    FROM qc_test q JOIN batch b ON b.id = q.batch_id
+    GROUP BY period, b.recipe_id
+'''
+
+
+def timed(fn, n):
+    samples = []
+    for _ in range(n):
+        with Timer() as t:
+            fn()
+        samples.append(t.elapsed * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='100k', help='10k, 100k, 1m or a row count')
+    parser.add_argument('--requests', type=int, default=10)
+    args = parser.parse_args()
+
+    module = load_app()
+    seed(module, parse_scale(args.scale))
+    client = module.app.test_client()
+    with module.app.app_context():
+        qc_rows = module.QCTest.query.count()
+        with Timer() as backfill:
+            module.rebuild_rollups()
+        raw_ms = timed(lambda: module.db.session.execute(module.text(RAW_MONTHLY)).all(), args.requests)
+    api_ms = timed(lambda: client.get('/api/trends?grain=month&by=recipe').get_data(), args.requests)
+
+    print('qc rows: %d' % qc_rows)
+    print('rollup backfill:                    %9.1f ms' % (backfill.elapsed * 1000))
+    print('raw monthly aggregate (SQL only):   %9.1f ms' % raw_ms)
+    print('/api/trends month by recipe:        %9.1f ms' % api_ms)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Bytes on the wire and server CPU per request for a field-app sync, by encoding.
+
+Downloads the first /api/sync page (sites, batches, recipes and panel types) as JSON
+or MessagePack, each uncompressed, gzip and brotli, then uploads a batch of offline
+installations to /api/sync/upload the same ways. CPU is process time per request
+with the in-process test client, so it includes a little client-side overhead.
+
+    python benchmarks/bench_wire_formats.py --scale 10k --requests 50
+"""
+import argparse
+import gzip
+import json
+import time
+
+from common import load_app
+from seed_data import parse_scale, seed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+BODY_TYPES = {'json': 'application/json', 'msgpack': 'application/msgpack'}
+
+
+def variants():
+    for body in ('json', 'msgpack'):
+        if body == 'msgpack' and msgpack is None:
+            continue
+        for encoding in ('identity', 'gzip', 'br'):
+            if encoding == 'br' and brotli is None:
+                continue
+            yield body, encoding
+
+
+def encode_body(obj, body, encoding):
+    data = msgpack.packb(obj) if body == 'msgpack' else json.dumps(obj).encode()
+    if encoding == 'gzip':
+        return gzip.compress(data)
+    if encoding == 'br':
+        return brotli.compress(data)
+    return data
+
+
+def measure(client, n, **kwargs):
+    """(bytes sent, bytes received, CPU ms per request) averaged over n requests."""
+    sent = received = 0
+    cpu = time.process_time()
+    for _ in range(n):
+        resp = client.open(**kwargs)
+        assert resp.status_code == 200, resp.status_code
+        sent += len(kwargs.get('data') or b'')
+        received += len(resp.get_data())
+    return sent / n, received / n, (time.process_time() - cpu) * 1000 / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='10k', help='10k, 100k, 1m or a row count')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--upload-items', type=int, default=50, help='installations per upload')
+    args = parser.parse_args()
+
+    module = load_app()
+    seed(module, parse_scale(args.scale))
+    client = module.app.test_client()
+
+    print('download: GET /api/sync?since=0')
+    print('%-9s %-9s %12s %12s' % ('body', 'encoding', 'bytes', 'cpu ms/req'))
+    for body, encoding in variants():
+        headers = {'Accept': BODY_TYPES[body], 'Accept-Encoding': encoding}
+        _, received, cpu = measure(client, args.requests, path='/api/sync?since=0', headers=headers)
+        print('%-9s %-9s %12d %12.2f' % (body, encoding, received, cpu))
+
+    print('\nupload: POST /api/sync/upload, %d installations' % args.upload_items)
+    print('%-9s %-9s %12s %12s' % ('body', 'encoding', 'bytes', 'cpu ms/req'))
+    for run, (body, encoding) in enumerate(variants()):
+        items = [{'idempotency_key': 'bench-%d-%d' % (run, i), 'site_id': 1 + i % 10, 'batch_id': 1 + i % 10,
+                  'installed_panels': 4} for i in range(args.upload_items)]
+        data = encode_body({'installations': items}, body, encoding)
+        headers = {'Content-Type': BODY_TYPES[body]}
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        # the first request inserts; the rest are idempotent replays of the same upload
+        sent, _, cpu = measure(client, args.requests, path='/api/sync/upload', method='POST', data=data, headers=headers)
+        print('%-9s %-9s %12d %12.2f' % (body, encoding, sent, cpu))
+
+
+if __name__ == '__main__':
+    main()
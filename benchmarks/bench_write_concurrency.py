@@ -0,0 +1,106 @@
+"""Concurrent write load test for /api/field_report and /api/report_qc.
+
+Starts several worker processes against one SQLite file, the way a multi-worker
+server would. Each process fires requests from a pool of threads. The test runs
+once per mode and reports throughput and error rate. In 'queue' mode (INGEST_MODE=queue
+on concurrent storage) throughput counts 202 acknowledgements; the backlog the workers
+had not applied when the burst ended is then drained and timed separately.
+
+    python benchmarks/bench_write_concurrency.py --processes 4 --threads 8 --requests 300
+"""
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import Timer, load_app, seed_minimal, temp_db_path
+
+# environment for each mode
+MODES = {
+    'default': {'PANELS_STORAGE_MODE': 'default'},
+    'concurrent': {'PANELS_STORAGE_MODE': 'concurrent'},
+    'queue': {'PANELS_STORAGE_MODE': 'concurrent', 'INGEST_MODE': 'queue'},
+}
+
+
+def _setup(db_path, mode):
+    module = load_app(db_path, **MODES[mode])
+    batch_id = seed_minimal(module)
+    with module.app.app_context():
+        module.db.session.add(module.PilotSite(name='Load test site'))
+        module.db.session.commit()
+    return batch_id
+
+
+def _worker(db_path, mode, threads, requests, batch_id, start_at, out):
+    module = load_app(db_path, **MODES[mode])
+    client = module.app.test_client()
+
+    def one(i):
+        if i % 2:
+            resp = client.post('/api/field_report', json={'site_id': 1, 'batch_id': batch_id, 'installed_panels': 10})
+        else:
+            resp = client.post('/api/report_qc', json={'batch_id': batch_id, 'compressive_mpa': 24.0})
+        return resp.status_code in (200, 202)
+
+    while time.time() < start_at:
+        time.sleep(0.001)
+    with ThreadPoolExecutor(threads) as pool:
+        ok = sum(pool.map(one, range(requests)))
+    out.put((ok, requests - ok))
+
+
+def _drain(db_path, mode):
+    """Apply what is left in the ingest queue; returns (reports, seconds)."""
+    module = load_app(db_path, **MODES[mode])
+    total = 0
+    with module.app.app_context(), Timer() as t:
+        while True:
+            claimed = module.drain_once()
+            if not claimed:
+                break
+            total += claimed
+    return total, t.elapsed
+
+
+def run(mode, args):
+    db_path = temp_db_path()
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        batch_id = pool.apply(_setup, (db_path, mode))
+    out = ctx.Queue()
+    start_at = time.time() + 3  # let every process import the app before the burst starts
+    procs = [ctx.Process(target=_worker, args=(db_path, mode, args.threads, args.requests, batch_id, start_at, out))
+             for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    elapsed = time.time() - start_at
+    for p in procs:
+        p.join()
+    ok = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    if mode == 'queue':
+        with ctx.Pool(1) as pool:
+            backlog, seconds = pool.apply(_drain, (db_path, mode))
+        print('  queue backlog after burst: %d reports, drained in %.2fs' % (backlog, seconds))
+    return ok, failed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per process')
+    parser.add_argument('--modes', nargs='+', default=['default', 'concurrent', 'queue'], choices=sorted(MODES))
+    args = parser.parse_args()
+
+    print('%d processes x %d threads x %d requests' % (args.processes, args.threads, args.requests))
+    print('%-11s %10s %10s %12s %8s' % ('mode', 'ok', 'errors', 'writes/s', 'error %'))
+    for mode in args.modes:
+        ok, failed, elapsed = run(mode, args)
+        print('%-11s %10d %10d %12.0f %7.1f%%' % (mode, ok, failed, ok / elapsed, 100.0 * failed / (ok + failed)))
+
+
+if __name__ == '__main__':
+    main()
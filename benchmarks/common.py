@@ -0,0 +1,52 @@
+"""Shared helpers for the benchmark scripts.
+
+Each benchmark runs the app in-process against a throwaway SQLite file so
+results are not polluted by (and do not pollute) a real panels.db.
+"""
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def temp_db_path():
+    return os.path.join(tempfile.mkdtemp(prefix='panels-bench-'), 'panels.db')
+
+
+def load_app(db_path=None, **env):
+    """Import the app bound to `db_path` (a fresh temp file by default) and create its tables.
+    Extra keyword arguments are exported as environment variables before import.
+    """
+    os.environ['PANELS_DATABASE_URI'] = 'sqlite:///' + (db_path or temp_db_path())
+    os.environ.update({k: str(v) for k, v in env.items()})
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    module = importlib.import_module('bamboo_plastic_panel_manager')
+    with module.app.app_context():
+        module.create_tables()
+    return module
+
+
+def seed_minimal(module):
+    """Create one recipe, panel type and batch; returns the batch id."""
+    with module.app.app_context():
+        r = module.Recipe(name='Bench recipe', cement_percent=7.0, plastic_percent=5.0)
+        p = module.PanelType(name='Bench panel', target_strength_mpa=20.0)
+        module.db.session.add_all([r, p])
+        module.db.session.flush()
+        b = module.Batch(recipe_id=r.id, panel_type_id=p.id, quantity=100)
+        module.db.session.add(b)
+        module.db.session.commit()
+        return b.id
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,178 @@
+"""Benchmark every route and API at a given data scale and compare with a stored baseline.
+
+Every endpoint in the app's URL map is discovered and exercised: GET for the pages
+and read APIs, and POST for the forms and report APIs. The suite reports p50/p95/p99
+latency and throughput per endpoint, plus the process's peak RSS.
+
+    python benchmarks/run_suite.py --scale 10k                      # run and print
+    python benchmarks/run_suite.py --scale 10k --save-baseline      # store benchmarks/baselines/10k.json
+    python benchmarks/run_suite.py --scale 10k --check              # exit 1 on regression
+
+Seeding a large scale takes a while; pass --db to keep and reuse the seeded file.
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import statistics
+import subprocess
+import sys
+
+from common import Timer, load_app, temp_db_path
+from seed_data import has_data
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+# Values for URL arguments, and query strings for endpoints that need them
+URL_ARGS = {'id': 1, 'dataset': 'qc', 'fmt': 'csv'}
+QUERY = {
+    'api_sites_nearby': 'lat=23.5&lon=85.5&radius_km=5',
+    'api_sites_bbox': 'min_lat=23&min_lon=85&max_lat=23.5&max_lon=85.5',
+    'export_dataset': 'from=2023-01-01&to=2023-01-02',
+    'api_sync': 'since=0&limit=200',
+    'api_trends': 'grain=month&by=recipe&from=2023-01-01&to=2023-12-31',
+    'api_search': 'q=site 1&limit=10',
+}
+# Endpoints that are disabled in the suite's configuration (profiler off, INGEST_MODE=sync)
+SKIP = {'debug_slow_requests', 'api_report_status'}
+
+
+def _qc_payload(i):
+    return {'batch_id': 1 + i % 10, 'compressive_mpa': 24.0, 'flexural_mpa': 4.1,
+            'water_absorption_percent': 5.0, 'abrasion_loss_percent': 1.0, 'notes': 'suite'}
+
+
+# POST bodies, as keyword arguments for the test client, by endpoint
+POSTS = {
+    'api_report_qc': lambda i: {'json': _qc_payload(i)},
+    'api_field_report': lambda i: {'json': {'site_id': 1 + i % 10, 'batch_id': 1 + i % 10, 'installed_panels': 1}},
+    'api_sync_upload': lambda i: {'json': {'installations': [{'idempotency_key': 'suite-%d' % i, 'site_id': 1, 'batch_id': 1,
+                                                               'installed_panels': 1}]}},
+    'api_report_qc_bulk': lambda i: {'data': '\n'.join(json.dumps(_qc_payload(j)) for j in range(100)),
+                                     'content_type': 'application/x-ndjson'},
+    'new_recipe': lambda i: {'data': {'name': 'Suite recipe %d' % i, 'cement': '6', 'plastic': '4'}},
+    'new_panel': lambda i: {'data': {'name': 'Suite panel %d' % i}},
+    'new_batch': lambda i: {'data': {'recipe': '1', 'panel': '1', 'quantity': '100'}},
+    'new_qc': lambda i: {'data': {'batch': '1', 'comp': '25', 'flex': '4', 'water': '5', 'abr': '1'}},
+    'new_site': lambda i: {'data': {'name': 'Suite site %d' % i, 'district': 'Ranchi', 'lat': '23.4', 'lon': '85.3'}},
+    'new_install': lambda i: {'data': {'site': '1', 'batch': '1', 'qty': '1'}},
+}
+
+
+def scenarios(app):
+    """[(name, method, url, kwargs_factory)] for every endpoint, plus the endpoints that could not be called.
+    All GETs come first, so no read is timed against rows inserted by an earlier POST scenario."""
+    adapter = app.url_map.bind('localhost')
+    found, skipped = [], []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if rule.endpoint == 'static' or rule.endpoint in SKIP:
+            continue
+        if any(arg not in URL_ARGS for arg in rule.arguments):
+            skipped.append(rule.rule)
+            continue
+        url = adapter.build(rule.endpoint, {a: URL_ARGS[a] for a in rule.arguments})
+        if rule.endpoint in QUERY:
+            url += '?' + QUERY[rule.endpoint]
+        if 'GET' in rule.methods:
+            found.append(('GET ' + rule.rule, 'GET', url, lambda i: {}))
+        if 'POST' in rule.methods:
+            if rule.endpoint in POSTS:
+                found.append(('POST ' + rule.rule, 'POST', url, POSTS[rule.endpoint]))
+            else:
+                skipped.append('POST ' + rule.rule)
+    found.sort(key=lambda s: s[1] != 'GET')  # stable: URL order within GETs and within POSTs
+    return found, skipped
+
+
+def measure(client, method, url, make_kwargs, n, warmup=3):
+    for i in range(warmup):
+        client.open(url, method=method, **make_kwargs(i))
+    samples, errors = [], 0
+    with Timer() as total:
+        for i in range(n):
+            with Timer() as t:
+                resp = client.open(url, method=method, **make_kwargs(i))
+                resp.get_data()
+            errors += resp.status_code >= 400
+            samples.append(t.elapsed * 1000)
+    cuts = statistics.quantiles(samples, n=100)
+    return {'p50_ms': round(statistics.median(samples), 3), 'p95_ms': round(cuts[94], 3),
+            'p99_ms': round(cuts[98], 3), 'rps': round(n / total.elapsed, 1), 'errors': errors}
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    """Regression messages: p95 latency or peak RSS worse than baseline * tolerance (+ slack for latency)."""
+    problems = []
+    for name, r in results['routes'].items():
+        base = baseline['routes'].get(name)
+        if base and r['p95_ms'] > base['p95_ms'] * tolerance + slack_ms:
+            problems.append('%s: p95 %.2fms vs baseline %.2fms' % (name, r['p95_ms'], base['p95_ms']))
+        if r['errors']:
+            problems.append('%s: %d error responses' % (name, r['errors']))
+    if results['peak_rss_mb'] > baseline['peak_rss_mb'] * tolerance:
+        problems.append('peak RSS %.1fMB vs baseline %.1fMB' % (results['peak_rss_mb'], baseline['peak_rss_mb']))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='10k', help='10k, 100k, 1m or a row count')
+    parser.add_argument('--db', help='SQLite file to use; seeded only if empty')
+    parser.add_argument('--requests', type=int, default=100, help='timed requests per endpoint')
+    parser.add_argument('--only', help='regex; only run endpoints whose name matches')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help='compare with the stored baseline, exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--slack-ms', type=float, default=1.0)
+    args = parser.parse_args()
+
+    db_path = args.db or temp_db_path()
+    module = load_app(db_path)
+    if not has_data(module):
+        # seed in a child process, so peak RSS below is the same whether or not this run seeded
+        with Timer() as t:
+            subprocess.check_call([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'seed_data.py'),
+                                   '--scale', args.scale, '--db', db_path])
+        print('seeded scale %s in %.1fs' % (args.scale, t.elapsed))
+    client = module.app.test_client()
+
+    found, skipped = scenarios(module.app)
+    results = {'scale': args.scale, 'requests': args.requests, 'routes': {}}
+    print('%-40s %9s %9s %9s %9s %6s' % ('endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors'))
+    for name, method, url, make_kwargs in found:
+        if args.only and not re.search(args.only, name):
+            continue
+        r = measure(client, method, url, make_kwargs, args.requests)
+        results['routes'][name] = r
+        print('%-40s %9.2f %9.2f %9.2f %9.0f %6d' % (name, r['p50_ms'], r['p95_ms'], r['p99_ms'], r['rps'], r['errors']))
+    results['peak_rss_mb'] = peak_rss_mb()
+    print('peak RSS: %.1f MB' % results['peak_rss_mb'])
+    if skipped:
+        print('not exercised (add to URL_ARGS / POSTS): %s' % ', '.join(skipped))
+
+    path = os.path.join(BASELINE_DIR, '%s.json' % args.scale)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('baseline written to %s' % path)
+    if args.check:
+        if not os.path.exists(path):
+            sys.exit('no baseline for scale %s at %s; run with --save-baseline first' % (args.scale, path))
+        with open(path) as f:
+            problems = compare(results, json.load(f), args.tolerance, args.slack_ms)
+        for p in problems:
+            print('REGRESSION ' + p)
+        if problems:
+            sys.exit(1)
+        print('no regressions against %s' % path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Synthetic data generator for benchmarks.
+
+Row counts scale with one number, N = QC tests = installations:
+N/10 batches, N/100 pilot sites (at least 10), 50 recipes and 10 panel types.
+
+    python benchmarks/seed_data.py --scale 100k --db /tmp/panels-100k.db
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from common import Timer, load_app
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+DISTRICTS = ['Ranchi', 'Gumla', 'Khunti', 'Lohardaga', 'Simdega', 'Latehar', 'Palamu', 'Garhwa']
+CHUNK = 50000
+
+
+def parse_scale(value):
+    value = value.lower()
+    return SCALES[value] if value in SCALES else int(value)
+
+
+def _chunks(total, make):
+    for lo in range(0, total, CHUNK):
+        yield [make(i) for i in range(lo, min(lo + CHUNK, total))]
+
+
+def seed(module, n, seed_value=1, partition=None):
+    """Insert a synthetic dataset of scale `n` with executemany, then rebuild the dashboard summary.
+    With `partition`, seed that district's database; it gets its recipes and panel types from the main
+    database, so seed that first."""
+    rnd = random.Random(seed_value)
+    start = datetime(2023, 1, 1)
+    n_batches = max(n // 10, 1)
+    n_sites = max(n // 100, 10)
+    counts = {'recipes': 50, 'panel_types': 10, 'batches': n_batches, 'sites': n_sites, 'qc': n, 'installations': n}
+    districts = [partition.replace('_', ' ').title()] if partition else DISTRICTS
+    with module.partition_context(partition):
+        conn = module.db.session.connection()
+        if partition is None:
+            conn.execute(module.Recipe.__table__.insert(), [
+                {'name': 'Mix %d: cement %d%% + plastic %d%%' % (i, 5 + i % 5, 3 + i % 7), 'cement_percent': 5.0 + i % 5,
+                 'plastic_percent': 3.0 + i % 7, 'additives': rnd.choice(['flyash 15%', 'bamboo fibre', 'none']),
+                 'notes': 'synthetic recipe %d' % i, 'created_at': start + timedelta(days=i)} for i in range(50)])
+            conn.execute(module.PanelType.__table__.insert(), [
+                {'name': 'Panel type %d' % i, 'length_m': 1.0, 'width_m': 0.5, 'thickness_m': 0.1 + i * 0.01,
+                 'target_strength_mpa': 18.0 + i, 'notes': ''} for i in range(10)])
+        for rows in _chunks(n_batches, lambda i: {
+                'recipe_id': rnd.randint(1, 50), 'panel_type_id': rnd.randint(1, 10), 'quantity': rnd.randint(50, 500),
+                'produced_on': start + timedelta(minutes=i * 30), 'status': 'produced'}):
+            conn.execute(module.Batch.__table__.insert(), rows)
+        for rows in _chunks(n_sites, lambda i: {
+                'name': 'Site %d' % i, 'village': 'Village %d' % (i % 997), 'district': districts[i % len(districts)],
+                'latitude': rnd.uniform(21.9, 25.3), 'longitude': rnd.uniform(83.3, 87.9),
+                'slope_deg': rnd.uniform(0, 15), 'notes': ''}):
+            conn.execute(module.PilotSite.__table__.insert(), rows)
+        for rows in _chunks(n, lambda i: {
+                'batch_id': rnd.randint(1, n_batches), 'compressive_mpa': rnd.gauss(24, 4), 'flexural_mpa': rnd.gauss(4, 0.6),
+                'water_absorption_percent': rnd.uniform(2, 9), 'abrasion_loss_percent': rnd.uniform(0.5, 3),
+                'tested_on': start + timedelta(minutes=i * 3), 'notes': ''}):
+            conn.execute(module.QCTest.__table__.insert(), rows)
+        for rows in _chunks(n, lambda i: {
+                'site_id': rnd.randint(1, n_sites), 'batch_id': rnd.randint(1, n_batches), 'panels_installed': rnd.randint(1, 20),
+                'installed_on': start + timedelta(minutes=i * 3), 'status': 'installed'}):
+            conn.execute(module.Installation.__table__.insert(), rows)
+        module.db.session.commit()
+        rebuild_derived_state(module)
+    return counts
+
+
+def rebuild_derived_state(module):
+    """Core inserts bypass the ORM hooks, so recompute state derived from them."""
+    module.SummaryCounter.query.delete()
+    module.db.session.commit()
+    module.init_summary()
+    module.rebuild_inventory()
+    module.rebuild_rollups()
+    module.rebuild_trace()
+    module.init_sync_versions()
+    module.ModelVersion.query.delete()  # new versions invalidate any cached pages
+    module.db.session.commit()
+    module.init_model_versions()
+
+
+def has_data(module):
+    with module.app.app_context():
+        return module.QCTest.query.first() is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', default='10k', help='10k, 100k, 1m or a row count')
+    parser.add_argument('--db', help='SQLite file to create (default: a temp file)')
+    args = parser.parse_args()
+    module = load_app(args.db)
+    with Timer() as t:
+        counts = seed(module, parse_scale(args.scale))
+    print('seeded %s in %.1fs into %s' % (counts, t.elapsed, module.app.config['SQLALCHEMY_DATABASE_URI']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""The app module imported once against a throwaway SQLite database, shared by every test file."""
+import importlib
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    os.environ['PANELS_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='panels-test-'), 'panels.db')
+    os.environ['SQL_QUERY_STATS'] = '1'
+    os.environ['ANALYTICS_WARM_ON_START'] = '0'
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    module = importlib.import_module('bamboo_plastic_panel_manager')
+    module.app.config.update(TESTING=True, SQL_QUERY_STATS=True, RESPONSE_CACHE_ENTRIES=0)
+    with module.app.app_context():
+        module.create_tables()
+    return module
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def batch_id(app_module):
+    """A fresh recipe, panel type and batch of 100 panels."""
+    with app_module.app.app_context():
+        recipe = app_module.Recipe(name='Fixture recipe', cement_percent=7.0, plastic_percent=5.0)
+        panel = app_module.PanelType(name='Fixture panel', target_strength_mpa=20.0)
+        app_module.db.session.add_all([recipe, panel])
+        app_module.db.session.flush()
+        batch = app_module.Batch(recipe_id=recipe.id, panel_type_id=panel.id, quantity=100)
+        app_module.db.session.add(batch)
+        app_module.db.session.commit()
+        return batch.id
+
+
+@pytest.fixture
+def site_id(app_module):
+    with app_module.app.app_context():
+        site = app_module.PilotSite(name='Fixture site', district='Ranchi', latitude=23.3, longitude=85.3)
+        app_module.db.session.add(site)
+        app_module.db.session.commit()
+        return site.id
@@ -0,0 +1,38 @@
+"""A report re-sent with the same Idempotency-Key is stored once and answered with the original row."""
+import json
+import uuid
+
+
+def test_qc_report_replay_returns_original_id(app_module, client, batch_id):
+    headers = {'Idempotency-Key': uuid.uuid4().hex}
+    first = client.post('/api/report_qc', json={'batch_id': batch_id, 'compressive_mpa': 22.0}, headers=headers)
+    again = client.post('/api/report_qc', json={'batch_id': batch_id, 'compressive_mpa': 22.0}, headers=headers)
+    assert first.status_code == again.status_code == 200
+    assert 'duplicate' not in first.get_json()
+    assert again.get_json() == {'status': 'ok', 'id': first.get_json()['id'], 'duplicate': True}
+    with app_module.app.app_context():
+        assert app_module.QCTest.query.filter_by(idempotency_key=headers['Idempotency-Key']).count() == 1
+
+
+def test_field_report_replay_returns_original_installation(app_module, client, batch_id, site_id):
+    key = uuid.uuid4().hex
+    body = {'site_id': site_id, 'batch_id': batch_id, 'installed_panels': 5, 'idempotency_key': key}
+    first = client.post('/api/field_report', json=body).get_json()
+    again = client.post('/api/field_report', json=body).get_json()
+    assert again == {'status': 'ok', 'installation_id': first['installation_id'], 'duplicate': True}
+    with app_module.app.app_context():
+        assert app_module.db.session.get(app_module.SiteStock, site_id).installed == 5
+
+
+def test_bulk_rows_with_stored_keys_are_duplicates(app_module, client, batch_id):
+    key = uuid.uuid4().hex
+    stored = client.post('/api/report_qc', json={'batch_id': batch_id, 'idempotency_key': key}).get_json()['id']
+    rows = [{'batch_id': batch_id, 'compressive_mpa': 21.0, 'idempotency_key': k} for k in (key, key + '-b', key + '-b')]
+    resp = client.post('/api/report_qc/bulk', data='\n'.join(json.dumps(r) for r in rows),
+                       content_type='application/x-ndjson')
+    assert resp.status_code == 200
+    results = resp.get_json()['results']
+    assert results[0] == {'row': 1, 'status': 'ok', 'id': stored, 'duplicate': True}
+    assert results[2]['duplicate'] is True
+    with app_module.app.app_context():
+        assert app_module.QCTest.query.filter_by(idempotency_key=key + '-b').count() == 1
@@ -0,0 +1,79 @@
+"""Queue mode (INGEST_MODE=queue): reports are validated, acknowledged with 202 and applied by drain_once()."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+
+@pytest.fixture
+def queue_mode(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'INGEST_MODE', 'queue')
+    # the tests drain the queue themselves instead of racing background workers
+    monkeypatch.setattr(app_module.ingest_workers, 'start', lambda: None)
+    with app_module.app.app_context():
+        while app_module.drain_once():  # reports left queued by an earlier test
+            pass
+    return app_module
+
+
+def report(module, report_id):
+    with module.app.app_context():
+        return module.db.session.get(module.IngestReport, report_id)
+
+
+def test_report_is_acknowledged_then_applied(queue_mode, client, batch_id):
+    resp = client.post('/api/report_qc', json={'batch_id': batch_id, 'compressive_mpa': 23.5})
+    assert resp.status_code == 202
+    body = resp.get_json()
+    assert body['status'] == 'accepted'
+    assert client.get(body['status_url']).get_json()['state'] == 'queued'
+
+    with queue_mode.app.app_context():
+        assert queue_mode.drain_once() == 1
+    status = client.get(body['status_url']).get_json()
+    assert status['state'] == 'done'
+    with queue_mode.app.app_context():
+        assert queue_mode.db.session.get(queue_mode.QCTest, status['result_id']).compressive_mpa == 23.5
+
+
+def test_invalid_report_is_refused_before_queueing(queue_mode, client, batch_id):
+    with queue_mode.app.app_context():
+        queued = queue_mode.IngestReport.query.count()
+    resp = client.post('/api/report_qc', json={'batch_id': batch_id, 'compressive_mpa': 'abc'})
+    assert resp.status_code == 400
+    with queue_mode.app.app_context():
+        assert queue_mode.IngestReport.query.count() == queued
+
+
+def test_transient_errors_are_retried_until_max_attempts(queue_mode, client, batch_id, monkeypatch):
+    monkeypatch.setitem(queue_mode.app.config, 'INGEST_MAX_ATTEMPTS', 3)
+    report_id = client.post('/api/report_qc', json={'batch_id': batch_id}).get_json()['report_id']
+
+    def locked(reports):
+        raise OperationalError('INSERT', {}, Exception('database is locked'))
+    monkeypatch.setattr(queue_mode, '_apply_reports', locked)
+    for attempt in (1, 2):
+        with queue_mode.app.app_context():
+            queue_mode.drain_once()
+            r = queue_mode.db.session.get(queue_mode.IngestReport, report_id)
+            assert (r.state, r.attempts) == ('queued', attempt)
+            assert r.next_attempt_at > datetime.utcnow()
+            r.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)  # due again now
+            queue_mode.db.session.commit()
+    with queue_mode.app.app_context():
+        queue_mode.drain_once()
+    r = report(queue_mode, report_id)
+    assert (r.state, r.attempts) == ('failed', 3)
+    assert 'database is locked' in r.error
+
+
+def test_permanent_errors_fail_at_once(queue_mode, client, batch_id, monkeypatch):
+    report_id = client.post('/api/report_qc', json={'batch_id': batch_id}).get_json()['report_id']
+
+    def misfit(reports):
+        raise ValueError('payload does not fit')
+    monkeypatch.setattr(queue_mode, '_apply_reports', misfit)
+    with queue_mode.app.app_context():
+        queue_mode.drain_once()
+    r = report(queue_mode, report_id)
+    assert (r.state, r.attempts, r.error) == ('failed', 1, 'payload does not fit')
@@ -0,0 +1,20 @@
+"""Inventory ledger: installing more panels than a batch has left in the yard is flagged, not refused."""
+
+
+def test_overdraw_warning(app_module, client, batch_id, site_id):
+    first = client.post('/api/field_report', json={'site_id': site_id, 'batch_id': batch_id, 'installed_panels': 80})
+    assert first.status_code == 200
+    assert 'warning' not in first.get_json()
+
+    # a numeric string is taken as a number
+    over = client.post('/api/field_report', json={'site_id': site_id, 'batch_id': batch_id, 'installed_panels': '30'})
+    assert over.status_code == 200
+    assert over.get_json()['warning'] == 'installing 30 panels over-draws batch %d (20 left in the yard)' % batch_id
+
+    stock = client.get('/api/inventory/batches/%d' % batch_id).get_json()
+    assert (stock['produced'], stock['installed']) == (100, 110)
+
+
+def test_installed_panels_must_be_a_whole_number(client, batch_id, site_id):
+    resp = client.post('/api/field_report', json={'site_id': site_id, 'batch_id': batch_id, 'installed_panels': 'five'})
+    assert resp.status_code == 400
@@ -0,0 +1,43 @@
+"""Per-district databases: requests routed by X-District, reads that would span them, and the catalog copy."""
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def district(app_module, monkeypatch, tmp_path):
+    """A district with its own database; names are unique because opened engines are kept by key."""
+    monkeypatch.setitem(app_module.app.config, 'PARTITION_DIR', str(tmp_path))
+    name = 'District %s' % uuid.uuid4().hex[:8]
+    with app_module.app.app_context():
+        app_module.partitions.engine(app_module.partition_key(name))
+    return name
+
+
+def _site_names(client, **headers):
+    return {s['name'] for s in client.get('/api/sites?limit=500', headers=headers).get_json()['items']}
+
+
+def test_new_site_goes_to_its_district(client, district):
+    resp = client.post('/sites/new', data={'name': 'Hill plot', 'district': district})
+    assert resp.status_code == 302
+    assert 'district=' in resp.headers['Location']
+    assert 'Hill plot' in _site_names(client, **{'X-District': district})
+    assert 'Hill plot' not in _site_names(client, **{'X-District': 'Nowhere'})
+
+
+def test_single_database_reads_need_a_district(client, district):
+    assert client.get('/api/analytics/batches').status_code == 400
+    assert client.get('/api/analytics/batches', headers={'X-District': district}).status_code == 200
+    # a district without a database reads the main one
+    assert client.get('/api/analytics/batches?district=Nowhere').status_code == 200
+
+
+def test_catalog_changes_reach_districts(app_module, client, district):
+    name = 'Recipe %s' % uuid.uuid4().hex[:8]
+    assert client.post('/recipes/new', data={'name': name, 'cement': '6'}).status_code == 302
+    app_module.catalog_pusher.queue.join()
+    with app_module.partition_context(app_module.partition_key(district)):
+        copied = app_module.Recipe.query.filter_by(name=name).one()
+    with app_module.app.app_context():
+        assert copied.id == app_module.Recipe.query.filter_by(name=name).one().id
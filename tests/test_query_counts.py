@@ -0,0 +1,45 @@
+"""Pin the number of SQL statements list pages issue, so an N+1 lazy load fails CI.
+
+Pages report their statement count in X-SQL-Queries when SQL_QUERY_STATS is on; the
+count must not grow with the number of rows shown.
+"""
+import pytest
+
+
+def add_rows(module, batches, tests_per_batch):
+    with module.app.app_context():
+        recipe = module.Recipe(name='Test recipe %d' % batches, cement_percent=7.0, plastic_percent=5.0)
+        panel = module.PanelType(name='Test panel %d' % batches, target_strength_mpa=20.0)
+        module.db.session.add_all([recipe, panel])
+        module.db.session.flush()
+        for _ in range(batches):
+            batch = module.Batch(recipe_id=recipe.id, panel_type_id=panel.id, quantity=100)
+            module.db.session.add(batch)
+            module.db.session.flush()
+            module.db.session.add_all([module.QCTest(batch_id=batch.id, compressive_mpa=24.0, flexural_mpa=4.0)
+                                       for _ in range(tests_per_batch)])
+        module.db.session.commit()
+
+
+def query_count(client, url):
+    resp = client.get(url)
+    assert resp.status_code == 200
+    return int(resp.headers['X-SQL-Queries'])
+
+
+@pytest.mark.parametrize('url', ['/batches', '/qc', '/qc/new'])
+def test_query_count_does_not_grow_with_rows(app_module, url):
+    client = app_module.app.test_client()
+    add_rows(app_module, 2, 1)
+    client.get('/')  # first request creates tables and warms per-process state
+    few = query_count(client, url)
+    add_rows(app_module, 20, 3)
+    assert query_count(client, url) == few
+
+
+@pytest.mark.parametrize('url, expected', [('/batches', 1), ('/qc', 1)])
+def test_list_pages_use_one_query(app_module, url, expected):
+    client = app_module.app.test_client()
+    add_rows(app_module, 5, 2)
+    client.get('/')
+    assert query_count(client, url) == expected
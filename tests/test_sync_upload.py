@@ -0,0 +1,49 @@
+"""Offline sync uploads: malformed bodies are refused with 400 and re-sent items are not stored twice."""
+import uuid
+
+import pytest
+
+
+@pytest.mark.parametrize('body', [
+    [],
+    [{'idempotency_key': 'a'}],
+    {'installations': 5},
+    {'qc_tests': 'x'},
+    {'qc_tests': [5]},
+    {'qc_tests': [{'batch_id': 1}]},
+])
+def test_malformed_body_is_400(client, body):
+    resp = client.post('/api/sync/upload', json=body)
+    assert resp.status_code == 400
+    assert resp.get_json()['status'] == 'error'
+
+
+def test_invalid_items_are_listed_and_nothing_stored(app_module, client, batch_id):
+    key = uuid.uuid4().hex
+    resp = client.post('/api/sync/upload', json={
+        'qc_tests': [{'idempotency_key': key, 'batch_id': batch_id, 'compressive_mpa': 'abc'}],
+        'installations': [{'idempotency_key': key + '-i', 'installed_panels': 3}],
+    })
+    assert resp.status_code == 400
+    errors = {(e['list'], e['index']): e['message'] for e in resp.get_json()['errors']}
+    assert errors == {('qc_tests', 0): 'compressive_mpa must be a number', ('installations', 0): 'site_id required'}
+    with app_module.app.app_context():
+        assert app_module.QCTest.query.filter_by(idempotency_key=key).count() == 0
+
+
+def test_resent_items_return_the_first_rows(app_module, client, batch_id, site_id):
+    key = uuid.uuid4().hex
+    body = {
+        'qc_tests': [{'idempotency_key': key, 'batch_id': batch_id, 'compressive_mpa': '21.5'}],
+        'installations': [{'idempotency_key': key, 'site_id': site_id, 'batch_id': batch_id, 'installed_panels': 4}],
+    }
+    first = client.post('/api/sync/upload', json=body).get_json()
+    again = client.post('/api/sync/upload', json=body).get_json()
+    for name in ('qc_tests', 'installations'):
+        assert [i['duplicate'] for i in first[name]] == [False]
+        assert [i['duplicate'] for i in again[name]] == [True]
+        assert again[name][0]['id'] == first[name][0]['id']
+    with app_module.app.app_context():
+        qc = app_module.QCTest.query.filter_by(idempotency_key=key).one()
+        assert qc.compressive_mpa == 21.5
+        assert app_module.Installation.query.filter_by(idempotency_key=key).count() == 1